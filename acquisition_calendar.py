@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Predict the scenes of the wrs2 archive that can match a field site from the Landsat acquisition calendar rather than
+walking the whole archive tree. Landsat 7 and 8 each image a path every 16 days, the field site layer (joined to the
+WRS-2 path/row layer) carries the day of the 16 day cycle each path is imaged on (ACQDayL7, ACQDayL8). The cycle days
+are counted from CALENDAR_EPOCH (cycle day 1), so the acquisition dates within a site's search window are known and
+the expected scene paths can be built from the archive layout and naming convention:
+
+    <wrs2>/103_077/2018/201807/l7tmre_p103r077_20180725_dilm3_zstdmask.img
+
+Each candidate is checked with a stat call, on a thread pool so the network round trips overlap, and only the
+candidates that exist are returned. A single season run makes a few hundred targeted lookups rather than listing every
+directory of the archive. The candidate names are filtered with the same file name pattern used to list the archive
+(e.g. *dilm[2-4]_zstdmask.img).
+
+Sites without a cycle day for a sensor (0 or missing) get a candidate for every day of their search window.
+
+e.g.
+    python acquisition_calendar.py -s nt_rm_fieldSite_2021_wrs2sj_buff.shp -d Z:/Landsat/wrs2 -n 15 -o imglist_dil.csv
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import csv
+import fnmatch
+import argparse
+import datetime
+import concurrent.futures
+import pandas as pd
+from run_report import report
+
+
+# cycle day 1 of the 16 day acquisition calendar
+CALENDAR_EPOCH = datetime.date(2018, 7, 18)
+
+CYCLE_DAYS = 16
+
+# scene file name prefix of each sensor and the site layer field holding its cycle day
+SENSORS = [('l7tmre', 'ACQDayL7'), ('l8olre', 'ACQDayL8')]
+
+# the dilm zones the scenes of a path/row can be delivered in
+ZONES = [2, 3, 4]
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""List the scenes of the wrs2 archive acquired within a number of days of each field site measured date, predicted from the acquisition calendar and checked with stat calls rather than by walking the archive.""")
+
+    p.add_argument("-s","--shape", help="field site shape file with the Date, PATH, ROW, ACQDayL7 and ACQDayL8 fields")
+
+    p.add_argument("-d","--direc", help="path to the wrs2 directory")
+
+    p.add_argument("-e","--endfilen", default="*dilm[2-4]_zstdmask.img", help="end of the scene file names to list (default is %(default)s)")
+
+    p.add_argument("-n","--days", type=int, default=15, help="number of days either side of the field site measured date (default is %(default)s)")
+
+    p.add_argument("-w","--workers", type=int, default=16, help="number of stat calls made at the same time (default is %(default)s)")
+
+    p.add_argument("-o","--txtfile", help="name of the output csv file containing the list of scenes found")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file containing the timing and counts (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.shape is None or cmdargs.direc is None or cmdargs.txtfile is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def cycleDay(date, epoch=CALENDAR_EPOCH):
+    """
+    day (1 to 16) of the acquisition cycle the date falls on
+    """
+    return (pd.Timestamp(date).date() - epoch).days % CYCLE_DAYS + 1
+
+
+def acquisitionDates(cycle_day, start, end, epoch=CALENDAR_EPOCH):
+    """
+    dates between start and end (inclusive) falling on the cycle day, every date if the cycle day is not known
+    """
+    dates = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize())
+    if pd.isnull(cycle_day) or int(cycle_day) < 1:
+        return list(dates)
+    return [d for d in dates if cycleDay(d, epoch) == int(cycle_day)]
+
+
+def candidatePaths(root, sensor, path, row, dates, endfilename, zones=ZONES):
+    """
+    expected archive paths of the scenes of the sensor for the path/row and dates, filtered by the file name pattern
+    """
+    candidates = []
+    for date in dates:
+        dirname = os.path.join(root, '%03d_%03d' % (path, row), date.strftime('%Y'), date.strftime('%Y%m'))
+        for zone in zones:
+            name = '%s_p%03dr%03d_%s_dilm%s_zstdmask.img' % (sensor, path, row, date.strftime('%Y%m%d'), zone)
+            if fnmatch.fnmatch(name, endfilename):
+                candidates.append(os.path.join(dirname, name))
+    return candidates
+
+
+def siteCandidates(sd, root, endfilename, epoch=CALENDAR_EPOCH, zones=ZONES):
+    """
+    candidate scene paths of every site of the site layer (with the bck_date and fwd_date search window of
+    cal_val_extract.readSiteLayer), in site order without duplicates
+    """
+    candidates = []
+    for index, row in sd.iterrows():
+        for sensor, field in SENSORS:
+            cycle_day = row[field] if field in sd.columns else None
+            dates = acquisitionDates(cycle_day, row['bck_date'], row['fwd_date'], epoch)
+            candidates += candidatePaths(root, sensor, int(row['PATH']), int(row['ROW']), dates, endfilename, zones)
+
+    return list(dict.fromkeys(candidates))
+
+
+def existingScenes(candidates, workers=16):
+    """
+    the candidates that exist, checked with stat calls on a thread pool, in the order of the candidates
+    """
+    with report.stage('calendar_stat'), concurrent.futures.ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        found = list(executor.map(os.path.isfile, candidates))
+
+    report.count('calendar_candidates', len(candidates))
+    report.count('files_matched', sum(found))
+
+    return [img for img, exists in zip(candidates, found) if exists]
+
+
+def calendarScenes(sd, root, endfilename, workers=16, epoch=CALENDAR_EPOCH, zones=ZONES):
+    """
+    the archive scenes acquired within the search window of the sites, predicted from the acquisition calendar
+    """
+    with report.stage('calendar_candidates'):
+        candidates = siteCandidates(sd, root, endfilename, epoch, zones)
+
+    list_img = existingScenes(candidates, workers)
+    print ('calendar candidates: ', len(candidates), ' scenes found: ', len(list_img))
+
+    return list_img
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+
+    # the site search windows are the same as the extraction
+    from cal_val_extract import readSiteLayer
+    sd = readSiteLayer(cmdargs.shape, cmdargs.days)
+
+    list_img = calendarScenes(sd, cmdargs.direc, cmdargs.endfilen, cmdargs.workers)
+
+    with open(cmdargs.txtfile, "w") as output:
+        writer = csv.writer(output, lineterminator='\n')
+        for file in list_img:
+            writer.writerow([file])
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
+
+
+if __name__ == "__main__":
+    mainRoutine()
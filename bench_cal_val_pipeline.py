@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the cal/val workflow on synthetic data. The script generates a wrs2 style directory tree of DIL scenes, a
+field site polygon layer and observational transect data (synthetic_cal_val_data.py) at several data sizes and times
+the stages of the workflow:
+
+    listdir       - list_of_files_multi_dir_fnmatch.listdir over the wrs2 tree (images/s)
+    match         - site/image matching within the day range of the field date (sites/s)
+    zonal         - zonal_stats_single_cal_val_local.applyZonalstats for every band of every image (images/s, sites/s)
+    zonal_label   - as zonal with the label raster engine (zonal_engine.py)
+    frac_calcs    - intercept classification and cover indices of frac_calcs_rm_field_obs_sheets (sheets/s)
+
+The wall time reported is the best of the repeats, the peak memory is the python heap peak (tracemalloc) and the
+resident set size of the process when psutil is installed.
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import io
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import synthetic_cal_val_data as synth
+from list_of_files_multi_dir_fnmatch import listdir
+from zonal_stats_single_cal_val_local import applyZonalstats
+import cal_val_extract
+import frac_calcs_rm_field_obs_sheets as frac_calcs
+
+
+# number of images, sites, scene width/height in pixels and observational spreadsheets for each benchmark size
+SIZES = {'small': {'images': 4, 'sites': 10, 'pixels': 500, 'sheets': 10},
+         'medium': {'images': 16, 'sites': 50, 'pixels': 1000, 'sheets': 50},
+         'large': {'images': 32, 'sites': 200, 'pixels': 1500, 'sheets': 200}}
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Benchmark the file listing, zonal stats, site/image matching and fractional cover calculations on synthetic data.""")
+
+    p.add_argument("-s","--sizes", default="small,medium", help="comma separated list of benchmark sizes to run from %s (default is %%(default)s)" % ', '.join(SIZES))
+
+    p.add_argument("-r","--repeats", type=int, default=3, help="number of times each stage is timed, the best time is reported (default is %(default)s)")
+
+    p.add_argument("-d","--direc", default=None, help="directory to write the synthetic data into, a temp dir is used and removed if not given")
+
+    p.add_argument("-f","--format", default="HFA", help="raster driver of the synthetic scenes, HFA (ERDAS Imagine) or GTiff (default is %(default)s)")
+
+    p.add_argument("-o","--csv", default=None, help="name of the output csv file containing the benchmark results")
+
+    cmdargs = p.parse_args()
+
+    return cmdargs
+
+
+def rss():
+    """
+    return the resident set size of the process in bytes or None if psutil is not installed
+    """
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def timeStage(func, repeats, *args):
+    """
+    run func repeats times with the output of the print statements suppressed and return the best wall time, then run
+    it once more under tracemalloc to get the peak python memory.
+    """
+    best = None
+
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    rss_before = rss()
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss()
+
+    rss_mb = None if rss_after is None else rss_after / 1e6
+    rss_growth = None if rss_after is None else (rss_after - rss_before) / 1e6
+
+    return best, peak / 1e6, rss_mb, rss_growth
+
+
+def runZonal(images, shape, engine='rasterstats', nodata=0, param=False):
+    """
+    derive the zonal stats for every band of every image as zonal_stats_single_cal_val_local.mainRoutine does
+    """
+    for image in images:
+        for band in range(1, synth.NUM_BANDS + 1):
+            applyZonalstats(image, param, nodata, band, shape, engine=engine)
+
+
+def runMatch(list_img, shape, number_of_days=15):
+    """
+    build the image list dataframe and match each field site to the images within the day range
+    """
+    df = cal_val_extract.imageListDf(list_img)
+    sd = cal_val_extract.readSiteLayer(shape, number_of_days)
+    return cal_val_extract.matchSiteImages(sd, df)
+
+
+def runFracCalcs(intercepts):
+    """
+    classify the transect intercepts and calculate the cover indices as frac_calcs_rm_field_obs_sheets.mainRoutine does
+    """
+    appended_data = intercepts.copy()
+    appended_data['fpc'] = appended_data.apply(frac_calcs.FPC, axis=1)
+    appended_data['ppc'] = appended_data.apply(frac_calcs.PPC, axis=1)
+    appended_data['cc'] = appended_data.apply(frac_calcs.CC, axis=1)
+    appended_data['ob'] = appended_data.apply(frac_calcs.OB, axis=1)
+    appended_data['pvg'] = appended_data.apply(frac_calcs.groundGreen, axis=1)
+    appended_data['npvg'] = appended_data.apply(frac_calcs.groundNPV, axis=1)
+    appended_data['bgg'] = appended_data.apply(frac_calcs.groundBare, axis=1)
+    appended_data['pv'] = appended_data.apply(frac_calcs.pv, axis=1)
+    appended_data['npv'] = appended_data.apply(frac_calcs.npv, axis=1)
+    appended_data['bg'] = appended_data.apply(frac_calcs.bg, axis=1)
+
+    return frac_calcs.CoverIndices(appended_data)
+
+
+def benchSize(name, size, root, repeats, driver):
+    """
+    generate the synthetic data for one benchmark size and time each stage, returns a list of result rows
+    """
+    direc = os.path.join(root, name)
+    wrs2 = os.path.join(direc, 'wrs2')
+
+    print ('generating synthetic data: ', name, size)
+    images = synth.makeWrs2Tree(wrs2, size['images'], size['pixels'], size['pixels'], driver=driver)
+    shape = synth.makeSiteLayer(os.path.join(direc, 'sites', 'synthetic_fieldSite_wrs2_buff.shp'), size['sites'], images,
+                                size['pixels'], size['pixels'])
+    intercepts = synth.makeObsIntercepts(size['sheets'])
+
+    list_img = images['image'].tolist()
+    results = []
+
+    stages = [('listdir', listdir, (wrs2, '*dilm[2-4]_zstdmask.img'), size['images'], 'images/s'),
+              ('match', runMatch, (list_img, shape), size['sites'], 'sites/s'),
+              ('zonal', runZonal, (list_img, shape), size['images'], 'images/s'),
+              ('zonal_label', runZonal, (list_img, shape, 'label'), size['images'], 'images/s'),
+              ('frac_calcs', runFracCalcs, (intercepts,), size['sheets'], 'sheets/s')]
+
+    for stage, func, args, units, label in stages:
+        elapsed, peak, rss_mb, rss_growth = timeStage(func, repeats, *args)
+        throughput = units / elapsed if elapsed > 0 else float('inf')
+        row = {'size': name, 'stage': stage, 'units': units, 'seconds': elapsed, 'throughput': throughput,
+               'throughput_units': label, 'peak_py_mb': peak, 'rss_mb': rss_mb, 'rss_growth_mb': rss_growth}
+
+        # the zonal stage is also reported per site as each site is processed for every image
+        if stage.startswith('zonal'):
+            row['sites_per_s'] = size['sites'] * size['images'] / elapsed
+
+        print ('%-8s %-11s %8.3f s  %10.1f %s  peak %.1f MB' % (name, stage, elapsed, throughput, label, peak))
+        results.append(row)
+
+    return results
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+    sizes = [s.strip() for s in cmdargs.sizes.split(',') if s.strip()]
+
+    for name in sizes:
+        if name not in SIZES:
+            print ('unknown benchmark size: ', name)
+            sys.exit(1)
+
+    root = cmdargs.direc if cmdargs.direc is not None else tempfile.mkdtemp(prefix='cal_val_bench_')
+
+    try:
+        results = []
+        for name in sizes:
+            results.extend(benchSize(name, SIZES[name], root, cmdargs.repeats, cmdargs.format))
+            print ('--------------------------------------------------')
+    finally:
+        if cmdargs.direc is None:
+            shutil.rmtree(root)
+
+    output = pd.DataFrame(results)
+    print (output.to_string(index=False))
+
+    if cmdargs.csv is not None:
+        output.to_csv(cmdargs.csv, index=False)
+
+
+if __name__ == "__main__":
+    mainRoutine()
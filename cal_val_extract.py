@@ -0,0 +1,811 @@
+#!/usr/bin/env python
+
+"""
+Match the field sites to the available fractional cover imagery within a given day range of the field site measured
+date and extract out the zonal statistics for each band of the matched images to produce a single csv file. This is the
+workflow of the cal_val_stats_local_data_shpfile notebook as a script, the zonal stats are run in the same process
+(zonal_stats_single_cal_val_local.imageZonalstats) rather than calling the script once per image.
+
+A run report with the time spent in each stage, the raster open counts, bytes read per image and the latency of each
+(site, image) job is written next to the output csv.
+
+The results of each job and a manifest of the completed and failed jobs are kept in <output>_temp_individual_results
+next to the output csv. Rerunning the same command after a crash skips the completed jobs and retries the failed ones, use --fresh
+to remove the previous results and start again. The jobs completed with other zonal stats options (e.g. --engine,
+--alltouch, --nodata or --percentiles) are run again.
+
+With --cache-dir the matched scenes are copied from the archive onto local disk (scene_cache.py) a few images ahead of
+the job being run, and read from the local copy. The cache is kept between runs, bounded by --cache-size.
+
+With --chips the pixels around each site are saved for every matched image (chip_cube.py) so the stats can be derived
+again later without the scenes.
+
+With an image catalogue (list_of_files_multi_dir_fnmatch.py -m) as the image list the matched images are pruned to the
+scenes whose footprint covers the site, and each site is reprojected to the crs recorded for its scenes rather than the
+one given by the dilm zone of the file name.
+
+With --calendar the scenes are not listed by walking the whole -d directory, the scenes acquired within the search window
+of each site are predicted from the acquisition calendar of its path (acquisition_calendar.py) and checked with stat calls.
+
+With --min-valid the number of valid pixels of the site is counted in one band of the site window read for each job,
+before the stats are derived, and the jobs where every site polygon has fewer valid pixels (e.g. the site is cloud or
+shadow masked) are skipped and recorded as skipped in the job manifest rather than extracted and filtered out later.
+
+With --work-queue the outstanding jobs are published to a shared SQLite work queue (work_queue.py) on the common file
+system rather than run here, worker processes on any number of hosts (queue_worker.py) claim and run them, and the
+results are collected once every job is finished.
+
+With --readers the jobs are streamed through job_pipeline.py, reader threads read the site windows of the next jobs
+while worker threads derive the stats of the windows already read and the results are written as they complete.
+
+With --memory-budget the GDAL block cache is given a share of the budget (--cache-fraction), the first job is run on its
+own to measure its peak memory and the number of --readers, --workers and --queue slots is reduced to what fits in the
+rest of the budget (memory_budget.py). The readers wait before reading a job while the process is near the budget.
+Without --readers only the GDAL cache is budgeted, the jobs are run one at a time.
+
+e.g.
+    python cal_val_extract.py -s nt_rm_fieldSite_2021_wrs2sj_buff.shp -l imglist_dil.csv -n 15 -o cal_val_dil_data_2021_results30days.csv
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import shutil
+import json
+import hashlib
+import argparse
+import functools
+import contextlib
+import fiona
+import pandas as pd
+import geopandas as gpd
+from datetime import timedelta
+from list_of_files_multi_dir_fnmatch import listdir
+import zonal_stats_single_cal_val_local
+from zonal_stats_single_cal_val_local import imageZonalstats, readImageWindow, windowZonalstats, validPixelCounts, parseList, parseBuffers, asBool, ENGINES
+from run_report import report
+from job_profiler import JobProfiler
+from job_manifest import JobManifest, retry
+from dataset_pool import DatasetPool, ThreadDatasetPool
+from job_pipeline import JobPipeline
+from scene_cache import SceneCache
+from convert_to_cog import cogPath
+from chip_cube import ChipCube
+from image_catalogue import readImageList, footprint
+from acquisition_calendar import calendarScenes
+from work_queue import WorkQueue
+from memory_budget import setGdalCache, measurePeak, planWorkers, MemoryGate, rss
+from zonal_engine import outerFeatures
+
+
+def addExtractArgs(p):
+    """
+    add the site, image and extraction arguments shared with the multi year driver (cal_val_multi_year.py) to the parser
+    """
+    p.add_argument("-s","--shape", help="field site shape file (e.g. nt_rm_fieldSite_2021_wrs2sj_buff.shp) with the Date, PATH and ROW fields")
+
+    p.add_argument("-l","--imglist", default=None, help="csv file containing the list of images or the image catalogue (-m) produced by list_of_files_multi_dir_fnmatch.py")
+
+    p.add_argument("-d","--direc", default=None, help="path to the wrs2 directory to list the images from if no image list is given")
+
+    p.add_argument("-e","--endfilen", default="*dilm[2-4]_zstdmask.img", help="end of the image file names to list (default is %(default)s)")
+
+    p.add_argument("--archives", action="store_true", help="also list the matching scenes inside tar and zip archives in the wrs2 directory, they are read without being extracted")
+
+    p.add_argument("--calendar", action="store_true", help="with -d predict the scenes acquired within the search window of each site from the acquisition calendar (ACQDayL7, ACQDayL8) and check they exist, rather than listing the whole directory")
+
+    p.add_argument("-n","--days", type=int, default=15, help="number of days either side of the field site measured date to extract stats from (default is %(default)s)")
+
+    p.add_argument("-u","--uid", default="uid_2", help="column name of the unique id field in the shapefile (default is %(default)s)")
+
+    p.add_argument("--nodata", type=int, default=0, help="no data value of the imagery (default is %(default)s)")
+
+    p.add_argument("-a","--alltouch", type=asBool, default=False, help="select either True of False, True will increase the number of pixels used to produce the stats False reduces the number (default is %(default)s)")
+
+    p.add_argument("--engine", default="rasterstats", choices=ENGINES, help="zonal stats engine, rasterstats masks one polygon at a time, label derives the stats of all the polygons at once from a label raster (default is %(default)s)")
+
+    p.add_argument("--percentiles", default=None, help="comma separated list of percentiles to add to the stats e.g. 10,25,75,90 (default is %(default)s)")
+
+    p.add_argument("--bins", default=None, help="comma separated list of histogram bin edges to count the pixel values into e.g. 100,120,140,160,180,200 (default is %(default)s)")
+
+    p.add_argument("-b","--buffers", default=None, help="comma separated list of buffer distances in metres to add the stats of the buffered site polygons for, from the same window read e.g. 30,60, a list starting with a negative (shrinking) distance needs the = form e.g. -b=-30,30,60 (default is %(default)s)")
+
+    p.add_argument("--shrink", default=None, help="comma separated list of distances in metres to shrink the site polygons by and add the stats of, as --buffers with the negative distances e.g. 30 (default is %(default)s)")
+
+    p.add_argument("--rings", action="store_true", help="with --buffers derive the stats of the rings between the sorted buffer distances rather than of the whole buffered polygons")
+
+    p.add_argument("--shifts", type=int, default=0, help="add the spread of the band means of the site polygons shifted by up to this many whole pixels in x and y, to flag sites sensitive to geolocation error (default is %(default)s)")
+
+    p.add_argument("--min-valid", type=int, default=0, help="skip the (site, image) jobs where no site polygon has at least this many valid pixels in the --valid-band, counted in the window read before the stats are derived e.g. 9, 0 runs every job (default is %(default)s)")
+
+    p.add_argument("--valid-band", type=int, default=1, help="with --min-valid the band the valid pixels are counted in (default is %(default)s)")
+
+    p.add_argument("--no-cog", action="store_true", help="read the scenes themselves even if there are COG copies of them made by convert_to_cog.py")
+
+    p.add_argument("-m","--max-open", type=int, default=16, help="maximum number of images kept open between jobs, the least recently used image is closed (default is %(default)s)")
+
+    p.add_argument("--cache-dir", default=None, help="local directory to stage the scenes into from the archive before they are read, not used if not given (default is %(default)s)")
+
+    p.add_argument("--cache-size", type=float, default=50, help="maximum size of the scene cache in GB, the least recently used scenes are removed (default is %(default)s)")
+
+    p.add_argument("--prefetch", type=int, default=4, help="number of threads staging scenes into the cache ahead of the jobs (default is %(default)s)")
+
+    p.add_argument("--chips", default=None, help="chip cube directory to save the pixels around each site for each matched image into, the stats can be derived again from it with chip_cube.py (default is %(default)s)")
+
+    p.add_argument("--margin", type=int, default=10, help="with --chips the number of pixels around the site polygons saved in each chip (default is %(default)s)")
+
+    p.add_argument("--readers", type=int, default=0, help="number of threads reading the site windows ahead of the zonal stats, 0 runs each job's read, stats and write in turn (default is %(default)s)")
+
+    p.add_argument("--workers", type=int, default=2, help="with --readers the number of threads deriving the zonal stats of the windows read (default is %(default)s)")
+
+    p.add_argument("--queue", type=int, default=8, help="with --readers the number of jobs that can wait between the read, stats and write stages, this bounds the memory used (default is %(default)s)")
+
+    p.add_argument("--memory-budget", type=float, default=0, help="memory in GB the run should keep within, sets the GDAL cache size and limits the readers, workers and queue of --readers to fit, 0 does not budget (default is %(default)s)")
+
+    p.add_argument("--cache-fraction", type=float, default=0.25, help="with --memory-budget the fraction of the budget given to the GDAL block cache (default is %(default)s)")
+
+    p.add_argument("--work-queue", default=None, help="path of a shared work queue database to publish the jobs to for queue_worker.py processes to run, rather than running them here (default is %(default)s)")
+
+    p.add_argument("--lease", type=float, default=600, help="with --work-queue the seconds a worker holds a job for without renewing its lease, stored with each published job (default is %(default)s)")
+
+    p.add_argument("--poll", type=float, default=30, help="with --work-queue the seconds between checks for the jobs being finished (default is %(default)s)")
+
+    p.add_argument("--retries", type=int, default=3, help="number of attempts for each job before it is recorded as failed, every job is attempted at least once (default is %(default)s)")
+
+    p.add_argument("--backoff", type=float, default=5.0, help="seconds to wait before the first retry of a failed job, doubled for each further attempt, with --work-queue a failed job is not claimed again until then (default is %(default)s)")
+
+    p.add_argument("--fresh", action="store_true", help="remove the results and job manifest of a previous run and start again")
+
+    p.add_argument("-p","--profile", action="store_true", help="profile each (site, image) job with cProfile and save the profiles next to the run report")
+
+    p.add_argument("--slowest", type=int, default=0, help="with --profile only save the profiles of the slowest N jobs, 0 saves every job (default is %(default)s)")
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Match the field sites to the imagery captured within a number of days of the field site measured date and extract out the zonal stats for each band of the matched images into a single csv file.""")
+
+    addExtractArgs(p)
+
+    p.add_argument("-o","--csv", help="name of the output csv file containing the results")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file, defaults to the output csv name ending in _run_report.json")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.shape is None or cmdargs.csv is None or (cmdargs.imglist is None and cmdargs.direc is None):
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def imageListDf(list_img, catalogue=None):
+    """
+    convert the list of images returned by list_of_files_multi_dir_fnmatch.listdir to a dataframe with the path row,
+    image date and zone taken from the image file name e.g. l7tmre_p103r077_20180725_dilm3_zstdmask.img. The crs and
+    bounds of each image are added from the image catalogue if one is given.
+    """
+    df = pd.DataFrame({'image': [str(x) for x in list_img]})
+
+    # get the path row and image date from the image file name
+    df['path_row'] = df['image'].map(lambda x: x[-35:-32]) + '_' + df['image'].map(lambda x: x[-31:-28])
+    df['img_date'] = df['image'].map(lambda x: x[-27:-23]) + '-' + df['image'].map(lambda x: x[-23:-21]) + '-' + df['image'].map(lambda x: x[-21:-19])
+    df['zone'] = df['image'].map(lambda x: x[-14:-13])
+    df['img_dt'] = pd.to_datetime(df['img_date'], yearfirst=True, dayfirst=False)
+
+    if catalogue is not None:
+        df = df.merge(catalogue[['image', 'crs', 'left', 'bottom', 'right', 'top']].astype({'image': str}), on='image', how='left')
+
+    return df
+
+
+def readSiteLayer(shape, number_of_days):
+    """
+    read in the field site shape file and produce the date_time and the plus and minus date range to search for
+    imagery either side of the field site measured date.
+    """
+    sd = gpd.read_file(shape)
+    sd['date_time'] = pd.to_datetime(sd['Date'], yearfirst=False, dayfirst=True)
+
+    sd['fwd_date'] = sd['date_time'] + timedelta(days=abs(number_of_days))
+    sd['bck_date'] = sd['date_time'] + timedelta(days=-abs(number_of_days))
+
+    return sd
+
+
+def matchSiteImages(sd, df, uid='uid_2'):
+    """
+    find the images with the same path row as each site and an image date within the site search date range, returns
+    a dataframe with one row per (site, image) job covering all the polygons of the site. If the images have catalogue
+    bounds (imageListDf) the images whose footprint does not cover the site are dropped, and the crs of each image is
+    kept for reprojecting the site.
+    """
+    jobs = []
+    catalogue = 'crs' in df.columns
+
+    for index, row in sd.iterrows():
+
+        # get the info to create the path row of the imagery
+        path_row = str(row['PATH']) + '_0' + str(row['ROW'])
+
+        dfs = df[(df['path_row'] == path_row)]
+        imgS = dfs[dfs['img_dt'].isin(pd.date_range(row['bck_date'], row['fwd_date']))]
+
+        # the site reprojected once per crs of its images
+        site = {}
+
+        for img_index, img in imgS.iterrows():
+            crs = img['crs'] if catalogue and isinstance(img['crs'], str) else ''
+            bounds = footprint(img) if crs else None
+            if bounds is not None:
+                if crs not in site:
+                    site[crs] = gpd.GeoSeries([row.geometry], crs=sd.crs).to_crs(crs).iloc[0]
+                if not bounds.intersects(site[crs]):
+                    report.count('jobs_pruned_footprint')
+                    continue
+            jobs.append([row[uid], img['image'], img['zone'], img_index, crs])
+
+    # the rows of a site with several polygons match the same images
+    jobs = pd.DataFrame(jobs, columns=['uid', 'image', 'zone', 'img_index', 'crs'])
+    return jobs.drop_duplicates(['uid', 'image']).reset_index(drop=True)
+
+
+def siteShapefile(sda, zone, tempshp, siteN, crs=''):
+    """
+    reproject the site polygon to the same coordinate system as the imagery (the crs from the image catalogue, or from
+    the dilm zone 2 = UTM 52, 3 = UTM 53, 4 = UTM 54) and write it to a temporary shape file for the zonal stats.
+    """
+    sdsr = sda.drop(columns=['date_time', 'fwd_date', 'bck_date']).to_crs(crs if crs else 'EPSG:3275' + str(zone))
+
+    shp_file = os.path.join(tempshp, 'temp_' + str(siteN) + '_' + str(zone) + '_.shp')
+    sdsr.to_file(shp_file)
+
+    return shp_file
+
+
+def profileJob(profiler, image, sites, **info):
+    """
+    return the profiler context for a job, or a context that does nothing when the run is not being profiled
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.profile(image, sites, **info)
+
+
+def zonalJob(img, shp_file, csv, options, profiler=None, sites=1, siteN=None, cache=None, cube=None, zone=None, min_valid=0, band=1):
+    """
+    extract the zonal stats for a single (site, image) job and write the results to csv, returns the csv file name
+    and the valid pixels of the site (None if they are not counted). options are the keyword arguments of
+    imageZonalstats (param, nodata, percentiles, bins, engine, pool, buffers, rings and shifts). The image is read from
+    its copy in the scene cache if one is given. If a chip cube is given the chip of the site is saved to it and the
+    stats are derived from the chip. With min_valid the valid pixels of the site in the band are counted from the
+    window read for the job, if there are fewer the job is skipped and the csv file name returned is None.
+    """
+    valid = None
+
+    with report.stage('zonal_job', job=img), profileJob(profiler, img, sites, uid=siteN):
+        local = img if cache is None else cache.path(img)
+
+        if cube is None and min_valid <= 0:
+            result = imageZonalstats(local, shape=shp_file, **options)
+        else:
+            with fiona.open(shp_file) as src:
+                features = list(src)
+            window = readImageWindow(local, options['nodata'], outerFeatures(features, options['buffers']), options['pool'],
+                                     max(1 if cube is None else cube.margin, options['shifts'] + 1))
+            if min_valid > 0:
+                valid = validJob(window, features, options, band)
+                if valid < min_valid:
+                    return None, valid
+            if cube is not None:
+                cube.save(siteN, img, zone, window, features)
+            result = windowZonalstats(window, features, options['param'], options['nodata'], options['percentiles'],
+                                      options['bins'], options['engine'], options['buffers'], options['rings'], options['shifts'])
+
+        # write to a temp file first so an interrupted write does not leave a partial result
+        result.to_csv(csv + '.part')
+        os.replace(csv + '.part', csv)
+
+    return csv, valid
+
+
+def validJob(window, features, options, band=1):
+    """
+    the largest number of valid pixels of the site polygons in the band, counted from the window read for the job
+    """
+    with report.stage('valid_count'):
+        counts = validPixelCounts(window, features, band, options['param'])
+    return max(counts) if counts else 0
+
+
+def skipJob(manifest, uid, img, valid, min_valid):
+    """
+    record a job skipped because the site has too few valid pixels in the image
+    """
+    print ('job skipped, %s valid pixels (minimum %s)' % (valid, min_valid))
+    manifest.update(uid, img, 'skipped', attempts=0, error='valid pixels %s < %s' % (valid, min_valid), valid=valid)
+    report.count('jobs_skipped')
+
+
+def jobFailed(manifest, pool, siteN, img, retries, cache, attempt, err):
+    """
+    record a failed attempt of a job in the manifest and close the image so the next attempt opens it again
+    """
+    print ('job failed (attempt %s of %s): %s' % (attempt, retries, err))
+    report.count('job_failed_attempt')
+    manifest.update(siteN, img, 'failed', attempts=attempt, error=repr(err))
+    img = img if cache is None else cache.localPath(img)
+    pool.release(img)
+    pool.release(cogPath(img))
+
+
+def runOrder(jobs):
+    """
+    return the job indexes in the order the jobs are run, by image then site, so the sites sharing a scene are run one
+    after the other while the scene is open in the pool
+    """
+    return list(jobs.sort_values(['image', 'uid'], kind='stable').index)
+
+
+def resultOrder(jobs):
+    """
+    return the job indexes in the order the results are written to the output csv (by site, then by zone)
+    """
+    return [i for siteN, site_jobs in jobs.groupby('uid', sort=False)
+            for zone, zone_jobs in site_jobs.groupby('zone') for i in zone_jobs.index]
+
+
+def resultCsv(tempDir, siteN, image):
+    """
+    name of the csv holding the results of a (site, image) job, from a hash of the image path so the name of a job does
+    not change when the image list does
+    """
+    key = hashlib.sha1(str(image).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempDir, 'results_' + str(siteN) + '_' + key + '.csv')
+
+
+def jobParams(cmdargs, options):
+    """
+    digest of the extraction parameters that change the results of a job (the zonal stats options and the uid field),
+    recorded in the job manifest so the jobs of a run with other parameters are run again
+    """
+    params = dict((k, v) for k, v in options.items() if k != 'pool')
+    params['uid'] = cmdargs.uid
+    text = json.dumps(params, sort_keys=True, default=str)
+    report.info['job_params'] = text
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def outstandingJobs(jobs, sd, uid, manifest, tempDir, tempshp, cache=None, ahead=0):
+    """
+    generate the (site, image) jobs not completed by a previous run in the order they are run (runOrder), writing the
+    site shape file of each (site, zone) when it is first needed and staging the scenes of the next few images into the
+    cache (if one is given). Each job is a dictionary of the uid, image, site shape file, results csv and the number of
+    site polygons.
+    """
+    # skip the jobs completed by a previous run
+    order = [i for i in runOrder(jobs) if not manifest.isDone(jobs.loc[i, 'uid'], jobs.loc[i, 'image'])]
+    report.count('jobs_done_earlier', len(jobs) - len(order))
+
+    # the scenes of the outstanding jobs in the order they are needed
+    upcoming = list(dict.fromkeys(jobs.loc[i, 'image'] for i in order)) if cache is not None else []
+
+    # the crs of each (site, zone) from the image catalogue, and the site shape files written so far
+    crs = dict((key, next((c for c in group['crs'] if c), '')) for key, group in jobs.groupby(['uid', 'zone'], sort=False))
+    shp_files = {}
+
+    for i in order:
+        siteN, img, zone = jobs.loc[i, 'uid'], jobs.loc[i, 'image'], jobs.loc[i, 'zone']
+        sda = sd[(sd[uid] == siteN)]
+
+        if (siteN, zone) not in shp_files:
+            print ('Site name:', sda['Site'].tolist())
+            with report.stage('write_site_shp'):
+                shp_files[(siteN, zone)] = siteShapefile(sda, zone, tempshp, siteN, crs[(siteN, zone)])
+
+        if cache is not None:
+            n = upcoming.index(img)
+            cache.prefetch(upcoming[n + 1:n + 1 + ahead])
+
+        csv = resultCsv(tempDir, siteN, img)
+
+        yield {'uid': siteN, 'image': img, 'zone': zone, 'shp': shp_files[(siteN, zone)], 'csv': csv, 'sites': len(sda)}
+
+
+def readJob(job, options, cache=None, retries=3, backoff=5.0, cube=None, min_valid=0, band=1):
+    """
+    pipeline read stage, stage the scene (if there is a cache) and read the window of the job's site polygons, saving
+    it to the chip cube if one is given. If the site has fewer than min_valid valid pixels in the window read the valid
+    pixel count is kept in the job (job['skipped']) and None is returned.
+    """
+    with fiona.open(job['shp']) as src:
+        features = list(src)
+
+    img = job['image'] if cache is None else cache.path(job['image'])
+
+    def failed(attempt, err):
+        print ('read failed (attempt %s of %s): %s' % (attempt, retries, err))
+        report.count('job_failed_attempt')
+        options['pool'].release(img)
+        options['pool'].release(cogPath(img))
+
+    with report.stage('pipeline_read', job=img):
+        read = functools.partial(readImageWindow, img, options['nodata'], outerFeatures(features, options['buffers']), options['pool'],
+                                 max(1 if cube is None else cube.margin, options['shifts'] + 1))
+        job['attempts'], window = retry(read, retries, backoff, failed)
+
+    if min_valid > 0:
+        valid = validJob(window, features, options, band)
+        if valid < min_valid:
+            job['skipped'] = valid
+            return None
+
+    if cube is not None:
+        cube.save(job['uid'], job['image'], job['zone'], window, features)
+
+    return features, window
+
+
+def computeJob(job, data, options):
+    """
+    pipeline compute stage, the zonal stats of the window read for the job
+    """
+    if data is None:
+        return None
+
+    features, window = data
+    with report.stage('pipeline_compute', job=job['image']):
+        return windowZonalstats(window, features, options['param'], options['nodata'], options['percentiles'],
+                                options['bins'], options['engine'], options['buffers'], options['rings'], options['shifts'])
+
+
+def writeJob(job, result, err, min_valid=0):
+    """
+    pipeline write stage, write the results of the job to its csv and record the job in its manifest
+    """
+    print (job['image'])
+    manifest = job['manifest']
+
+    if err is None and job.get('skipped') is not None:
+        skipJob(manifest, job['uid'], job['image'], job['skipped'], min_valid)
+        return
+
+    if err is not None:
+        print ('job failed: %s' % err)
+        manifest.update(job['uid'], job['image'], 'failed', attempts=job.get('attempts', 1), error=repr(err))
+        report.count('jobs_failed')
+        return
+
+    with report.stage('write_csv'):
+        # write to a temp file first so an interrupted write does not leave a partial result
+        result.to_csv(job['csv'] + '.part')
+        os.replace(job['csv'] + '.part', job['csv'])
+
+    manifest.update(job['uid'], job['image'], 'done', attempts=job.get('attempts', 1), result=job['csv'])
+    report.count('jobs_done')
+
+
+def publishJobs(cmdargs, queue, sites, options):
+    """
+    publish the outstanding jobs of the output of prepareSites to the shared work queue, returns the run name and the
+    (uid, image) of the jobs published
+    """
+    # the jobs of a run with other parameters are kept apart in the queue
+    run = os.path.abspath(sites['csv']) + '#' + sites['manifest'].params
+    shared = dict((k, v) for k, v in options.items() if k != 'pool')
+    jobs = [dict(((k, v) for k, v in job.items() if k != 'manifest'), sites=int(job['sites']), options=shared,
+                 cog=not cmdargs.no_cog, min_valid=cmdargs.min_valid, valid_band=cmdargs.valid_band) for job in sites['pending']]
+
+    queued = queue.publish(run, jobs, cmdargs.retries, cmdargs.lease, cmdargs.backoff)
+    print ('jobs published to the work queue: ', queued, ' ', sites['csv'])
+
+    return run, set((str(job['uid']), str(job['image'])) for job in jobs)
+
+
+def queueJobs(cmdargs, runs, options):
+    """
+    publish the outstanding jobs of each output of prepareSites to the shared work queue, then wait for the workers to
+    finish every job and record them in the job manifest of their output. Every output is published before the wait
+    so the workers are not left idle between them.
+    """
+    with WorkQueue(cmdargs.work_queue, cmdargs.lease) as queue:
+        published = [publishJobs(cmdargs, queue, sites, options) for sites in runs]
+
+        for sites, (run, jobs) in zip(runs, published):
+            queue.wait(run, cmdargs.poll)
+            recordJobs(queue, run, jobs, sites['manifest'])
+
+
+def recordJobs(queue, run, published, manifest):
+    """
+    record the queue records of the published jobs of a finished run in the job manifest
+    """
+    # only the jobs published by this run, the queue may hold the records of earlier runs with other parameters
+    for record in queue.jobs(run):
+        if record['status'] in ('done', 'skipped', 'failed') and (record['uid'], record['image']) in published:
+            if record['status'] == 'skipped':
+                # the worker records the valid pixels of a skipped job as its result
+                manifest.update(record['uid'], record['image'], 'skipped', attempts=record['attempts'],
+                                error=record['error'] or '', valid=record['result'] or '')
+            else:
+                manifest.update(record['uid'], record['image'], record['status'], attempts=record['attempts'],
+                                result=record['result'] or '', error=record['error'] or '')
+            report.count('jobs_' + record['status'])
+
+
+def remakeDir(dirname):
+    """
+    remove the directory if it exists and create a new empty one
+    """
+    if os.path.isdir(dirname):
+        shutil.rmtree(dirname)
+    os.makedirs(dirname)
+
+
+def listImages(cmdargs, sd):
+    """
+    the images to match the sites to, from the image list or catalogue, the acquisition calendar or a listing of the
+    wrs2 directory. Returns the list of images and the catalogue dataframe (None if there is no catalogue).
+    """
+    catalogue = None
+    if cmdargs.imglist is not None:
+        with report.stage('read_imglist'):
+            list_img, catalogue = readImageList(cmdargs.imglist)
+    elif cmdargs.calendar:
+        list_img = calendarScenes(sd, cmdargs.direc, cmdargs.endfilen)
+    else:
+        list_img = listdir(cmdargs.direc, cmdargs.endfilen, cmdargs.archives)
+
+    return list_img, catalogue
+
+
+def extractOptions(cmdargs, pool):
+    """
+    the zonal stats options of the jobs (the keyword arguments of imageZonalstats) from the command arguments
+    """
+    return {'param': cmdargs.alltouch, 'nodata': cmdargs.nodata, 'percentiles': parseList(cmdargs.percentiles),
+            'bins': parseList(cmdargs.bins), 'engine': cmdargs.engine, 'pool': pool,
+            'buffers': parseBuffers(cmdargs.buffers, cmdargs.shrink), 'rings': cmdargs.rings, 'shifts': cmdargs.shifts}
+
+
+def memoryBudget(cmdargs):
+    """
+    give the GDAL cache its share of the memory budget (before any raster is opened), returns the memory gate holding
+    back the jobs near the budget or None if there is no budget
+    """
+    if cmdargs.memory_budget <= 0:
+        return None
+
+    budget = cmdargs.memory_budget * 1e9
+    megabytes = setGdalCache(budget * cmdargs.cache_fraction)
+    report.info['memory_budget'] = budget
+    print ('memory budget: %.1f GB, GDAL cache: %s MB' % (cmdargs.memory_budget, megabytes))
+
+    return MemoryGate(budget)
+
+
+def budgetPipeline(cmdargs, pending, run_job):
+    """
+    run the first pending job with run_job to measure its peak memory and return the readers, workers and queue depth
+    that fit in the memory budget, and the rest of the pending jobs
+    """
+    first = next(pending, None)
+    if first is None:
+        return {'readers': cmdargs.readers, 'workers': cmdargs.workers, 'depth': cmdargs.queue}, iter([])
+
+    ignored, peak = measurePeak(run_job, first)
+    plan = planWorkers(cmdargs.memory_budget * 1e9, peak, rss(), cmdargs.readers, cmdargs.workers, cmdargs.queue,
+                       cmdargs.cache_fraction)
+    report.info['memory_plan'] = plan
+    print ('job peak memory: %s bytes, readers: %s workers: %s queue: %s' % (peak, plan['readers'], plan['workers'], plan['depth']))
+
+    return plan, pending
+
+
+def prepareSites(cmdargs, sd, df, export_csv, options, cache=None):
+    """
+    match the sites of the site layer to the images of the image dataframe (imageListDf) and set up the temp dirs and
+    job manifest of the results of export_csv. Returns a dictionary of the output csv, manifest, jobs, temp dirs and a
+    generator of the (site, image) jobs not completed by a previous run (outstandingJobs), each holding the manifest
+    it is recorded in.
+    """
+    uid = cmdargs.uid
+
+    # make some temp dir's to put the single site shp files and results into
+    # named after the output csv so runs writing to the same directory do not share results
+    outname = os.path.splitext(os.path.abspath(export_csv))[0]
+    tempDir = outname + '_temp_individual_results'
+    tempshp = outname + '_temp_individual_shp'
+    if cmdargs.fresh and os.path.isdir(tempDir):
+        shutil.rmtree(tempDir)
+    if not os.path.isdir(tempDir):
+        os.makedirs(tempDir)
+    remakeDir(tempshp)
+
+    # the manifest records the status of each (uid, image) job so a restarted run only runs the outstanding jobs
+    manifest = JobManifest(os.path.join(tempDir, 'job_manifest.csv'), jobParams(cmdargs, options), cmdargs.min_valid)
+    report.info['manifest'] = manifest.path
+
+    with report.stage('match'):
+        jobs = matchSiteImages(sd, df, uid)
+
+    report.info.update({'images': len(df), 'sites': len(sd), 'jobs': len(jobs)})
+    print ('number of (site, image) jobs: ', len(jobs))
+
+    # the results are written by site with the images of each site in path order
+    jobs = jobs.sort_values(['image', 'uid'], kind='stable')
+
+    pending = (dict(job, manifest=manifest) for job in
+               outstandingJobs(jobs, sd, uid, manifest, tempDir, tempshp, cache, 2 * cmdargs.prefetch))
+
+    return {'csv': export_csv, 'manifest': manifest, 'jobs': jobs, 'tempDir': tempDir, 'tempshp': tempshp, 'pending': pending}
+
+
+def runJobs(cmdargs, pending, options, cache=None, cube=None, profiler=None, gate=None):
+    """
+    run the pending jobs here, in turn or through the reader / worker pipeline (--readers), recording each job in its
+    manifest. The jobs can come from several calls of prepareSites so one pipeline runs the jobs of every output.
+    """
+    pool = options['pool']
+
+    if cmdargs.readers > 0:
+        # read the windows of the next jobs while the stats of the previous ones are derived
+        if profiler is not None:
+            print ('--profile is not used with --readers, the jobs are not profiled')
+        report.info.update({'readers': cmdargs.readers, 'workers': cmdargs.workers, 'queue': cmdargs.queue})
+
+        read = functools.partial(readJob, options=options, cache=cache, retries=cmdargs.retries, backoff=cmdargs.backoff,
+                                 cube=cube, min_valid=cmdargs.min_valid, band=cmdargs.valid_band)
+        compute = functools.partial(computeJob, options=options)
+        write = functools.partial(writeJob, min_valid=cmdargs.min_valid)
+
+        plan = {'readers': cmdargs.readers, 'workers': cmdargs.workers, 'depth': cmdargs.queue}
+        if gate is not None:
+            # the first job is run on its own to measure the memory of a job
+            def runFirst(job):
+                result, err = None, None
+                try:
+                    result = compute(job, read(job))
+                except Exception as e:
+                    err = e
+                write(job, result, err)
+            plan, pending = budgetPipeline(cmdargs, pending, runFirst)
+
+        pipeline = JobPipeline(read, compute, write, plan['readers'], plan['workers'], plan['depth'], gate)
+        pipeline.run(pending)
+        return
+
+    for job in pending:
+
+        img = job['image']
+        manifest = job['manifest']
+        print (img)
+
+        run = functools.partial(zonalJob, img, job['shp'], job['csv'], options, profiler, job['sites'], job['uid'], cache, cube,
+                                job['zone'], cmdargs.min_valid, cmdargs.valid_band)
+        failed = functools.partial(jobFailed, manifest, pool, job['uid'], img, cmdargs.retries, cache)
+
+        try:
+            attempts, (result, valid) = retry(run, cmdargs.retries, cmdargs.backoff, failed)
+            if result is None:
+                # too few valid pixels in the window read
+                skipJob(manifest, job['uid'], img, valid, cmdargs.min_valid)
+            else:
+                manifest.update(job['uid'], img, 'done', attempts=attempts, result=result)
+                report.count('jobs_done')
+        except Exception:
+            report.count('jobs_failed')
+
+        print ("...................")
+
+
+def finishSites(sites):
+    """
+    concatenate the results of the completed jobs of prepareSites into its output csv and remove the site shape files,
+    returns the job counts of the manifest
+    """
+    manifest, jobs = sites['manifest'], sites['jobs']
+
+    # read in the individual results of the completed jobs and concatenate them to a single dataframe
+    with report.stage('concat_results'):
+        # by site rather than in the order the jobs were run, the pipeline also completes them out of order
+        all_files = manifest.results([(jobs.loc[i, 'uid'], jobs.loc[i, 'image']) for i in resultOrder(jobs)])
+        df_from_each_file = (pd.read_csv(f) for f in all_files)
+        concatenated_df = pd.concat(df_from_each_file, ignore_index=False, axis=0) if all_files else pd.DataFrame()
+
+        # export the results to a csv file
+        concatenated_df.to_csv(sites['csv'])
+
+    shutil.rmtree(sites['tempshp'])
+
+    counts = manifest.counts()
+    print ('jobs completed: ', counts.get('done', 0), ' jobs skipped: ', counts.get('skipped', 0), ' jobs failed: ', counts.get('failed', 0))
+    if counts.get('failed', 0):
+        print ('rerun the same command to retry the failed jobs')
+
+    return counts
+
+
+def extractSites(cmdargs, sd, df, export_csv, options, cache=None, cube=None, profiler=None, gate=None):
+    """
+    match the sites of the site layer to the images of the image dataframe (imageListDf), run the (site, image) jobs
+    not completed by a previous run and write all the results to export_csv. The dataset pool (in options), scene cache
+    and chip cube are left open so they can be shared by several calls. Returns the job counts of the manifest.
+    """
+    sites = prepareSites(cmdargs, sd, df, export_csv, options, cache)
+
+    if cmdargs.work_queue is not None:
+        # the jobs are run by queue_worker.py processes
+        if cube is not None or profiler is not None:
+            print ('--chips and --profile are not used with --work-queue')
+        queueJobs(cmdargs, [sites], options)
+    else:
+        runJobs(cmdargs, sites['pending'], options, cache, cube, profiler, gate)
+
+    return finishSites(sites)
+
+
+def mainRoutine():
+
+    # read in the command arguments
+    cmdargs = getCmdargs()
+    export_csv = cmdargs.csv
+    report_file = cmdargs.report if cmdargs.report is not None else os.path.splitext(export_csv)[0] + '_run_report.json'
+
+    report.info.update({'shape': cmdargs.shape, 'days': cmdargs.days, 'csv': export_csv})
+
+    # the COG copies of the scenes are read when they exist
+    zonal_stats_single_cal_val_local.USE_COG = not cmdargs.no_cog
+
+    profiler = None
+    if cmdargs.profile:
+        profiler = JobProfiler(os.path.splitext(report_file)[0] + '_profiles', slowest=cmdargs.slowest)
+        report.info['profiles'] = profiler.outdir
+
+    # generate a list of all the available imagery to extract the statistics from
+    with report.stage('read_sites'):
+        sd = readSiteLayer(cmdargs.shape, cmdargs.days)
+
+    list_img, catalogue = listImages(cmdargs, sd)
+    df = imageListDf(list_img, catalogue)
+
+    # the GDAL cache size has to be set before the first image is opened
+    gate = memoryBudget(cmdargs)
+
+    # the images stay open in the pool between jobs. The pipeline reader threads each have their own pool.
+    pool = DatasetPool(cmdargs.max_open) if cmdargs.readers == 0 else ThreadDatasetPool(cmdargs.max_open)
+    options = extractOptions(cmdargs, pool)
+
+    # the cache stages the scenes a few images ahead of the job being run
+    cache = None
+    if cmdargs.cache_dir is not None:
+        cache = SceneCache(cmdargs.cache_dir, cmdargs.cache_size * 1e9, cmdargs.prefetch)
+        report.info['cache_dir'] = cmdargs.cache_dir
+
+    # the chips of the sites are saved as the windows are read
+    cube = None
+    if cmdargs.chips is not None:
+        cube = ChipCube(cmdargs.chips, cmdargs.margin)
+        report.info['chips'] = cmdargs.chips
+
+    counts = extractSites(cmdargs, sd, df, export_csv, options, cache, cube, profiler, gate)
+    report.info['manifest_counts'] = counts
+
+    pool.close()
+    if cache is not None:
+        cache.close()
+
+    if profiler is not None:
+        profiler.finish()
+
+    report.write(report_file)
+
+
+if __name__ == "__main__":
+    mainRoutine()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Run the cal/val extraction (cal_val_extract.py) for a range of field survey years in one command, in place of one
+notebook run per year. The site layer holds the field visits of every year, the visits of each year are matched against
+a single listing (or image catalogue) of the archive and the jobs of every year are run together, sharing the open
+dataset pool, the scene cache, the chip cube and the reader / worker threads (--readers) across the years. The results
+are written as one dataset partitioned by year:
+
+    <outdir>/year=2016/cal_val_dil_data_2016_results30days.csv
+    <outdir>/year=2017/cal_val_dil_data_2017_results30days.csv
+    ...
+    <outdir>/dataset_index.csv  - year, csv, number of sites and the done / skipped / failed job counts of each year
+
+Each year keeps its own job manifest next to its results, so rerunning the command only runs the outstanding jobs of
+each year. The other arguments are the same as cal_val_extract.py.
+
+e.g.
+    python cal_val_multi_year.py -s nt_rm_fieldSite_2016_2021_wrs2sj_buff.shp -l imglist_dil.csv -y 2016-2021 -n 15 -o dil_results
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import argparse
+import itertools
+import pandas as pd
+import zonal_stats_single_cal_val_local
+from cal_val_extract import addExtractArgs, readSiteLayer, listImages, imageListDf, extractOptions, prepareSites, runJobs, finishSites, queueJobs, memoryBudget
+from dataset_pool import DatasetPool, ThreadDatasetPool
+from scene_cache import SceneCache
+from chip_cube import ChipCube
+from job_profiler import JobProfiler
+from run_report import report
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Extract the zonal stats of the field sites of a range of years from the matched imagery in one run, writing one results csv per year into a dataset directory.""")
+
+    addExtractArgs(p)
+
+    p.add_argument("-y","--years", help="first and last field survey year e.g. 2016-2021, or a single year")
+
+    p.add_argument("-o","--outdir", help="dataset directory the results of each year are written into")
+
+    p.add_argument("--name", default="cal_val_dil_data_{year}_results{window}days.csv", help="name of the results csv of each year, {year} and {window} (2 x days) are filled in (default is %(default)s)")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file, defaults to run_report.json in the dataset directory")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.shape is None or cmdargs.years is None or cmdargs.outdir is None or (cmdargs.imglist is None and cmdargs.direc is None):
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def yearRange(text):
+    """
+    the years of a year range argument e.g. "2016-2021" or "2019"
+    """
+    first, last = (str(text).split('-') + [str(text)])[:2]
+    return list(range(int(first), int(last) + 1))
+
+
+def partitionCsv(outdir, year, name, days):
+    """
+    path of the results csv of a year in the dataset directory
+    """
+    return os.path.join(outdir, 'year=%s' % year, name.format(year=year, window=2 * abs(days)))
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+    years = yearRange(cmdargs.years)
+    report_file = cmdargs.report if cmdargs.report is not None else os.path.join(cmdargs.outdir, 'run_report.json')
+
+    report.info.update({'shape': cmdargs.shape, 'days': cmdargs.days, 'years': years, 'outdir': cmdargs.outdir})
+
+    # the COG copies of the scenes are read when they exist
+    zonal_stats_single_cal_val_local.USE_COG = not cmdargs.no_cog
+
+    profiler = None
+    if cmdargs.profile:
+        profiler = JobProfiler(os.path.splitext(report_file)[0] + '_profiles', slowest=cmdargs.slowest)
+        report.info['profiles'] = profiler.outdir
+
+    with report.stage('read_sites'):
+        sd = readSiteLayer(cmdargs.shape, cmdargs.days)
+        sd = sd[sd['date_time'].dt.year.isin(years)]
+
+    # one listing of the archive for every year
+    list_img, catalogue = listImages(cmdargs, sd)
+    df = imageListDf(list_img, catalogue)
+    print ('number of images: ', len(df), ' number of sites: ', len(sd))
+
+    # the GDAL cache size has to be set before the first image is opened
+    gate = memoryBudget(cmdargs)
+
+    # the open datasets, staged scenes and chips are shared by the years
+    pool = DatasetPool(cmdargs.max_open) if cmdargs.readers == 0 else ThreadDatasetPool(cmdargs.max_open)
+    options = extractOptions(cmdargs, pool)
+
+    cache = None
+    if cmdargs.cache_dir is not None:
+        cache = SceneCache(cmdargs.cache_dir, cmdargs.cache_size * 1e9, cmdargs.prefetch)
+        report.info['cache_dir'] = cmdargs.cache_dir
+
+    cube = None
+    if cmdargs.chips is not None:
+        cube = ChipCube(cmdargs.chips, cmdargs.margin)
+        report.info['chips'] = cmdargs.chips
+
+    # the jobs of each year are matched and recorded in the manifest of the year
+    runs = []
+    for year in years:
+
+        sdy = sd[sd['date_time'].dt.year == year]
+        export_csv = partitionCsv(cmdargs.outdir, year, cmdargs.name, cmdargs.days)
+        print ('year: ', year, ' sites: ', len(sdy))
+        if len(sdy) == 0:
+            continue
+
+        if not os.path.isdir(os.path.dirname(export_csv)):
+            os.makedirs(os.path.dirname(export_csv))
+
+        runs.append((year, sdy, prepareSites(cmdargs, sdy, df, export_csv, options, cache)))
+
+    if cmdargs.work_queue is not None:
+        # the jobs are run by queue_worker.py processes, each year is a run of the queue and every year is published
+        # before waiting so the workers run the jobs of the years together
+        with report.stage('run_jobs'):
+            queueJobs(cmdargs, [sites for year, sdy, sites in runs], options)
+    else:
+        # the jobs of every year are run by one pipeline (or in turn), so the reader and worker threads and their open
+        # datasets are shared by the years
+        with report.stage('run_jobs'):
+            runJobs(cmdargs, itertools.chain.from_iterable(sites['pending'] for year, sdy, sites in runs), options,
+                    cache, cube, profiler, gate)
+
+    partitions = []
+    for year, sdy, sites in runs:
+        counts = finishSites(sites)
+        partitions.append({'year': year, 'csv': os.path.relpath(sites['csv'], cmdargs.outdir), 'sites': len(sdy),
+                           'done': counts.get('done', 0), 'skipped': counts.get('skipped', 0), 'failed': counts.get('failed', 0)})
+
+    pool.close()
+    if cache is not None:
+        cache.close()
+
+    index = pd.DataFrame(partitions, columns=['year', 'csv', 'sites', 'done', 'skipped', 'failed'])
+    index.to_csv(os.path.join(cmdargs.outdir, 'dataset_index.csv'), index=False)
+    report.info['partitions'] = partitions
+    print (index)
+
+    if profiler is not None:
+        profiler.finish()
+
+    report.write(report_file)
+
+
+if __name__ == "__main__":
+    mainRoutine()
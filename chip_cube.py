@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""
+Per site chip cube. The batch extractor (cal_val_extract.py --chips) saves the pixels of every band in a small chip
+covering each site polygon plus a margin for every matched image, so a change of statistic, percentiles, histogram bins,
+all touched or a smaller site buffer can be derived again from the chips in seconds rather than going back to the scenes.
+
+The cube is a directory:
+    index.csv              - one line per chip: uid, img_date, image, imName, zone, chip, crs, the affine transform (a-f),
+                             nodata, bands, rows, cols, dtype. Append only, the last line for a (uid, image) chip wins.
+    chips/<uid>/<scene>.npz - the (bands, rows, cols) chip array, one chunk per site and image
+    sites/<uid>_<zone>.json - the site polygons in the crs of the zone, as used for the extraction
+
+The stats are derived again with this script, which writes the same columns as the extraction, from the stored site
+polygons or a new site shape file (-s) e.g. with a smaller buffer, or with the stats of buffers of the polygons (-b)
+that fall within the chip margin or of the polygons shrunk (--shrink):
+
+e.g.
+    python chip_cube.py -c cal_val_2021_chips -o cal_val_2021_p10_p90.csv --percentiles 10,90
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import csv
+import json
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from affine import Affine
+from rasterio.crs import CRS
+from zonal_stats_single_cal_val_local import windowZonalstats, parseList, parseBuffers, asBool, ENGINES
+from run_report import report
+
+
+INDEX_FIELDS = ['uid', 'img_date', 'image', 'imName', 'zone', 'chip', 'crs', 'a', 'b', 'c', 'd', 'e', 'f', 'nodata',
+                'bands', 'rows', 'cols', 'dtype']
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Derive the zonal stats of the field sites again from the pixel chips saved by cal_val_extract.py --chips rather than from the scenes.""")
+
+    p.add_argument("-c","--cube", help="chip cube directory written by cal_val_extract.py --chips")
+
+    p.add_argument("-s","--shape", default=None, help="field site shape file to use in place of the site polygons stored in the cube e.g. with a different buffer (default is %(default)s)")
+
+    p.add_argument("-u","--uid", default="uid_2", help="column name of the unique id field in the shape file given with -s (default is %(default)s)")
+
+    p.add_argument("-a","--alltouch", type=asBool, default=False, help="select either True of False, True will increase the number of pixels used to produce the stats False reduces the number (default is %(default)s)")
+
+    p.add_argument("-e","--engine", default="rasterstats", choices=ENGINES, help="zonal stats engine (default is %(default)s)")
+
+    p.add_argument("--percentiles", default=None, help="comma separated list of percentiles to add to the stats e.g. 10,25,75,90 (default is %(default)s)")
+
+    p.add_argument("--bins", default=None, help="comma separated list of histogram bin edges to count the pixel values into e.g. 100,120,140,160,180,200 (default is %(default)s)")
+
+    p.add_argument("-b","--buffers", default=None, help="comma separated list of buffer distances in metres to add the stats of the buffered site polygons for, the buffers must fall within the chip margin e.g. 30, a list starting with a negative (shrinking) distance needs the = form e.g. -b=-30,30 (default is %(default)s)")
+
+    p.add_argument("--shrink", default=None, help="comma separated list of distances in metres to shrink the site polygons by and add the stats of, as --buffers with the negative distances e.g. 30 (default is %(default)s)")
+
+    p.add_argument("--rings", action="store_true", help="with --buffers derive the stats of the rings between the sorted buffer distances")
+
+    p.add_argument("--shifts", type=int, default=0, help="add the spread of the band means of the site polygons shifted by up to this many whole pixels, the shifts must fall within the chip margin (default is %(default)s)")
+
+    p.add_argument("-o","--csv", help="name of the output csv file containing the results")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file containing the timing and counts (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.cube is None or cmdargs.csv is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+class ChipCube(object):
+    """
+    read and write the chips of a chip cube directory, saving is safe from several threads
+    """
+
+    def __init__(self, path, margin=10):
+        self.path = path
+        self.margin = margin
+        self.index_file = os.path.join(path, 'index.csv')
+        self.lock = threading.Lock()
+        self.chips = {}
+
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as src:
+                for record in csv.DictReader(src):
+                    self.chips[(record['uid'], record['image'])] = record
+        else:
+            os.makedirs(os.path.join(path, 'chips'), exist_ok=True)
+            os.makedirs(os.path.join(path, 'sites'), exist_ok=True)
+            with open(self.index_file, 'w') as output:
+                csv.writer(output, lineterminator='\n').writerow(INDEX_FIELDS)
+
+    def __len__(self):
+        return len(self.chips)
+
+    def save(self, uid, image, zone, window, features):
+        """
+        save the window read by zonal_stats_single_cal_val_local.readImageWindow as the chip of the site and image, and
+        the site polygons it was read for
+        """
+        name = os.path.splitext(os.path.basename(str(image)))[0]
+        chip = os.path.join('chips', str(uid), name + '.npz')
+        os.makedirs(os.path.join(self.path, 'chips', str(uid)), exist_ok=True)
+
+        with report.stage('chip_save'):
+            np.savez_compressed(os.path.join(self.path, chip), array=window['array'], bands=np.array(window['bands']))
+
+            # the polygons of the latest extraction of the site replace any earlier ones
+            sites = os.path.join(self.path, 'sites', '%s_%s.json' % (uid, zone))
+            with self.lock:
+                with open(sites + '.part', 'w') as output:
+                    json.dump({'type': 'FeatureCollection', 'features': [f.__geo_interface__ for f in features]},
+                              output, default=str)
+                os.replace(sites + '.part', sites)
+
+        affine = window['affine']
+        array = window['array']
+        record = {'uid': str(uid), 'img_date': str(image)[-27:-19], 'image': str(image), 'imName': window['imgName'],
+                  'zone': str(zone), 'chip': chip, 'crs': window['crs'].to_wkt() if window['crs'] else '',
+                  'a': affine.a, 'b': affine.b, 'c': affine.c, 'd': affine.d, 'e': affine.e, 'f': affine.f,
+                  'nodata': '' if window.get('nodata') is None else window['nodata'], 'bands': array.shape[0],
+                  'rows': array.shape[1], 'cols': array.shape[2], 'dtype': str(array.dtype)}
+
+        with self.lock:
+            self.chips[(record['uid'], record['image'])] = record
+            with open(self.index_file, 'a') as output:
+                csv.DictWriter(output, fieldnames=INDEX_FIELDS, lineterminator='\n').writerow(record)
+
+        report.count('chips_saved')
+        report.count('chip_bytes', array.nbytes)
+
+    def records(self, uid=None, date=None):
+        """
+        return the index records of the chips ordered by uid and image, optionally of one site and / or one image date
+        (yyyymmdd)
+        """
+        records = [r for r in self.chips.values() if (uid is None or r['uid'] == str(uid)) and (date is None or r['img_date'] == str(date))]
+
+        # by site then image whatever order the chips were saved in
+        return sorted(records, key=lambda r: ((0, int(r['uid']), '') if r['uid'].isdigit() else (1, 0, r['uid']), r['image']))
+
+    def load(self, record):
+        """
+        load a chip as a window dictionary that can be passed to zonal_stats_single_cal_val_local.windowZonalstats
+        """
+        with report.stage('chip_load'), np.load(os.path.join(self.path, record['chip'])) as chip:
+            array = chip['array']
+            bands = tuple(int(b) for b in chip['bands'])
+
+        return {'bands': bands, 'array': array,
+                'affine': Affine(*[float(record[k]) for k in ['a', 'b', 'c', 'd', 'e', 'f']]),
+                'crs': CRS.from_wkt(record['crs']) if record['crs'] else None, 'imgName': record['imName']}
+
+    def features(self, record):
+        """
+        the site polygons stored for the chip
+        """
+        with open(os.path.join(self.path, 'sites', '%s_%s.json' % (record['uid'], record['zone'])), 'r') as src:
+            return json.load(src)['features']
+
+
+def siteFeatures(sd, uid_field, uid, crs):
+    """
+    the polygons of a site from a site layer reprojected to the crs of the chip, as geojson features
+    """
+    sda = sd[sd[uid_field].astype(str) == str(uid)].to_crs(crs)
+    return json.loads(sda.to_json(drop_id=True))['features']
+
+
+def cubeZonalstats(cube, param, nodata=None, percentiles=None, bins=None, engine='rasterstats', sd=None, uid_field='uid_2', buffers=None, rings=False, shifts=0):
+    """
+    derive the zonal stats of every chip in the cube, returns the results of each (site, image) as a list of dataframes
+    with the same columns as the extraction. The site polygons are taken from the site layer sd if one is given.
+    """
+    results = []
+
+    for record in cube.records():
+
+        window = cube.load(record)
+        if sd is not None:
+            features = siteFeatures(sd, uid_field, record['uid'], window['crs'])
+        else:
+            features = cube.features(record)
+
+        chip_nodata = nodata
+        if chip_nodata is None and record['nodata'] != '':
+            chip_nodata = float(record['nodata'])
+
+        results.append(windowZonalstats(window, features, param, chip_nodata, percentiles, bins, engine, buffers, rings, shifts))
+
+    return results
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+
+    cube = ChipCube(cmdargs.cube)
+    print ('number of chips: ', len(cube))
+
+    sd = None
+    if cmdargs.shape is not None:
+        sd = gpd.read_file(cmdargs.shape)
+
+    with report.stage('cube_zonal_stats'):
+        results = cubeZonalstats(cube, cmdargs.alltouch, None, parseList(cmdargs.percentiles), parseList(cmdargs.bins),
+                                 cmdargs.engine, sd, cmdargs.uid, parseBuffers(cmdargs.buffers, cmdargs.shrink), cmdargs.rings, cmdargs.shifts)
+
+    # the same layout as the batch extractor output, the row index of each (site, image) result is kept as a column
+    with report.stage('write_csv'):
+        results = [df.reset_index().rename(columns={'index': 'Unnamed: 0'}) for df in results]
+        concatenated_df = pd.concat(results, ignore_index=False, axis=0) if results else pd.DataFrame()
+        concatenated_df.to_csv(cmdargs.csv)
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
+
+
+if __name__ == "__main__":
+    mainRoutine()
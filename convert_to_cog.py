@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+Convert the ERDAS Imagine DIL scenes of the archive (found with list_of_files_multi_dir_fnmatch.listdir) to tiled,
+compressed Cloud Optimised GeoTIFFs with overviews. The .img scenes are stored in strips, so reading the small window
+of a field site reads whole rows of the scene, from a 256 x 256 tiled COG the same window reads one or two tiles.
+
+Each COG is written next to its scene with the same name ending in .tif (cogPath) e.g.
+    l7tmre_p103r077_20180725_dilm3_zstdmask.img -> l7tmre_p103r077_20180725_dilm3_zstdmask.tif
+
+The zonal stats scripts open the COG in place of the scene when it exists and is newer than the scene (preferCog). The
+scenes are converted in parallel worker processes and each conversion is recorded in the manifest csv (by default
+cog_manifest.csv in the listed directory) with the scene size and modification time, so rerunning the tool only
+converts the new or changed scenes.
+
+e.g.
+    python convert_to_cog.py -d Z:/Landsat/wrs2/103_077 -w 4
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import csv
+import time
+import argparse
+import datetime
+import concurrent.futures
+import rasterio
+import rasterio.shutil
+from list_of_files_multi_dir_fnmatch import listdir
+from run_report import report
+
+
+MANIFEST_FIELDS = ['image', 'cog', 'status', 'image_size', 'image_mtime', 'cog_size', 'seconds', 'error', 'updated']
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Convert the ERDAS Imagine scenes of the archive to tiled, compressed Cloud Optimised GeoTIFFs with overviews written next to each scene.""")
+
+    p.add_argument("-d","--direc", help="path to the wrs2 directory to list the scenes from")
+
+    p.add_argument("-e","--endfilen", default="*dilm*_zstdmask.img", help="end of the scene file names to convert (default is %(default)s)")
+
+    p.add_argument("-w","--workers", type=int, default=4, help="number of scenes converted at the same time (default is %(default)s)")
+
+    p.add_argument("-b","--blocksize", type=int, default=256, help="tile width and height in pixels (default is %(default)s)")
+
+    p.add_argument("-c","--compress", default="DEFLATE", help="compression of the COG e.g. DEFLATE, LZW, ZSTD (default is %(default)s)")
+
+    p.add_argument("--resampling", default="NEAREST", help="resampling used to build the overviews (default is %(default)s)")
+
+    p.add_argument("-m","--manifest", default=None, help="name of the conversion manifest csv, defaults to cog_manifest.csv in the listed directory")
+
+    p.add_argument("--overwrite", action="store_true", help="convert every scene even if its COG is up to date")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file containing the timing and counts (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.direc is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def cogPath(image):
+    """
+    path of the COG copy of a scene, the scene name ending in .tif rather than .img
+    """
+    return os.path.splitext(str(image))[0] + '.tif'
+
+
+def preferCog(image):
+    """
+    return the COG copy of the scene if one exists and is not older than the scene, otherwise the scene itself
+    """
+    image = str(image)
+    if image.lower().endswith('.tif'):
+        return image
+
+    cog = cogPath(image)
+    try:
+        if os.path.getmtime(cog) >= os.path.getmtime(image):
+            report.count('cog_used')
+            return cog
+    except OSError:
+        pass
+
+    return image
+
+
+def convertScene(image, blocksize=256, compress='DEFLATE', resampling='NEAREST'):
+    """
+    convert a single scene to a COG, the COG is written to a temporary name first so an interrupted conversion is never
+    mistaken for a complete one. Returns the manifest record of the conversion.
+    """
+    cog = cogPath(image)
+    start = time.perf_counter()
+    st = os.stat(image)
+    record = {'image': image, 'cog': cog, 'image_size': st.st_size, 'image_mtime': int(st.st_mtime)}
+
+    try:
+        with rasterio.Env():
+            rasterio.shutil.copy(image, cog + '.part', driver='COG', BLOCKSIZE=blocksize, COMPRESS=compress,
+                                 PREDICTOR='YES', OVERVIEWS='AUTO', OVERVIEW_RESAMPLING=resampling, BIGTIFF='IF_SAFER')
+
+            # check the COG has the same grid and bands as the scene before it replaces any earlier copy
+            with rasterio.open(image) as src, rasterio.open(cog + '.part') as dst:
+                if (src.count, src.width, src.height, src.transform, src.crs, src.nodata) != (dst.count, dst.width, dst.height, dst.transform, dst.crs, dst.nodata):
+                    raise ValueError('COG does not match the grid of the scene')
+
+        os.replace(cog + '.part', cog)
+        record.update({'status': 'done', 'cog_size': os.path.getsize(cog), 'error': ''})
+
+    except Exception as err:
+        if os.path.exists(cog + '.part'):
+            os.remove(cog + '.part')
+        record.update({'status': 'failed', 'cog_size': '', 'error': repr(err)})
+
+    record['seconds'] = time.perf_counter() - start
+    record['updated'] = datetime.datetime.now().isoformat()
+
+    return record
+
+
+def readManifest(path):
+    """
+    read the conversion manifest, returns a dictionary of the last record of each scene
+    """
+    records = {}
+    if os.path.isfile(path):
+        with open(path, 'r') as src:
+            for record in csv.DictReader(src):
+                records[record['image']] = record
+    return records
+
+
+def isConverted(image, record):
+    """
+    True if the scene was converted and has not changed since, and its COG still exists
+    """
+    if record is None or record['status'] != 'done' or not os.path.isfile(record['cog']):
+        return False
+    st = os.stat(image)
+    return str(st.st_size) == record['image_size'] and str(int(st.st_mtime)) == record['image_mtime']
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+    manifest_file = cmdargs.manifest if cmdargs.manifest is not None else os.path.join(cmdargs.direc, 'cog_manifest.csv')
+
+    list_img = listdir(cmdargs.direc, cmdargs.endfilen)
+
+    records = readManifest(manifest_file)
+    todo = [img for img in list_img if cmdargs.overwrite or not isConverted(img, records.get(img))]
+    report.count('scenes_up_to_date', len(list_img) - len(todo))
+    print ('scenes to convert: ', len(todo), ' up to date: ', len(list_img) - len(todo))
+
+    new_file = not os.path.isfile(manifest_file)
+    with open(manifest_file, 'a') as output:
+        writer = csv.DictWriter(output, fieldnames=MANIFEST_FIELDS, lineterminator='\n')
+        if new_file:
+            writer.writeheader()
+
+        # GDAL is not shared between processes so each worker converts its own scenes
+        with report.stage('convert'), concurrent.futures.ProcessPoolExecutor(max_workers=max(cmdargs.workers, 1)) as executor:
+            futures = [executor.submit(convertScene, img, cmdargs.blocksize, cmdargs.compress, cmdargs.resampling) for img in todo]
+
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                writer.writerow(record)
+                output.flush()
+
+                report.count('scenes_' + record['status'])
+                report.addLatency('convert_scene', record['seconds'])
+                print (record['status'], record['cog'], record['error'])
+
+    print ('conversion manifest written: ', manifest_file)
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
+
+
+if __name__ == "__main__":
+    mainRoutine()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""
+Pool of open rasterio datasets. Opening an ERDAS Imagine scene on the network share is expensive as GDAL reads the
+header and the .aux/.rrd sidecar files, so jobs that use the same scene share one open handle. The least recently used
+dataset is closed when more than max_open datasets are open, which bounds the number of file handles and the memory
+held by the GDAL block cache for them.
+
+e.g.
+    pool = DatasetPool(max_open=16)
+    srci = pool.open(image, nodata=0)    # do not close, the pool owns the handle
+    ...
+    pool.close()
+
+ThreadDatasetPool gives each thread its own pool, for the reader threads of job_pipeline.py.
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import threading
+import collections
+import rasterio
+from run_report import report
+
+
+class DatasetPool(object):
+    """
+    least recently used pool of open rasterio datasets
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max(int(max_open), 1)
+        self.datasets = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.datasets)
+
+    def open(self, image, nodata=None):
+        """
+        return the open dataset of the image, opening it (and closing the least recently used dataset if the pool is
+        full) if it is not already open
+        """
+        key = (str(image), nodata)
+
+        if key in self.datasets:
+            self.datasets.move_to_end(key)
+            report.hit('dataset_pool')
+            return self.datasets[key]
+
+        report.hit('dataset_pool', False)
+        with report.stage('raster_open'):
+            srci = rasterio.open(image, nodata=nodata)
+        report.count('raster_open')
+
+        self.datasets[key] = srci
+        while len(self.datasets) > self.max_open:
+            old_key, old = self.datasets.popitem(last=False)
+            old.close()
+            report.count('dataset_pool_evict')
+
+        return srci
+
+    def release(self, image):
+        """
+        close the datasets of the image e.g. when the file is about to be replaced
+        """
+        for key in [k for k in self.datasets if k[0] == str(image)]:
+            self.datasets.pop(key).close()
+
+    def close(self):
+        """
+        close every open dataset
+        """
+        while self.datasets:
+            key, srci = self.datasets.popitem(last=False)
+            srci.close()
+
+
+class ThreadDatasetPool(object):
+    """
+    a DatasetPool for each thread using it, GDAL dataset handles must not be shared between threads
+    """
+
+    def __init__(self, max_open=16):
+        self.max_open = max_open
+        self.local = threading.local()
+        self.pools = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return sum(len(pool) for pool in self.pools)
+
+    def pool(self):
+        """
+        return the pool of the calling thread
+        """
+        if not hasattr(self.local, 'pool'):
+            self.local.pool = DatasetPool(self.max_open)
+            with self.lock:
+                self.pools.append(self.local.pool)
+        return self.local.pool
+
+    def open(self, image, nodata=None):
+        return self.pool().open(image, nodata)
+
+    def release(self, image):
+        self.pool().release(image)
+
+    def close(self):
+        """
+        close every open dataset, call once the threads using the pool have finished
+        """
+        with self.lock:
+            for pool in self.pools:
+                pool.close()
@@ -57,6 +57,7 @@ import os
 import argparse
 import sys
 from openpyxl import load_workbook
+from run_report import report
 
 
 # command arguments
@@ -67,6 +68,8 @@ def getCmdargs():
     p.add_argument("-d","--indir", help="Path to the directory containing the observational spreadsheets")
  
     p.add_argument("-o","--csv", help="Path and name of the output csv file containing the results")
+
+    p.add_argument("-r","--report", default=None, help="Path and name of the json or csv run report file containing the timing of each stage")
     
     cmdargs = p.parse_args()
     
@@ -1360,10 +1363,12 @@ def mainRoutine():
         site_name = wb[-11:-5]
         full_path = path + wb
         print ('observational spreadsheet being processed: ', full_path)
+        report.count('sheets_read')
         
         # read in the observational work sheet and extract out the site name and visit date to use as the uid to match the site details
         # and fractional calculations. 
-        book = load_workbook(filename = full_path, data_only=True)
+        with report.stage('load_workbook', job=full_path):
+            book = load_workbook(filename = full_path, data_only=True)
         sheet_ranges2 = book['Step 2 - Visit Details']
         site = (sheet_ranges2['B5'].value)
         date = (sheet_ranges2['B6'].value)
@@ -1371,7 +1376,8 @@ def mainRoutine():
         print (uid)
         print ('--------------------------------------------------')
         # read in the three transect tabs from the spreadsheet, and convert them to a concatenated dataframe
-        df = pd.concat(pd.read_excel(full_path, sheet_name=[3, 4, 5], header=None, index_col=None, usecols = [1, 2, 3], skiprows = [0, 1,2], nrows=100))
+        with report.stage('read_transects', job=full_path):
+            df = pd.concat(pd.read_excel(full_path, sheet_name=[3, 4, 5], header=None, index_col=None, usecols = [1, 2, 3], skiprows = [0, 1,2], nrows=100))
         df.columns = ["GROUND LAYER", "BELOW", "ABOVE"]
             
         # drop the index columns
@@ -1385,18 +1391,20 @@ def mainRoutine():
 
     
     '''Call upon the fraction calculation functions and append the variables calculations to the DataFrame'''
-    appended_data['fpc'] = appended_data.apply(FPC,axis=1)
-    appended_data['ppc'] = appended_data.apply(PPC,axis=1)
-    appended_data['cc'] = appended_data.apply(CC,axis=1)
-    appended_data['ob'] = appended_data.apply(OB,axis=1)
-    appended_data['pvg'] = appended_data.apply(groundGreen,axis=1)
-    appended_data['npvg'] = appended_data.apply(groundNPV,axis=1)
-    appended_data['bgg'] = appended_data.apply(groundBare, axis=1)
-    appended_data['pv'] = appended_data.apply(pv,axis=1)
-    appended_data['npv'] = appended_data.apply(npv,axis=1)
-    appended_data['bg'] = appended_data.apply(bg, axis=1)
+    with report.stage('classify'):
+        appended_data['fpc'] = appended_data.apply(FPC,axis=1)
+        appended_data['ppc'] = appended_data.apply(PPC,axis=1)
+        appended_data['cc'] = appended_data.apply(CC,axis=1)
+        appended_data['ob'] = appended_data.apply(OB,axis=1)
+        appended_data['pvg'] = appended_data.apply(groundGreen,axis=1)
+        appended_data['npvg'] = appended_data.apply(groundNPV,axis=1)
+        appended_data['bgg'] = appended_data.apply(groundBare, axis=1)
+        appended_data['pv'] = appended_data.apply(pv,axis=1)
+        appended_data['npv'] = appended_data.apply(npv,axis=1)
+        appended_data['bg'] = appended_data.apply(bg, axis=1)
         
-    calculations_df = CoverIndices(appended_data)
+    with report.stage('cover_indices'):
+        calculations_df = CoverIndices(appended_data)
     
     """
     Extract property name, site, date, lat and long for centre and the north offset from spreadsheet
@@ -1408,7 +1416,8 @@ def mainRoutine():
     for wb in os.listdir(path):
 
         # load the individual observational spread sheet 
-        book = load_workbook(filename = path + wb, data_only=True)
+        with report.stage('load_workbook', job=path + wb):
+            book = load_workbook(filename = path + wb, data_only=True)
         
         # read in sheet 1 to extract out the station name and lat and long coords for the centre and north offset picket
         sheet_ranges1 = book['Step 1 - Site Establishment']
@@ -1441,7 +1450,11 @@ def mainRoutine():
     # join attribute and calculation dataframes using 'uid' as index
     final_df = attribute_df.join(calculations_df.set_index('uid'), on='uid')
     
-    final_df.to_csv(results_csv)
+    with report.stage('write_csv'):
+        final_df.to_csv(results_csv)
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
 
 if __name__ == "__main__":
     mainRoutine()
\ No newline at end of file
@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+
+"""
+Golden output check of the faster extraction paths against the legacy zonal stats, so a change to the engines, the
+window reads or the job pipeline can only be merged once it reproduces the results tables (the layout of
+dil_results/cal_val_dil_data_*_results30days.csv) for the same sites and images.
+
+The script generates a synthetic wrs2 tree of DIL scenes and a field site layer (synthetic_cal_val_data.py) and builds
+the golden table with the legacy path: the pinned copy of the 2021 zonal stats script (2022/zonal_stats_single_cal_val_local.py,
+none of the later changes) is run for each matched (site, image) as the cal_val_stats_local_data_shpfile notebook ran
+it, one whole band read per band through its temp dir band csvs, with the job csvs of the notebook's temp dir
+concatenated. The legacy script has no percentiles, the --percentiles columns of each job are added to its results csv
+from rasterstats' own percentile stats of the whole band (numpy's linear percentile). Each candidate path is then run
+through cal_val_extract.extractSites with --percentiles on the same fixtures:
+
+    extract       - the extraction driver with the rasterstats engine (images kept open in the dataset pool)
+    label         - the label raster engine (zonal_engine.py)
+    exact         - the exact area weighted engine
+    pipeline      - the label engine through the reader / worker pipeline (job_pipeline.py)
+
+for each case of site layer:
+
+    aligned       - square sites on the pixel grid
+    offgrid       - the sites moved off the pixel grid by fractions of a pixel, and a second polygon of the same site
+                    (uid_2) next to every other site, touching it or less than a pixel from it
+    alltouch      - the offgrid sites with --alltouch True
+
+The exact engine weights the pixels a site partly covers by the fraction covered, so it is only checked on the aligned
+sites where it reproduces the legacy stats and percentiles, its covered area columns (area_1) are not compared.
+
+The results are matched on (uid, imName) and compared column by column, the stats columns within --rtol / --atol and
+the site attribute and count columns exactly. The best wall time of the repeats of each path and its speed-up over the
+legacy path are reported, and the script exits with 1 if any candidate does not match.
+
+With -g and -t two results csv files are compared without the synthetic fixtures e.g. a shipped dil_results table and
+the table of the same sites and images extracted again with a new engine.
+
+e.g.
+    python golden_cal_val_results.py -c extract,label,pipeline -o golden_check.csv
+    python golden_cal_val_results.py -g dil_results/cal_val_dil_data_2021_results30days.csv -t cal_val_dil_data_2021_label.csv
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import io
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import importlib.util
+import rasterio
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from shapely.affinity import translate
+from rasterstats import zonal_stats
+import synthetic_cal_val_data as synth
+import zonal_stats_single_cal_val_local
+import cal_val_extract
+from dataset_pool import DatasetPool, ThreadDatasetPool
+
+
+# the pinned legacy zonal stats script, as it was before any of the extraction changes
+LEGACY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '2022', 'zonal_stats_single_cal_val_local.py')
+
+# the cal_val_extract.py arguments of each candidate path
+CANDIDATES = {'extract': ['--engine', 'rasterstats'],
+              'label': ['--engine', 'label'],
+              'exact': ['--engine', 'exact'],
+              'pipeline': ['--engine', 'label', '--readers', '2', '--workers', '2']}
+
+# the candidates that only reproduce the legacy stats for sites on the pixel grid
+GRID_ONLY = ['exact']
+
+# the site layer cases, (sites off the pixel grid with touching polygons, all touched)
+CASES = {'aligned': (False, False),
+         'offgrid': (True, False),
+         'alltouch': (True, True)}
+
+# the offsets of the offgrid sites (fractions of a pixel in x and y) and the gaps to their second polygon (pixels)
+OFFSETS = [(0.37, -0.21), (-0.45, 0.12), (0.5, 0.5), (0.08, -0.33)]
+GAPS = [0.0, 1 / 6.0]
+
+# the columns a (site, image) row is matched on, and the site attribute columns compared exactly
+KEYS = ['uid', 'imName']
+EXACT = ['Site', 'obs_time']
+
+# the prefixes of the columns only some engines add, not compared
+EXTRA = ['area_']
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Check the faster extraction paths reproduce the results of the pinned legacy zonal stats script on synthetic fixtures, column by column, and report the speed-up of each.""")
+
+    p.add_argument("-c","--candidates", default="extract,label,exact,pipeline", help="comma separated list of the paths to check from %s (default is %%(default)s)" % ', '.join(CANDIDATES))
+
+    p.add_argument("--cases", default="aligned,offgrid,alltouch", help="comma separated list of the site layer cases to check from %s (default is %%(default)s)" % ', '.join(CASES))
+
+    p.add_argument("--legacy", default=LEGACY, help="the legacy zonal stats script the golden tables are made with (default is %(default)s)")
+
+    p.add_argument("--percentiles", default="10,25,75,90", help="comma separated list of the percentiles added to the stats of every path (default is %(default)s)")
+
+    p.add_argument("-i","--images", type=int, default=8, help="number of synthetic scenes (default is %(default)s)")
+
+    p.add_argument("-s","--sites", type=int, default=20, help="number of synthetic field sites (default is %(default)s)")
+
+    p.add_argument("-p","--pixels", type=int, default=1000, help="width and height of each synthetic scene in pixels (default is %(default)s)")
+
+    p.add_argument("-n","--days", type=int, default=60, help="number of days either side of the field date to match the scenes within (default is %(default)s)")
+
+    p.add_argument("-f","--format", default="HFA", help="raster driver of the synthetic scenes, HFA (ERDAS Imagine) or GTiff (default is %(default)s)")
+
+    p.add_argument("-r","--repeats", type=int, default=1, help="number of times each path is timed, the best time is reported (default is %(default)s)")
+
+    p.add_argument("--rtol", type=float, default=1e-9, help="relative tolerance of the stats columns (default is %(default)s)")
+
+    p.add_argument("--atol", type=float, default=1e-9, help="absolute tolerance of the stats columns (default is %(default)s)")
+
+    p.add_argument("-d","--direc", default=None, help="directory to write the fixtures and results into, a temp dir is used and removed if not given")
+
+    p.add_argument("-g","--golden", default=None, help="golden results csv to check -t against rather than running the synthetic check")
+
+    p.add_argument("-t","--test", default=None, help="with -g the results csv to check")
+
+    p.add_argument("-o","--csv", default=None, help="name of the output csv file with the comparison of each column")
+
+    cmdargs = p.parse_args()
+
+    if (cmdargs.golden is None) != (cmdargs.test is None):
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def readResults(csv):
+    """
+    read a results csv (the layout written by cal_val_extract.py and the notebook) without the index columns, sorted on
+    the (uid, imName) of each row
+    """
+    df = pd.read_csv(csv, index_col=0)
+    df = df.drop(columns=[c for c in df.columns if c.startswith('Unnamed')])
+    return df.sort_values(KEYS, kind='stable').reset_index(drop=True)
+
+
+def compareResults(golden, test, rtol=1e-9, atol=1e-9):
+    """
+    compare two results dataframes (readResults) column by column, returns a dataframe with one row per column of the
+    golden table holding the number of rows that differ, the largest absolute difference and whether the column matches.
+    The rows are first matched on (uid, imName), the rows only in one of the tables and the repeated rows of a key are
+    reported against the keys.
+    """
+    merged = golden.merge(test, on=KEYS, how='outer', suffixes=('_golden', '_test'), indicator=True)
+    rows = []
+
+    missing = merged['_merge'] != 'both'
+    differ = int(missing.sum()) + int(golden.duplicated(KEYS).sum()) + int(test.duplicated(KEYS).sum())
+    rows.append({'column': ' '.join(KEYS), 'rows': len(merged), 'differ': differ, 'max_abs_diff': np.nan,
+                 'match': differ == 0})
+    merged = merged[~missing]
+
+    for column in golden.columns:
+        if column in KEYS:
+            continue
+        if column not in test.columns:
+            rows.append({'column': column, 'rows': len(merged), 'differ': len(merged), 'max_abs_diff': np.nan, 'match': False})
+            continue
+
+        a, b = merged[column + '_golden'], merged[column + '_test']
+        max_diff = np.nan
+
+        if column in EXACT or column.startswith('count_') or not (pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b)):
+            same = (a == b) | (a.isna() & b.isna())
+        else:
+            a, b = a.astype(float).values, b.astype(float).values
+            same = np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+            both = ~(np.isnan(a) | np.isnan(b))
+            if both.any():
+                max_diff = float(np.abs(a[both] - b[both]).max())
+
+        differ = int(len(merged) - np.count_nonzero(same))
+        rows.append({'column': column, 'rows': len(merged), 'differ': differ, 'max_abs_diff': max_diff, 'match': differ == 0})
+
+    for column in test.columns:
+        if column not in golden.columns and not column.startswith(tuple(EXTRA)):
+            rows.append({'column': column, 'rows': len(merged), 'differ': len(merged), 'max_abs_diff': np.nan, 'match': False})
+
+    return pd.DataFrame(rows, columns=['column', 'rows', 'differ', 'max_abs_diff', 'match'])
+
+
+def bestTime(func, repeats, *args):
+    """
+    run func repeats times with the output of the print statements suppressed, returns the best wall time
+    """
+    best = None
+
+    for i in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def loadLegacy(path):
+    """
+    load the legacy zonal stats script as a module
+    """
+    spec = importlib.util.spec_from_file_location('legacy_zonal_stats', path)
+    legacy = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(legacy)
+    return legacy
+
+
+def legacyJob(legacy, image, shp, csv, nodata, alltouch, workdir):
+    """
+    run the legacy script for a (site, image) job with the command line the notebook used, from workdir where it
+    writes its temp_individual_bands csvs
+    """
+    argv = ['zonal_stats_single_cal_val_local.py', '--image', image, '--nodata', str(nodata), '--shape', shp, '--csv', csv]
+    if alltouch:
+        argv += ['-a', 'True']
+
+    saved = sys.argv, os.getcwd()
+    sys.argv = argv
+    os.chdir(workdir)
+    try:
+        legacy.mainRoutine()
+    finally:
+        sys.argv = saved[0]
+        os.chdir(saved[1])
+
+
+def addPercentiles(csv, image, shp, nodata, alltouch, percentiles):
+    """
+    add the percentile columns (p10_1 etc.) of each band to the results csv of a legacy job, from rasterstats'
+    percentile stats of the whole band
+    """
+    df = pd.read_csv(csv, index_col=0)
+    stats = ' '.join('percentile_' + format(q, 'g') for q in percentiles)
+
+    with rasterio.open(image, nodata=nodata) as srci:
+        for band in srci.indexes:
+            zs = zonal_stats(shp, srci.read(band), affine=srci.transform, nodata=nodata, stats=stats, all_touched=alltouch)
+            for q in percentiles:
+                df['p' + format(q, 'g') + '_' + str(band)] = [zone['percentile_' + format(q, 'g')] for zone in zs]
+
+    df.to_csv(csv)
+
+
+def legacyResults(legacy, shape, list_img, days, export_csv, alltouch=False, percentiles=None, nodata=0, uid='uid_2'):
+    """
+    the legacy path, the loop of the cal_val_stats_local_data_shpfile notebook, for each site the polygons of its uid
+    are reprojected to the zone of its images and written to a temp shape file, the legacy script is run for each
+    matched image into the temp results dir (with the percentiles added, addPercentiles) and the result csvs are
+    concatenated into the golden results csv
+    """
+    workdir = os.path.abspath(os.path.splitext(export_csv)[0] + '_legacy')
+    tempDir = os.path.join(workdir, 'temp_individual_results')
+    tempshp = os.path.join(workdir, 'temp_individual_shp')
+    cal_val_extract.remakeDir(workdir)
+    os.makedirs(tempDir)
+    os.makedirs(tempshp)
+
+    sd = gpd.read_file(shape)
+    sd['date_time'] = pd.to_datetime(sd['Date'], yearfirst=False, dayfirst=True)
+    sd['fwd_date'] = sd['date_time'] + timedelta(days=abs(days))
+    sd['bck_date'] = sd['date_time'] + timedelta(days=-abs(days))
+    df = cal_val_extract.imageListDf([os.path.abspath(x) for x in list_img])
+
+    for index, row in sd.iterrows():
+
+        siteN = row[uid]
+        sda = sd[(sd[uid] == siteN)]
+
+        path_row = str(row['PATH']) + '_0' + str(row['ROW'])
+        dfs = df[(df['path_row'] == path_row)]
+        imgS = dfs[dfs['img_dt'].isin(pd.date_range(row['bck_date'], row['fwd_date']))]
+        if len(imgS) == 0:
+            continue
+
+        # reproject the site polygons to the coordinate system of the imagery
+        zone = imgS['zone'].iloc[0]
+        sdsr = sda.drop(columns=['date_time', 'fwd_date', 'bck_date']).to_crs('EPSG:3275' + str(zone))
+        shp_file = os.path.join(tempshp, 'temp_' + str(siteN) + '_.shp')
+        sdsr.to_file(shp_file)
+
+        for img_index, img in imgS.iterrows():
+            csv = os.path.join(tempDir, 'results_' + str(siteN) + '_' + str(img_index) + '.csv')
+            legacyJob(legacy, img['image'], shp_file, csv, nodata, alltouch, workdir)
+            if percentiles:
+                addPercentiles(csv, img['image'], shp_file, nodata, alltouch, percentiles)
+
+    # read in the individual results and concatenate them to a single dataframe
+    all_files = glob.glob(os.path.join(tempDir, '*.csv'))
+    pd.concat((pd.read_csv(f) for f in all_files), ignore_index=False, axis=0).to_csv(export_csv)
+    shutil.rmtree(workdir)
+
+    return export_csv
+
+
+def offgridSites(shape, output, pixel=synth.PIXEL_SIZE):
+    """
+    write a copy of the site layer with each site moved off the pixel grid by a fraction of a pixel (OFFSETS), and a
+    second polygon of the same site (uid_2, with uid + 1000) next to every other site, touching it or less than a pixel
+    from it (GAPS) so both can touch the same pixel
+    """
+    sd = gpd.read_file(shape)
+    rows = []
+
+    for n, (index, site) in enumerate(sd.iterrows()):
+        dx, dy = OFFSETS[n % len(OFFSETS)]
+        site = site.copy()
+        site['geometry'] = translate(site['geometry'], dx * pixel, dy * pixel)
+        rows.append(site)
+
+        if n % 2 == 0:
+            minx, miny, maxx, maxy = site['geometry'].bounds
+            gap = GAPS[(n // 2) % len(GAPS)] * pixel
+            second = site.copy()
+            second['geometry'] = box(maxx + gap, miny, maxx + gap + 2.5 * pixel, maxy)
+            second['uid'] = site['uid'] + 1000
+            second['Site'] = site['Site'][:-1] + 'B'
+            rows.append(second)
+
+    gpd.GeoDataFrame(rows, crs=sd.crs).to_file(output)
+    return output
+
+
+def candidateResults(args, shape, list_img, days, export_csv):
+    """
+    run a candidate path through cal_val_extract.extractSites with its cal_val_extract.py arguments, starting afresh
+    """
+    p = argparse.ArgumentParser()
+    cal_val_extract.addExtractArgs(p)
+    cmdargs = p.parse_args(['-s', shape, '-n', str(days), '--fresh'] + list(args))
+
+    sd = cal_val_extract.readSiteLayer(shape, days)
+    df = cal_val_extract.imageListDf(list_img)
+
+    pool = DatasetPool(cmdargs.max_open) if cmdargs.readers == 0 else ThreadDatasetPool(cmdargs.max_open)
+    try:
+        cal_val_extract.extractSites(cmdargs, sd, df, export_csv, cal_val_extract.extractOptions(cmdargs, pool))
+    finally:
+        pool.close()
+
+    shutil.rmtree(os.path.splitext(os.path.abspath(export_csv))[0] + '_temp_individual_results')
+
+    return export_csv
+
+
+def checkCase(cmdargs, root, case, shape, list_img, candidates, legacy):
+    """
+    build the golden table of a site layer case with the legacy path and check each candidate against it, returns the
+    summary rows of each path and the column comparisons
+    """
+    offgrid, alltouch = CASES[case]
+    args = ['-a', 'True'] if alltouch else []
+    percentiles = cal_val_extract.parseList(cmdargs.percentiles)
+    if percentiles:
+        args += ['--percentiles', cmdargs.percentiles]
+
+    golden_csv = os.path.join(root, case + '_golden_results.csv')
+    legacy_time = bestTime(legacyResults, cmdargs.repeats, legacy, shape, list_img, cmdargs.days, golden_csv, alltouch, percentiles)
+    golden = readResults(golden_csv)
+    print ('%-9s %-10s %8.3f s  %d rows' % (case, 'legacy', legacy_time, len(golden)))
+
+    # the key columns are compared as one
+    summary = [{'case': case, 'path': 'legacy', 'seconds': legacy_time, 'speedup': 1.0, 'rows': len(golden),
+                'columns': len(golden.columns) - len(KEYS) + 1, 'columns_differ': 0, 'max_abs_diff': 0.0, 'match': True}]
+    columns = []
+
+    for name in candidates:
+        if offgrid and name in GRID_ONLY:
+            continue
+
+        csv = os.path.join(root, case + '_' + name + '_results.csv')
+        elapsed = bestTime(candidateResults, cmdargs.repeats, CANDIDATES[name] + args, shape, list_img, cmdargs.days, csv)
+
+        compared = compareResults(golden, readResults(csv), cmdargs.rtol, cmdargs.atol)
+        compared.insert(0, 'path', name)
+        compared.insert(0, 'case', case)
+        columns.append(compared)
+
+        differ = compared[~compared['match']]
+        row = {'case': case, 'path': name, 'seconds': elapsed, 'speedup': legacy_time / elapsed if elapsed > 0 else float('inf'),
+               'rows': int(compared['rows'].iloc[0]), 'columns': len(compared), 'columns_differ': len(differ),
+               'max_abs_diff': compared['max_abs_diff'].max(), 'match': len(differ) == 0}
+        summary.append(row)
+
+        print ('%-9s %-10s %8.3f s  x%.2f  %s' % (case, name, elapsed, row['speedup'], 'match' if row['match'] else
+                                                 'DIFFERS: ' + ', '.join(differ['column'])))
+
+    return summary, columns
+
+
+def checkPaths(cmdargs, root, candidates, cases):
+    """
+    generate the fixtures and check the candidates on each site layer case, returns the summary of each path and the
+    column comparisons
+    """
+    print ('generating synthetic data: ', cmdargs.images, ' scenes ', cmdargs.sites, ' sites ', cmdargs.pixels, ' pixels')
+    images = synth.makeWrs2Tree(os.path.join(root, 'wrs2'), cmdargs.images, cmdargs.pixels, cmdargs.pixels, driver=cmdargs.format)
+    shape = synth.makeSiteLayer(os.path.join(root, 'sites', 'synthetic_fieldSite_wrs2_buff.shp'), cmdargs.sites, images,
+                                cmdargs.pixels, cmdargs.pixels)
+    offgrid = offgridSites(shape, os.path.join(root, 'sites', 'synthetic_fieldSite_offgrid_buff.shp'))
+    list_img = images['image'].tolist()
+
+    # the fixtures have no COG copies, the scenes themselves are read by every path
+    zonal_stats_single_cal_val_local.USE_COG = False
+    legacy = loadLegacy(cmdargs.legacy)
+
+    summary, columns = [], []
+    for case in cases:
+        rows, compared = checkCase(cmdargs, root, case, offgrid if CASES[case][0] else shape, list_img, candidates, legacy)
+        summary += rows
+        columns += compared
+
+    return pd.DataFrame(summary), pd.concat(columns, ignore_index=True) if columns else pd.DataFrame()
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+
+    if cmdargs.golden is not None:
+        compared = compareResults(readResults(cmdargs.golden), readResults(cmdargs.test), cmdargs.rtol, cmdargs.atol)
+        print (compared.to_string(index=False))
+        if cmdargs.csv is not None:
+            compared.to_csv(cmdargs.csv, index=False)
+        sys.exit(0 if compared['match'].all() else 1)
+
+    candidates = [c.strip() for c in cmdargs.candidates.split(',') if c.strip()]
+    for name in candidates:
+        if name not in CANDIDATES:
+            print ('unknown candidate path: ', name)
+            sys.exit(1)
+
+    cases = [c.strip() for c in cmdargs.cases.split(',') if c.strip()]
+    for case in cases:
+        if case not in CASES:
+            print ('unknown site layer case: ', case)
+            sys.exit(1)
+
+    root = cmdargs.direc if cmdargs.direc is not None else tempfile.mkdtemp(prefix='cal_val_golden_')
+
+    try:
+        summary, columns = checkPaths(cmdargs, root, candidates, cases)
+    finally:
+        if cmdargs.direc is None:
+            shutil.rmtree(root)
+
+    print (summary.to_string(index=False))
+
+    if cmdargs.csv is not None:
+        columns.to_csv(cmdargs.csv, index=False)
+
+    sys.exit(0 if summary['match'].all() else 1)
+
+
+if __name__ == "__main__":
+    mainRoutine()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Image catalogue of the scenes found by list_of_files_multi_dir_fnmatch.listdir with the georeferencing of each scene
+harvested from its header: crs, bounds, affine transform, size, data type, nodata and band count. Only the header of
+each scene is read (no pixels), on a thread pool so the network latency of the opens overlap. The catalogue is a csv
+with a header line:
+
+    image, size, mtime, crs, left, bottom, right, top, a, b, c, d, e, f, width, height, dtype, nodata, count, error
+
+The extractor (cal_val_extract.py -l) reads either a catalogue or a plain one column image list. With a catalogue the
+(site, image) matches are pruned to the scenes whose footprint covers the site and the sites are reprojected to the crs
+of each scene rather than one worked out from the dilm zone of the file name, without opening any scene.
+
+Rebuilding the catalogue only reads the headers of new or changed scenes (by size and modification time), the others
+are copied from the earlier catalogue.
+
+e.g.
+    python list_of_files_multi_dir_fnmatch.py -d Z:/Landsat/wrs2 -e *dilm*_zstdmask.img -o imglist_dil.csv -m
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import concurrent.futures
+import pandas as pd
+import rasterio
+from shapely.geometry import box
+from run_report import report
+
+
+CATALOGUE_FIELDS = ['image', 'size', 'mtime', 'crs', 'left', 'bottom', 'right', 'top', 'a', 'b', 'c', 'd', 'e', 'f',
+                    'width', 'height', 'dtype', 'nodata', 'count', 'error']
+
+
+def sourceStat(image):
+    """
+    size and modification time of the scene, or of the tar or zip archive holding it
+    """
+    path = str(image)
+    if path.startswith('/vsi'):
+        # /vsitar/<archive>/<member>, the archive is the longest leading part that is a file
+        path = path.split('/', 2)[2]
+        while path and not os.path.isfile(path):
+            path = os.path.dirname(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return '', ''
+    return st.st_size, int(st.st_mtime)
+
+
+def harvestHeader(image):
+    """
+    read the georeferencing of a scene from its header, returns the catalogue record of the scene. A scene that can not
+    be opened is recorded with the error and no georeferencing.
+    """
+    size, mtime = sourceStat(image)
+    record = dict((k, '') for k in CATALOGUE_FIELDS)
+    record.update({'image': str(image), 'size': size, 'mtime': mtime})
+
+    try:
+        with report.stage('header_read'), rasterio.open(image) as srci:
+            t = srci.transform
+            record.update({'crs': srci.crs.to_string() if srci.crs else '', 'left': srci.bounds.left,
+                           'bottom': srci.bounds.bottom, 'right': srci.bounds.right, 'top': srci.bounds.top,
+                           'a': t.a, 'b': t.b, 'c': t.c, 'd': t.d, 'e': t.e, 'f': t.f, 'width': srci.width,
+                           'height': srci.height, 'dtype': srci.dtypes[0], 'nodata': '' if srci.nodata is None else srci.nodata,
+                           'count': srci.count})
+        report.count('headers_read')
+    except Exception as err:
+        record['error'] = repr(err)
+        report.count('headers_failed')
+
+    return record
+
+
+def readCatalogue(path):
+    """
+    read a catalogue csv, returns None if the file is a plain one column image list
+    """
+    df = pd.read_csv(path, header=None, nrows=1)
+    if str(df.iloc[0, 0]) != 'image':
+        return None
+
+    df = pd.read_csv(path, keep_default_na=False, dtype={'crs': str, 'error': str, 'dtype': str})
+    return df
+
+
+def readImageList(path):
+    """
+    read the image list csv written by list_of_files_multi_dir_fnmatch.py, returns the list of images and the catalogue
+    dataframe (None for a plain image list)
+    """
+    catalogue = readCatalogue(path)
+    if catalogue is None:
+        return pd.read_csv(path, header=None)[0].tolist(), None
+    return catalogue['image'].tolist(), catalogue
+
+
+def harvestCatalogue(list_img, workers=8, previous=None):
+    """
+    harvest the header of every scene in the list on a thread pool, returns the catalogue dataframe in the order of the
+    list. The records of scenes with the same size and modification time in the previous catalogue are reused.
+    """
+    known = {}
+    if previous is not None:
+        for record in previous.to_dict('records'):
+            known[record['image']] = record
+
+    records = {}
+    todo = []
+    for image in list_img:
+        record = known.get(str(image))
+        if record is not None and record['error'] == '' and (record['size'], record['mtime']) == sourceStat(image):
+            records[str(image)] = record
+            report.hit('catalogue')
+        else:
+            todo.append(str(image))
+            report.hit('catalogue', False)
+
+    with report.stage('harvest_headers'), concurrent.futures.ThreadPoolExecutor(max_workers=max(int(workers), 1)) as executor:
+        for record in executor.map(harvestHeader, todo):
+            records[record['image']] = record
+            if record['error']:
+                print ('could not read header: ', record['image'], record['error'])
+
+    return pd.DataFrame([records[str(image)] for image in list_img], columns=CATALOGUE_FIELDS)
+
+
+def footprint(record):
+    """
+    the bounds of a catalogue record as a polygon in the crs of the scene, None if the scene has no georeferencing
+    """
+    if record.get('crs', '') in ('', None) or record.get('left', '') in ('', None):
+        return None
+    return box(float(record['left']), float(record['bottom']), float(record['right']), float(record['top']))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+Keep a manifest of the (uid, image) jobs of a cal/val extraction run and their completion status so an interrupted run
+can be restarted without losing the work already done. The manifest is an append only csv file, each change of status
+is written as a new line and flushed to disk straight away, so a crash or network drive drop out can at most lose the
+job that was running. When the manifest is read back in the last line for each job wins.
+
+    uid, image, status (done/failed/skipped), attempts, result (csv of the job results), error, params, valid, updated
+
+params is a digest of the extraction parameters of the run (the zonal stats options) the job was run with, a job run
+with other parameters is not done and is run again. valid is the number of valid pixels of a skipped job (--min-valid),
+a skipped job is run again when the run's minimum is 0 or no longer more than the valid pixels of the job.
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import csv
+import time
+import datetime
+
+
+FIELDS = ['uid', 'image', 'status', 'attempts', 'result', 'error', 'params', 'valid', 'updated']
+
+
+class JobManifest(object):
+    """
+    read (or create) the job manifest and record the status of each job as it is run
+    """
+
+    def __init__(self, path, params='', min_valid=0):
+        self.path = path
+        self.params = params
+        self.min_valid = min_valid
+        self.jobs = {}
+
+        fields = None
+        if os.path.isfile(path):
+            with open(path, 'r') as src:
+                reader = csv.DictReader(src)
+                for record in reader:
+                    self.jobs[(record['uid'], record['image'])] = record
+                fields = reader.fieldnames
+        else:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+
+        if fields != FIELDS:
+            # a new manifest, or one written with other fields which is rewritten with the current fields
+            with open(path + '.part', 'w') as output:
+                writer = csv.DictWriter(output, fieldnames=FIELDS, restval='', extrasaction='ignore', lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(self.jobs.values())
+            os.replace(path + '.part', path)
+
+    def status(self, uid, image):
+        """
+        return the last recorded status of the job or None if it has not been run
+        """
+        record = self.jobs.get((str(uid), str(image)))
+        return None if record is None else record['status']
+
+    def current(self, uid, image):
+        """
+        return the record of the job if it was run with the parameters of this run, otherwise None
+        """
+        record = self.jobs.get((str(uid), str(image)))
+        if record is None or record.get('params', '') != self.params:
+            return None
+        return record
+
+    def isDone(self, uid, image):
+        """
+        True if the job completed with the parameters of this run and its results file still exists, or the job was
+        skipped (e.g. the site was nodata) with fewer valid pixels than the minimum of this run
+        """
+        record = self.current(uid, image)
+        if record is not None and record['status'] == 'skipped':
+            if self.min_valid <= 0 or not record.get('valid'):
+                return False
+            return int(record['valid']) < self.min_valid
+        return record is not None and record['status'] == 'done' and os.path.isfile(record['result'])
+
+    def update(self, uid, image, status, attempts=1, result='', error='', valid=''):
+        """
+        record a change of status for the job, run with the parameters of this run, and flush it to disk
+        """
+        record = {'uid': str(uid), 'image': str(image), 'status': status, 'attempts': attempts, 'result': result,
+                  'error': error, 'params': self.params, 'valid': valid, 'updated': datetime.datetime.now().isoformat()}
+        self.jobs[(record['uid'], record['image'])] = record
+
+        with open(self.path, 'a') as output:
+            csv.DictWriter(output, fieldnames=FIELDS, lineterminator='\n').writerow(record)
+            output.flush()
+            os.fsync(output.fileno())
+
+    def results(self, jobs):
+        """
+        return the result files of the given (uid, image) jobs, in their order, that completed with the parameters of
+        this run. The jobs of earlier runs that are not in jobs (e.g. outside a narrower day range) are left out.
+        """
+        records = [self.current(uid, image) for uid, image in jobs]
+        return [r['result'] for r in records if r is not None and r['status'] == 'done' and os.path.isfile(r['result'])]
+
+    def counts(self):
+        """
+        return the number of jobs for each status, of the jobs run with the parameters of this run
+        """
+        counts = {}
+        for record in self.jobs.values():
+            if record.get('params', '') != self.params:
+                continue
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
+
+
+def retry(func, retries=3, backoff=5.0, on_error=None):
+    """
+    call func until it succeeds or has failed retries times, waiting backoff * 2 ** (attempt - 1) seconds between
+    attempts. on_error(attempt, err) is called after each failure. Returns (attempts, result), the last error is raised
+    if every attempt fails. func is always called at least once.
+    """
+    retries = max(int(retries), 1)
+    for attempt in range(1, retries + 1):
+        try:
+            return attempt, func()
+        except Exception as err:
+            if on_error is not None:
+                on_error(attempt, err)
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+Streaming pipeline so the raster reads of the (site, image) jobs overlap the zonal stats of the jobs before them. Each
+job goes through four stages connected by bounded queues:
+
+    producer (one thread)      - iterates over the jobs e.g. matched from the image catalogue
+    readers (readers threads)  - read(job), the I/O e.g. staging the scene and reading the site window
+    workers (workers threads)  - compute(job, data), the stats of the window
+    writer (the calling thread) - write(job, result, err), the only stage writing files and the job manifest
+
+A stage blocks when the queue to the next stage is full (depth items), so at most about 2 * depth + readers + workers
+windows are held in memory however far the readers get ahead of the compute. GDAL and numpy release the GIL while
+reading and sorting, so the threads overlap the network latency with the computation.
+
+If a memory gate (memory_budget.MemoryGate) is given the readers wait for the resident set to drop below its limit
+before reading each job, while earlier jobs are still in flight.
+
+An exception raised by read or compute is passed on to write as err (result is None) rather than stopping the run.
+
+The report records the time the workers wait for a window (pipeline_starved, the run is I/O bound) and the time the
+readers wait for a free queue slot (pipeline_blocked, the run is compute bound).
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import queue
+import threading
+from run_report import report
+
+
+# marks the end of the jobs on a queue
+DONE = object()
+
+
+class JobPipeline(object):
+    """
+    run jobs through read, compute and write stages with bounded queues between them
+    """
+
+    def __init__(self, read, compute, write, readers=2, workers=2, depth=8, gate=None):
+        self.read = read
+        self.compute = compute
+        self.write = write
+        self.readers = max(int(readers), 1)
+        self.workers = max(int(workers), 1)
+        self.read_q = queue.Queue(maxsize=depth)
+        self.compute_q = queue.Queue(maxsize=depth)
+        self.write_q = queue.Queue(maxsize=depth)
+        self.gate = gate
+        self.error = None
+
+    def produce(self, jobs):
+        try:
+            for job in jobs:
+                self.read_q.put(job)
+        except Exception as err:
+            # the jobs already queued are still run, the error is raised by run()
+            self.error = err
+        finally:
+            for n in range(self.readers):
+                self.read_q.put(DONE)
+
+    def reader(self):
+        while True:
+            job = self.read_q.get()
+            if job is DONE:
+                return
+
+            if self.gate is not None:
+                self.gate.enter()
+
+            data, err = None, None
+            try:
+                data = self.read(job)
+            except Exception as e:
+                err = e
+
+            with report.stage('pipeline_blocked'):
+                self.compute_q.put((job, data, err))
+
+    def worker(self):
+        while True:
+            with report.stage('pipeline_starved'):
+                item = self.compute_q.get()
+            if item is DONE:
+                return
+
+            job, data, err = item
+            result = None
+            if err is None:
+                try:
+                    result = self.compute(job, data)
+                except Exception as e:
+                    err = e
+            del data
+
+            self.write_q.put((job, result, err))
+
+    def close(self, threads, q, n):
+        """
+        wait for the threads of a stage to finish and then tell the next stage there are no more jobs
+        """
+        for thread in threads:
+            thread.join()
+        for i in range(n):
+            q.put(DONE)
+
+    def start(self, target, n, *args):
+        threads = [threading.Thread(target=target, args=args, daemon=True) for i in range(n)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run(self, jobs):
+        """
+        run the jobs through the pipeline, returns the number of jobs written
+        """
+        producer = self.start(self.produce, 1, jobs)
+        readers = self.start(self.reader, self.readers)
+        workers = self.start(self.worker, self.workers)
+        self.start(self.close, 1, producer + readers, self.compute_q, self.workers)
+        self.start(self.close, 1, workers, self.write_q, 1)
+
+        written = 0
+        while True:
+            item = self.write_q.get()
+            if item is DONE:
+                break
+            self.write(*item)
+            written += 1
+            if self.gate is not None:
+                self.gate.leave()
+
+        if self.error is not None:
+            raise self.error
+
+        return written
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+Profile individual zonal stats jobs with cProfile so the hot spots of a slow image can be found from a production run
+without editing code or rerunning the image by hand. Each job is profiled and either every profile is saved or only the
+profiles of the slowest N jobs are kept and saved at the end of the run.
+
+For each saved job the profiler writes into the profile directory (next to the run report):
+    job_0003.prof   - the cProfile stats, load with pstats.Stats or snakeviz
+    job_0003.txt    - the image path, site count and elapsed time followed by the top functions by cumulative time
+    profiles.csv    - an index of the saved profiles
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import io
+import os
+import time
+import pstats
+import cProfile
+import contextlib
+import pandas as pd
+
+
+class JobProfiler(object):
+    """
+    profile each job run inside JobProfiler.profile(), slowest = 0 saves every job otherwise only the slowest N are saved
+    by JobProfiler.finish()
+    """
+
+    def __init__(self, outdir, slowest=0, top=40):
+        self.outdir = outdir
+        self.slowest = slowest
+        self.top = top
+        self.jobs = 0
+        self.kept = []
+        self.saved = []
+
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+    @contextlib.contextmanager
+    def profile(self, image, sites, **info):
+        """
+        profile the code run inside the with block as a single job of the given image and number of sites
+        """
+        self.jobs += 1
+        job = self.jobs
+        prof = cProfile.Profile()
+        start = time.perf_counter()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            elapsed = time.perf_counter() - start
+            record = dict(info, job=job, image=image, sites=sites, seconds=elapsed)
+
+            if self.slowest:
+                # keep the profile in memory while it is one of the slowest N jobs
+                self.kept.append((elapsed, record, pstats.Stats(prof)))
+                self.kept.sort(key=lambda x: x[0], reverse=True)
+                del self.kept[self.slowest:]
+            else:
+                self.save(record, pstats.Stats(prof))
+
+    def save(self, record, stats):
+        """
+        write the stats of a single job to a .prof file and a text summary
+        """
+        name = os.path.join(self.outdir, 'job_%04d' % record['job'])
+        stats.dump_stats(name + '.prof')
+
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        with open(name + '.txt', 'w') as output:
+            for key, value in record.items():
+                output.write('%s: %s\n' % (key, value))
+            output.write('\n')
+            output.write(text.getvalue())
+
+        record['profile'] = name + '.prof'
+        self.saved.append(record)
+
+    def finish(self):
+        """
+        save the slowest N job profiles and write the profile index, returns the index file name
+        """
+        for elapsed, record, stats in self.kept:
+            self.save(record, stats)
+        self.kept = []
+
+        index = os.path.join(self.outdir, 'profiles.csv')
+        pd.DataFrame(self.saved).to_csv(index, index=False)
+        print ('job profiles written: ', self.outdir)
+
+        return index
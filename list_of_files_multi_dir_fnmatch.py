@@ -3,6 +3,13 @@
 This script finds all the files based on the end of the file name in a given folder and sub folders
 and returns a list showing the path and file based on the part file name given using fnmatch. 
 
+With archives=True (-a) the members of tar and zip delivery archives found in the folders are matched as well and
+listed as GDAL virtual file system paths (/vsitar/ or /vsizip/) so they can be read without being extracted e.g.
+    /vsitar/Z:/deliveries/p103r077_2018.tar.gz/l7tmre_p103r077_20180725_dilm3_zstdmask.img
+
+With -m the output is an image catalogue (image_catalogue.py) with the crs, bounds, transform, data type, nodata and
+band count of each scene harvested from the scene headers in parallel, rather than just the list of files.
+
 
 Created on Wed Jan 13 10:41:41 2016
 
@@ -17,6 +24,14 @@ import argparse
 import sys
 import csv
 import fnmatch
+import tarfile
+import zipfile
+from run_report import report
+from image_catalogue import harvestCatalogue, readCatalogue
+
+
+# archive file endings and the GDAL virtual file system used to read their members
+ARCHIVE_TYPES = [('.tar', '/vsitar/'), ('.tar.gz', '/vsitar/'), ('.tgz', '/vsitar/'), ('.zip', '/vsizip/')]
 
 def getCmdargs():
     """
@@ -28,7 +43,15 @@ def getCmdargs():
     
     p.add_argument("-e","--endfilen", help="end of the file name e.g. h99m2.img")
 
+    p.add_argument("-a","--archives", action="store_true", help="also list the matching members of tar and zip archives as /vsitar/ or /vsizip/ paths")
+
     p.add_argument("-o","--txtfile", help="name of out put txt file containing the list of files")
+
+    p.add_argument("-m","--metadata", action="store_true", help="write an image catalogue with the georeferencing of each scene read from its header, an existing catalogue of the same name is updated")
+
+    p.add_argument("-w","--workers", type=int, default=8, help="with -m the number of scene headers read at the same time (default is %(default)s)")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file containing the timing and counts (default is %(default)s)")
     
     
     cmdargs = p.parse_args()
@@ -43,19 +66,63 @@ def getCmdargs():
     
 
 
-def listdir(dirname,endfilename):
+def archivePrefix(filename):
+    """
+    return the GDAL virtual file system prefix for an archive file name or None if it is not an archive
     """
-    this function will return a list of files in a directory for the given file extention. 
+    for ending, prefix in ARCHIVE_TYPES:
+        if filename.lower().endswith(ending):
+            return prefix
+    return None
+
+
+def archiveMembers(archive):
+    """
+    return the names of the files in a tar or zip archive
+    """
+    if archive.lower().endswith('.zip'):
+        with zipfile.ZipFile(archive) as src:
+            return [info.filename for info in src.infolist() if not info.is_dir()]
+
+    with tarfile.open(archive) as src:
+        return [member.name for member in src.getmembers() if member.isfile()]
+
+
+def listdir(dirname,endfilename, archives=False):
+    """
+    this function will return a list of files in a directory for the given file extention. If archives is True the
+    matching members of any tar or zip archives are added as /vsitar/ or /vsizip/ paths.
     """
     list_img = []
     
     
-    for root, dirs, files in os.walk(dirname):
-        for file in files:
-            if fnmatch.fnmatch(file, endfilename):
-                img = (os.path.join(root, file))
-                list_img.append(img)
-                print (img)
+    with report.stage('listdir'):
+        for root, dirs, files in os.walk(dirname):
+            report.count('dirs_listed')
+            for file in files:
+                if fnmatch.fnmatch(file, endfilename):
+                    img = (os.path.join(root, file))
+                    list_img.append(img)
+                    report.count('files_matched')
+                    print (img)
+
+                elif archives and archivePrefix(file) is not None:
+                    archive = os.path.join(root, file)
+                    try:
+                        members = archiveMembers(archive)
+                    except (tarfile.TarError, zipfile.BadZipFile, OSError) as err:
+                        print ('could not read archive: ', archive, err)
+                        report.count('archives_failed')
+                        continue
+                    report.count('archives_listed')
+
+                    for member in members:
+                        if fnmatch.fnmatch(os.path.basename(member), endfilename):
+                            # GDAL virtual file paths use forward slashes
+                            img = archivePrefix(file) + archive.replace('\\', '/') + '/' + member
+                            list_img.append(img)
+                            report.count('files_matched')
+                            print (img)
     
     return list_img
 
@@ -70,14 +137,24 @@ def mainRoutine():
     txtname = cmdargs.txtfile
     
  
-    list_img = listdir(direc,endfilename)
+    list_img = listdir(direc,endfilename, cmdargs.archives)
      
     
-    # assumes that filelist is a flat list, it adds a  
-    with open(txtname, "w") as output:
-        writer = csv.writer(output, lineterminator='\n')
-        for file in list_img:
-            writer.writerow([file])
+    if cmdargs.metadata:
+        # only the headers of the new or changed scenes are read
+        previous = readCatalogue(txtname) if os.path.isfile(txtname) else None
+        catalogue = harvestCatalogue(list_img, cmdargs.workers, previous)
+        catalogue.to_csv(txtname, index=False)
+
+    else:
+        # assumes that filelist is a flat list, it adds a  
+        with open(txtname, "w") as output:
+            writer = csv.writer(output, lineterminator='\n')
+            for file in list_img:
+                writer.writerow([file])
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
 
 if __name__ == "__main__":
     mainRoutine()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+Keep a parallel extraction run within a memory budget so a long run is not killed part way through when the host runs
+out of memory. The budget is split between the GDAL block cache (GDAL_CACHEMAX, a fraction of the budget) and the
+windows held by the jobs in flight. The peak memory of one job is measured on the first job of the run (the resident
+set is sampled while it runs) and the number of pipeline readers, workers and queued windows is derived from what is
+left of the budget. While the run goes on new jobs are held back whenever the resident set gets close to the budget.
+
+The resident set is read with psutil when it is installed, or from /proc on linux. Without either the GDAL cache is
+still budgeted but the jobs are not measured or throttled.
+
+e.g.
+    setGdalCache(budget * 0.25)
+    result, peak = measurePeak(run_first_job)
+    plan = planWorkers(budget, peak, rss(), readers=4, workers=4, depth=8, cache_fraction=0.25)
+    gate = MemoryGate(budget)
+    gate.enter()    # before reading each job
+    gate.leave()    # once the job is written
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import time
+import threading
+from run_report import report
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss():
+    """
+    return the resident set size of the process in bytes or None if it can not be read
+    """
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as src:
+            return int(src.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def setGdalCache(nbytes):
+    """
+    set the size of the GDAL block cache (GDAL_CACHEMAX, in MB), must be called before the first raster is opened
+    """
+    megabytes = max(int(nbytes / 2 ** 20), 16)
+    os.environ['GDAL_CACHEMAX'] = str(megabytes)
+    report.info['gdal_cachemax_mb'] = megabytes
+    return megabytes
+
+
+class PeakSampler(object):
+    """
+    sample the resident set on a background thread while the context is open, peak is the largest sample
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = None
+        self.peak = None
+        self.stop = threading.Event()
+
+    def sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def __enter__(self):
+        self.start = self.peak = rss()
+        if self.start is not None:
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.start is not None:
+            self.stop.set()
+            self.thread.join()
+            self.peak = max(self.peak, rss())
+
+
+def measurePeak(func, *args):
+    """
+    run func(*args), returns its result and the increase in the resident set while it ran (None if it can not be read)
+    """
+    with PeakSampler() as sampler:
+        result = func(*args)
+
+    if sampler.start is None:
+        return result, None
+    return result, max(sampler.peak - sampler.start, 0)
+
+
+def planWorkers(budget, job_peak, used, readers, workers, depth, cache_fraction=0.25):
+    """
+    the number of pipeline readers, workers and queued windows (at most the requested numbers) whose jobs fit in what
+    is left of the budget after the GDAL cache and the memory already used. Each reader, worker and queue slot can
+    hold the window of one job.
+    """
+    available = budget * (1 - cache_fraction) - (used or 0)
+    slots = int(available // job_peak) if job_peak else readers + workers + depth
+    slots = max(slots, 3)
+
+    plan = {'readers': max(1, min(readers, slots // 3)), 'workers': max(1, min(workers, slots // 3))}
+    plan['depth'] = max(1, min(depth, slots - plan['readers'] - plan['workers']))
+    plan.update({'job_peak_bytes': job_peak, 'available_bytes': int(available), 'slots': slots})
+
+    return plan
+
+
+class MemoryGate(object):
+    """
+    hold back new jobs while the resident set is above high (a fraction) of the budget and other jobs are still in
+    flight, whose memory is freed as they finish. A job is always let through when none are in flight so the run can
+    not stall.
+    """
+
+    def __init__(self, budget, high=0.9, poll=0.5):
+        self.limit = budget * high
+        self.poll = poll
+        self.inflight = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        """
+        wait until the resident set is below the limit or no other job is in flight and count the job as in flight,
+        returns the seconds waited
+        """
+        start = time.perf_counter()
+        throttled = False
+
+        while True:
+            current = rss()
+            with self.lock:
+                if current is None or current < self.limit or self.inflight == 0:
+                    self.inflight += 1
+                    break
+            if not throttled:
+                report.count('memory_throttled')
+                throttled = True
+            time.sleep(self.poll)
+
+        waited = time.perf_counter() - start
+        if throttled:
+            report.addTime('memory_throttle', waited)
+        return waited
+
+    def leave(self):
+        """
+        the job has finished and its memory is released
+        """
+        with self.lock:
+            self.inflight -= 1
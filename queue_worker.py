@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""
+Worker process for the shared work queue (work_queue.py). Start any number of workers, on any host that can see the
+queue database, the scenes and the run's temp directories on the common file system. Each worker claims a (site,
+image) job published by cal_val_extract.py --work-queue, runs it (cal_val_extract.zonalJob) and records it as done,
+skipped (too few valid pixels, --min-valid) or failed. The lease of the job is renewed on a background thread while the
+job runs, every third of the lease the job was published with (cal_val_extract.py --lease), if the worker dies the job
+is claimed again by another worker once the lease expires. A failed job is claimed again once the --backoff of its run
+has passed.
+
+With --memory-budget the GDAL block cache of the worker is given a share of the budget (memory_budget.py), the worker
+runs one job at a time so the number of workers started on a host sets the rest of its memory use.
+
+The worker exits once the queue has had no job to claim for --idle seconds and holds no failed jobs waiting for their
+backoff.
+
+e.g.
+    python queue_worker.py -q Z:/cal_val/work_queue.db --cache-dir D:/scene_cache
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import zonal_stats_single_cal_val_local
+from cal_val_extract import zonalJob
+from work_queue import WorkQueue
+from dataset_pool import DatasetPool
+from scene_cache import SceneCache
+from convert_to_cog import cogPath
+from memory_budget import setGdalCache
+from run_report import report
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Claim and run the (site, image) jobs of the shared work queue published by cal_val_extract.py --work-queue.""")
+
+    p.add_argument("-q","--queue-db", help="path of the work queue database on the common file system")
+
+    p.add_argument("-w","--worker", default=None, help="name of the worker recorded against its jobs, defaults to the host name and process id")
+
+    p.add_argument("--lease", type=float, default=600, help="seconds a claimed job is held for without the lease being renewed, for jobs published without a lease, the jobs published by cal_val_extract.py use its --lease (default is %(default)s)")
+
+    p.add_argument("--idle", type=float, default=60, help="seconds to wait for new jobs when the queue is empty before exiting (default is %(default)s)")
+
+    p.add_argument("--poll", type=float, default=10, help="seconds between looking for new jobs when the queue is empty (default is %(default)s)")
+
+    p.add_argument("-m","--max-open", type=int, default=16, help="maximum number of images kept open between jobs (default is %(default)s)")
+
+    p.add_argument("--memory-budget", type=float, default=0, help="memory in GB the worker should keep within, sets the GDAL cache size, 0 does not budget (default is %(default)s)")
+
+    p.add_argument("--cache-fraction", type=float, default=0.25, help="with --memory-budget the fraction of the budget given to the GDAL block cache (default is %(default)s)")
+
+    p.add_argument("--cache-dir", default=None, help="local directory to stage the scenes into before they are read, not used if not given (default is %(default)s)")
+
+    p.add_argument("--cache-size", type=float, default=50, help="maximum size of the scene cache in GB (default is %(default)s)")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file of the worker (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.queue_db is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def keepLease(queue, job_id, worker, interval, stop):
+    """
+    renew the lease of the job every interval seconds until stop is set
+    """
+    while not stop.wait(interval):
+        try:
+            if not queue.renew(job_id, worker):
+                print ('lease lost: ', job_id)
+                return
+        except Exception as err:
+            print ('lease renewal failed: %s' % err)
+
+
+def runJob(job, pool, cache=None):
+    """
+    run a queued job, returns the status (done or skipped) and the result csv or the valid pixels of the skipped job
+    """
+    options = dict(job['options'], pool=pool)
+    zonal_stats_single_cal_val_local.USE_COG = job['cog']
+    csv, valid = zonalJob(job['image'], job['shp'], job['csv'], options, None, job['sites'], job['uid'], cache, None, job['zone'],
+                          job['min_valid'], job['valid_band'])
+    if csv is None:
+        return 'skipped', valid
+
+    return 'done', csv
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+    worker = cmdargs.worker if cmdargs.worker is not None else '%s-%s' % (socket.gethostname(), os.getpid())
+    report.info.update({'queue': cmdargs.queue_db, 'worker': worker})
+
+    # the GDAL cache size has to be set before the first image is opened
+    if cmdargs.memory_budget > 0:
+        setGdalCache(cmdargs.memory_budget * 1e9 * cmdargs.cache_fraction)
+
+    queue = WorkQueue(cmdargs.queue_db, cmdargs.lease)
+    pool = DatasetPool(cmdargs.max_open)
+    cache = None
+    if cmdargs.cache_dir is not None:
+        cache = SceneCache(cmdargs.cache_dir, cmdargs.cache_size * 1e9)
+
+    idle_since = time.time()
+    while True:
+        job = queue.claim(worker)
+
+        if job is None:
+            # the failed jobs waiting for their backoff are still to be run
+            if time.time() - idle_since >= cmdargs.idle and queue.counts().get('pending', 0) == 0:
+                break
+            time.sleep(cmdargs.poll)
+            continue
+
+        print (job['image'], ' attempt ', job['attempt'])
+        stop = threading.Event()
+        renewer = threading.Thread(target=keepLease, args=(queue, job['id'], worker, job['lease'] / 3.0, stop), daemon=True)
+        renewer.start()
+
+        try:
+            status, result = runJob(job, pool, cache)
+            if status == 'done':
+                queue.complete(job['id'], worker, result)
+            else:
+                print ('job skipped, %s valid pixels (minimum %s)' % (result, job['min_valid']))
+                queue.skip(job['id'], worker, 'valid pixels %s < %s' % (result, job['min_valid']), str(result))
+            report.count('jobs_' + status)
+        except Exception as err:
+            print ('job failed: %s' % err)
+            queue.fail(job['id'], worker, repr(err))
+            report.count('jobs_failed')
+            # the next attempt opens the image again
+            img = job['image'] if cache is None else cache.localPath(job['image'])
+            pool.release(img)
+            pool.release(cogPath(img))
+        finally:
+            stop.set()
+            renewer.join()
+
+        idle_since = time.time()
+        print ("...................")
+
+    pool.close()
+    if cache is not None:
+        cache.close()
+    queue.close()
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
+
+
+if __name__ == "__main__":
+    mainRoutine()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""
+Record timing and I/O instrumentation for the cal/val scripts and write it out as a run report. The scripts share the
+module level report object, wrap each stage of their work in report.stage() and add counters for the number of rasters
+opened, bytes read per image and cache hits. The report is written as json or csv (based on the file extension) at the
+end of a run so a slow yearly run can be traced to the share (raster_open/raster_read), the rasterisation (zonal_stats)
+or pandas (write_csv, classify etc.).
+
+e.g.
+    from run_report import report
+
+    with report.stage('raster_read', image):
+        array = srci.read(band)
+    report.addBytes(image, array.nbytes)
+
+    report.write('cal_val_run_report.json')
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import csv
+import json
+import time
+import bisect
+import datetime
+import threading
+import contextlib
+
+
+# upper edges (seconds) of the latency histogram bins, the last bin holds everything slower
+LATENCY_BINS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class RunReport(object):
+    """
+    collects per stage wall time, counters, bytes read per image and per job latency histograms for a single run
+    """
+
+    def __init__(self):
+        # the scene cache and the read ahead pipeline record from several threads
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        clear all the recorded values and restart the run clock
+        """
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.bytes_read = {}
+        self.latency = {}
+        self.info = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, job=None):
+        """
+        time the code run inside the with block and add it to the stage total, if job is given the time is also added
+        to the latency histogram of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.addTime(name, elapsed)
+            if job is not None:
+                self.addLatency(name, elapsed)
+
+    def addTime(self, name, elapsed):
+        with self.lock:
+            stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stage['calls'] += 1
+            stage['seconds'] += elapsed
+            stage['max_seconds'] = max(stage['max_seconds'], elapsed)
+
+    def addLatency(self, name, elapsed):
+        with self.lock:
+            hist = self.latency.setdefault(name, [0] * (len(LATENCY_BINS) + 1))
+            hist[bisect.bisect_left(LATENCY_BINS, elapsed)] += 1
+
+    def count(self, name, n=1):
+        """
+        add n to the named counter e.g. raster_open, cache_hit, cache_miss
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def hit(self, cache, hit=True):
+        """
+        record a hit (or a miss) for the named cache
+        """
+        self.count(cache + ('_hit' if hit else '_miss'))
+
+    def addBytes(self, image, nbytes):
+        """
+        add the number of bytes read from an image
+        """
+        with self.lock:
+            self.bytes_read[image] = self.bytes_read.get(image, 0) + int(nbytes)
+
+    def summary(self):
+        """
+        return the report as a dictionary
+        """
+        histograms = {}
+        for name, hist in self.latency.items():
+            labels = ['<=%gs' % b for b in LATENCY_BINS] + ['>%gs' % LATENCY_BINS[-1]]
+            histograms[name] = dict(zip(labels, hist))
+
+        return {'started': self.started.isoformat(),
+                'wall_seconds': time.perf_counter() - self.start,
+                'info': self.info,
+                'stages': self.stages,
+                'counters': self.counters,
+                'bytes_read_total': sum(self.bytes_read.values()),
+                'bytes_read': self.bytes_read,
+                'latency_histograms': histograms}
+
+    def write(self, path):
+        """
+        write the report to a json file, or a csv file of (section, name, field, value) records if the file name ends
+        with .csv
+        """
+        summary = self.summary()
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        if path.lower().endswith('.csv'):
+            with open(path, 'w') as output:
+                writer = csv.writer(output, lineterminator='\n')
+                writer.writerow(['section', 'name', 'field', 'value'])
+                writer.writerow(['run', 'started', '', summary['started']])
+                writer.writerow(['run', 'wall_seconds', '', summary['wall_seconds']])
+                for name, value in summary['info'].items():
+                    writer.writerow(['info', name, '', value])
+                for name, stage in summary['stages'].items():
+                    for field, value in stage.items():
+                        writer.writerow(['stage', name, field, value])
+                for name, value in summary['counters'].items():
+                    writer.writerow(['counter', name, '', value])
+                for image, value in summary['bytes_read'].items():
+                    writer.writerow(['bytes_read', image, '', value])
+                for name, hist in summary['latency_histograms'].items():
+                    for field, value in hist.items():
+                        writer.writerow(['latency', name, field, value])
+        else:
+            with open(path, 'w') as output:
+                json.dump(summary, output, indent=2, default=str)
+
+        print ('run report written: ', path)
+
+
+# the report shared by the cal/val scripts
+report = RunReport()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""
+Local disk staging cache for scenes read from the network archive (Z:/Landsat/wrs2/). Each scene (and its sidecar
+files e.g. .rrd, .ige, .img.aux.xml) is copied once into the cache directory and read from local disk from then on, by
+this run and by later runs and parameter sweeps. A cached copy is only used while the size and modification time of the
+archive scene match the ones recorded when it was copied. The least recently used scenes are removed when the cache is
+larger than its size cap.
+
+Members of tar and zip archives (/vsitar/ and /vsizip/ paths) are not staged, they are read from the archive.
+
+Scenes can be staged ahead of the compute on a background thread pool with SceneCache.prefetch(), SceneCache.path()
+waits for a scene that is still being copied.
+
+e.g.
+    cache = SceneCache('D:/scene_cache', max_bytes=50e9, workers=4)
+    cache.prefetch(images[:8])
+    local = cache.path(images[0])
+    ...
+    cache.close()
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+import concurrent.futures
+from run_report import report
+
+
+def isArchiveMember(image):
+    """
+    True if the image is a GDAL virtual file system path e.g. a member of a tar or zip archive
+    """
+    return str(image).startswith('/vsi')
+
+
+class SceneCache(object):
+    """
+    size capped least recently used cache of scenes copied from the archive onto local disk
+    """
+
+    def __init__(self, cache_dir, max_bytes=50e9, workers=4):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'cache_index.json')
+        # reentrant as a staging callback can run in the thread holding the lock
+        self.lock = threading.RLock()
+        self.pending = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(int(workers), 1))
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.index = {}
+        if os.path.isfile(self.index_file):
+            with open(self.index_file, 'r') as src:
+                self.index = json.load(src)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def localDir(self, image):
+        """
+        cache sub directory of the scene, named from a hash of the archive directory so scenes with the same name in
+        different directories do not collide
+        """
+        source_dir = os.path.dirname(os.path.abspath(image))
+        return os.path.join(self.cache_dir, hashlib.sha1(source_dir.encode('utf-8')).hexdigest()[:16])
+
+    def localPath(self, image):
+        """
+        path of the cached copy of the scene (whether or not it has been staged yet)
+        """
+        if isArchiveMember(image):
+            return image
+        return os.path.join(self.localDir(image), os.path.basename(image))
+
+    def sourceFiles(self, image):
+        """
+        the scene and its sidecar files e.g. scene.img, scene.rrd, scene.ige, scene.img.aux.xml and its COG copy scene.tif
+        """
+        stem = os.path.splitext(image)[0]
+        files = set(f for f in glob.glob(glob.escape(stem) + '.*') if not f.endswith('.part'))
+        files.add(image)
+        return sorted(files)
+
+    def isValid(self, image, entry):
+        """
+        True if the cached copy exists and the archive scene has not changed since it was copied
+        """
+        if entry is None or not os.path.isfile(entry['local']):
+            return False
+        try:
+            st = os.stat(image)
+        except OSError:
+            # the archive is not reachable, use the cached copy
+            return True
+        return st.st_size == entry['size'] and int(st.st_mtime) == entry['mtime']
+
+    def stage(self, image):
+        """
+        copy the scene and its sidecar files into the cache if there is no valid cached copy, returns the local path
+        """
+        key = os.path.abspath(image)
+        with self.lock:
+            entry = self.index.get(key)
+
+        if self.isValid(image, entry):
+            report.hit('scene_cache')
+            with self.lock:
+                entry['last_used'] = time.time()
+            return entry['local']
+
+        report.hit('scene_cache', False)
+        local_dir = self.localDir(image)
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir, exist_ok=True)
+
+        nbytes = 0
+        with report.stage('scene_stage', job=image):
+            for src in self.sourceFiles(image):
+                dst = os.path.join(local_dir, os.path.basename(src))
+                # copy to a temp name first so a partial copy is never used, the modification times are kept so a
+                # cached COG copy is still newer than its scene
+                shutil.copy2(src, dst + '.part')
+                os.replace(dst + '.part', dst)
+                nbytes += os.path.getsize(dst)
+        report.count('scene_cache_bytes_staged', nbytes)
+
+        st = os.stat(image)
+        entry = {'local': self.localPath(image), 'size': st.st_size, 'mtime': int(st.st_mtime),
+                 'bytes': nbytes, 'last_used': time.time()}
+
+        with self.lock:
+            self.index[key] = entry
+            self.evict(keep=key)
+            self.save()
+
+        return entry['local']
+
+    def submit(self, image):
+        """
+        stage the scene on the thread pool unless it is already being staged, returns the future of the local path.
+        Must be called with the lock held.
+        """
+        key = os.path.abspath(image)
+        future = self.pending.get(key)
+        if future is None:
+            future = self.executor.submit(self.stage, image)
+            self.pending[key] = future
+            future.add_done_callback(lambda f: self.done(key, f))
+        return future
+
+    def done(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+    def prefetch(self, images):
+        """
+        stage the scenes on the background thread pool, scenes already cached or being staged are skipped
+        """
+        with self.lock:
+            for image in images:
+                if not isArchiveMember(image):
+                    self.submit(image)
+
+    def path(self, image):
+        """
+        return the local path of the scene, waiting for it to be staged if it is not already in the cache. Threads
+        asking for the same scene wait for the same copy.
+        """
+        if isArchiveMember(image):
+            return image
+
+        with self.lock:
+            future = self.submit(image)
+
+        with report.stage('scene_cache_wait'):
+            return future.result()
+
+    def evict(self, keep=None):
+        """
+        remove the least recently used scenes until the cache is under its size cap, must be called with the lock held
+        """
+        total = sum(e['bytes'] for e in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep or key in self.pending:
+                continue
+
+            entry = self.index.pop(key)
+            stem = os.path.splitext(entry['local'])[0]
+            for f in glob.glob(glob.escape(stem) + '.*'):
+                try:
+                    os.remove(f)
+                except OSError:
+                    # still open (e.g. on windows), it is left for a later eviction
+                    pass
+            total -= entry['bytes']
+            report.count('scene_cache_evict')
+
+    def save(self):
+        """
+        write the cache index, must be called with the lock held
+        """
+        with open(self.index_file + '.part', 'w') as output:
+            json.dump(self.index, output)
+        os.replace(self.index_file + '.part', self.index_file)
+
+    def close(self):
+        """
+        wait for the prefetches in progress and write the index
+        """
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.pending = {}
+            self.save()
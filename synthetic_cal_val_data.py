@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""
+Generate synthetic inputs for the cal/val workflow so the zonal statistics, file listing, site/image matching and
+fractional cover calculations can be run and timed without access to the satellite archive (Z:/Landsat/wrs2/) or the
+rangeland monitoring observational spreadsheets.
+
+The script creates:
+    - multi band DIL style scenes (GeoTIFF or ERDAS Imagine) named and stored as they are in the wrs2 archive
+      e.g. wrs2/103_077/2018/201807/l7tmre_p103r077_20180725_dilm3_zstdmask.img
+    - a field site polygon shapefile carrying the attributes used by zonal_stats_single_cal_val_local.py
+    - a dataframe of transect intercepts matching the layout read from the observational spreadsheets
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+import fiona
+from fiona.crs import CRS
+from shapely.geometry import box, mapping
+from acquisition_calendar import cycleDay
+
+
+# the dil products are 4 band, 30 m, uint8 with the standard mask set to 0
+PIXEL_SIZE = 30
+NUM_BANDS = 4
+NODATA = 0
+
+# intercept classes used on the transect tabs of the observational spreadsheets
+GROUND_LAYER = ['BARE GROUND', 'GRAVEL', 'ROCK', 'ASH', 'CRYPTOGRAM', 'LITTER', 'GREEN ANNUAL GRASS', 'GREEN PERENNIAL GRASS',
+                'GREEN ANNUAL FORB / HERB', 'GREEN PERENNIAL FORB / HERB', 'GREEN PLANT', 'DEAD ANNUAL GRASS',
+                'DEAD PERENNIAL GRASS', 'DEAD ANNUAL FORB / HERB', 'DEAD PERENNIAL FORB / HERB', 'DEAD PLANT']
+BELOW = ['BELOW - GREEN', 'BELOW - BROWN', 'BELOW - DEAD', 'SUBSHRUB - GREY', 'BLANK']
+ABOVE = ['ABOVE - GREEN', 'ABOVE - BROWN', 'ABOVE - DEAD', 'ABOVE - IN CROWN', 'BLANK']
+
+# schema of the buffered field site shapefile (nt_rm_fieldSite_..._wrs2sj_buff_...shp)
+SITE_SCHEMA = {'geometry': 'Polygon',
+               'properties': {'uid': 'int', 'uid_2': 'int', 'Station': 'str', 'Site': 'str', 'Date': 'str',
+                              'C_Lat': 'float', 'C_Lon': 'float', 'NO_Lat': 'float', 'NO_Lon': 'float',
+                              'ba_trees': 'float', 'ba_shrubs': 'float', 'ba_total': 'float', 'FPC': 'float',
+                              'PPC': 'float', 'CC': 'float', 'PVg': 'float', 'NPVg': 'float', 'BGg': 'float',
+                              'PV': 'float', 'NPV': 'float', 'BG': 'float', 'PATH': 'int', 'ROW': 'int',
+                              'WRSPR': 'int', 'ACQDayL7': 'int', 'ACQDayL8': 'int'}}
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Generate a synthetic wrs2 directory tree of DIL scenes and a matching field site shapefile to run and benchmark the cal/val scripts locally.""")
+
+    p.add_argument("-d","--direc", help="Path to the directory to write the synthetic data into")
+
+    p.add_argument("-i","--images", type=int, default=8, help="number of scenes to create (default is %(default)s)")
+
+    p.add_argument("-s","--sites", type=int, default=20, help="number of field sites to create (default is %(default)s)")
+
+    p.add_argument("-p","--pixels", type=int, default=1000, help="width and height of each scene in pixels (default is %(default)s)")
+
+    p.add_argument("-f","--format", default="HFA", help="raster driver, HFA (ERDAS Imagine) or GTiff (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    if cmdargs.direc is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    return cmdargs
+
+
+def sceneName(sensor, path, row, date, zone):
+    """
+    build a scene file name following the archive naming convention e.g. l7tmre_p103r077_20180725_dilm3_zstdmask.img
+    """
+    return '%s_p%03dr%03d_%s_dilm%s_zstdmask.img' % (sensor, path, row, date.strftime('%Y%m%d'), zone)
+
+
+def scenePath(root, sensor, path, row, date, zone):
+    """
+    build the full path of a scene inside a wrs2 style directory tree i.e. root/103_077/2018/201807/scene
+    """
+    dirname = os.path.join(root, '%s_%03d' % (path, row), date.strftime('%Y'), date.strftime('%Y%m'))
+    return os.path.join(dirname, sceneName(sensor, path, row, date, zone))
+
+
+def sceneCrs(zone):
+    """
+    return the WGS84 UTM south crs used for the given dilm zone number (2 = 52, 3 = 53, 4 = 54)
+    """
+    return 'EPSG:3275' + str(zone)
+
+
+def makeScene(image, width, height, origin, zone=3, bands=NUM_BANDS, driver='HFA', seed=0, cloud=0.1):
+    """
+    write a synthetic multi band uint8 DIL scene, a fraction (cloud) of the scene is set to the no data value to
+    mimic the standard mask.
+    """
+    rng = np.random.default_rng(seed)
+
+    dirname = os.path.dirname(image)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    profile = {'driver': driver, 'width': width, 'height': height, 'count': bands, 'dtype': 'uint8',
+               'crs': sceneCrs(zone), 'transform': from_origin(origin[0], origin[1], PIXEL_SIZE, PIXEL_SIZE),
+               'nodata': NODATA}
+
+    # blocky masked areas so that the no data behaves like cloud and shadow rather than salt and pepper
+    block = 32
+    mask = rng.random((height // block + 1, width // block + 1)) < cloud
+    mask = np.kron(mask, np.ones((block, block), dtype=bool))[:height, :width]
+
+    with rasterio.open(image, 'w', **profile) as dst:
+        for band in range(1, bands + 1):
+            data = rng.integers(100, 200, size=(height, width), dtype=np.uint8)
+            data[mask] = NODATA
+            dst.write(data, band)
+
+    return image
+
+
+def makeWrs2Tree(root, num_images, width=1000, height=1000, path_rows=((103, 77),), zone=3, driver='HFA', start='2018-07-01', seed=0):
+    """
+    create a wrs2 style directory tree of synthetic scenes with a 16 day revisit per path/row alternating between
+    landsat 7 and 8, returns a dataframe of the scene paths with path_row, img_date and the scene origin.
+    """
+    start = datetime.datetime.strptime(start, '%Y-%m-%d')
+    records = []
+
+    for i in range(num_images):
+        path, row = path_rows[i % len(path_rows)]
+        revisit = i // len(path_rows)
+        sensor = 'l7tmre' if revisit % 2 == 0 else 'l8olre'
+        date = start + datetime.timedelta(days=8 * (revisit % 2) + 16 * (revisit // 2))
+        origin = sceneOrigin(path, row)
+
+        image = scenePath(root, sensor, path, row, date, zone)
+        makeScene(image, width, height, origin, zone=zone, driver=driver, seed=seed + i)
+        records.append([image, '%s_%03d' % (path, row), date.strftime('%Y-%m-%d'), origin[0], origin[1]])
+
+    return pd.DataFrame(records, columns=['image', 'path_row', 'img_date', 'ulx', 'uly'])
+
+
+def sceneOrigin(path, row):
+    """
+    return an upper left coordinate for a synthetic path/row so adjacent path/rows do not share an origin
+    """
+    return (500000.0 + (path - 100) * 150000.0, 7500000.0 - (row - 70) * 150000.0)
+
+
+def makeSiteLayer(shape, num_sites, images, width=1000, height=1000, site_pixels=(3, 5), zone=3, days=15, seed=0):
+    """
+    write a field site polygon shapefile in the scene projection with the attribute table used by the zonal stats
+    scripts, sites are square buffers of 3 to 5 pixels placed inside the footprint of the given scenes.
+    """
+    rng = np.random.default_rng(seed)
+    footprints = images.drop_duplicates('path_row').reset_index(drop=True)
+
+    dirname = os.path.dirname(shape)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    with fiona.open(shape, 'w', driver='ESRI Shapefile', crs=CRS.from_user_input(sceneCrs(zone)), schema=SITE_SCHEMA) as dst:
+        for uid in range(num_sites):
+            scene = footprints.iloc[uid % len(footprints)]
+            path, row = [int(x) for x in scene['path_row'].split('_')]
+
+            # the cycle days of the synthetic revisits of the path/row on the acquisition calendar
+            scenes = images[images['path_row'] == scene['path_row']]
+            acq_days = dict((sensor, cycleDay(scenes[scenes['image'].str.contains(sensor)]['img_date'].min()) if scenes['image'].str.contains(sensor).any() else 0)
+                            for sensor in ['l7tmre', 'l8olre'])
+            size = int(rng.integers(site_pixels[0], site_pixels[1] + 1)) * PIXEL_SIZE
+            col = int(rng.integers(10, width - 10 - site_pixels[1]))
+            line = int(rng.integers(10, height - 10 - site_pixels[1]))
+            minx = scene['ulx'] + col * PIXEL_SIZE
+            maxy = scene['uly'] - line * PIXEL_SIZE
+
+            # field visits fall inside the period covered by the scenes so the +/- day window finds matches
+            dates = pd.to_datetime(images['img_date'])
+            visit = dates.min() + (dates.max() - dates.min()) * rng.random()
+            fractions = rng.dirichlet([1, 1, 1]) * 100
+
+            properties = {'uid': uid, 'uid_2': uid, 'Station': 'STN%03d' % uid, 'Site': 'SYN%03dA' % uid,
+                          'Date': visit.strftime('%d/%m/%Y'), 'C_Lat': -20.0 - rng.random(), 'C_Lon': 132.0 + rng.random(),
+                          'NO_Lat': -20.0 - rng.random(), 'NO_Lon': 132.0 + rng.random(), 'ba_trees': 0.0,
+                          'ba_shrubs': 0.0, 'ba_total': 0.0, 'FPC': float(rng.random() * 30), 'PPC': float(rng.random() * 30),
+                          'CC': float(rng.random() * 30), 'PVg': float(fractions[0]), 'NPVg': float(fractions[1]),
+                          'BGg': float(fractions[2]), 'PV': float(fractions[0]), 'NPV': float(fractions[1]),
+                          'BG': float(fractions[2]), 'PATH': path, 'ROW': row, 'WRSPR': path * 1000 + row,
+                          'ACQDayL7': acq_days['l7tmre'], 'ACQDayL8': acq_days['l8olre']}
+
+            dst.write({'geometry': mapping(box(minx, maxy - size, minx + size, maxy)), 'properties': properties})
+
+    return shape
+
+
+def makeObsIntercepts(num_sheets, seed=0):
+    """
+    create the concatenated transect dataframe built by frac_calcs_rm_field_obs_sheets.py, three transects of 100
+    intercepts (300 rows) per observational spreadsheet.
+    """
+    rng = np.random.default_rng(seed)
+    rows = num_sheets * 300
+
+    df = pd.DataFrame({'GROUND LAYER': rng.choice(GROUND_LAYER, rows),
+                       'BELOW': rng.choice(BELOW, rows),
+                       'ABOVE': rng.choice(ABOVE, rows),
+                       'uid': np.repeat(['SYN%03dA_2018-07-%02d' % (i, i % 28 + 1) for i in range(num_sheets)], 300)})
+
+    return df
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+    root = cmdargs.direc
+
+    images = makeWrs2Tree(os.path.join(root, 'wrs2'), cmdargs.images, cmdargs.pixels, cmdargs.pixels, driver=cmdargs.format)
+    shape = makeSiteLayer(os.path.join(root, 'sites', 'synthetic_fieldSite_wrs2_buff.shp'), cmdargs.sites, images,
+                          cmdargs.pixels, cmdargs.pixels)
+
+    print ('scenes written: ', len(images))
+    print ('site layer written: ', shape)
+
+
+if __name__ == "__main__":
+    mainRoutine()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""
+Keep the cal/val results current as new DIL scenes land in the archive. The wrs2 directory is polled every interval
+seconds for new scenes matching the file name pattern, and when there are new ones the image list (or the image
+catalogue with -m) is updated and cal_val_extract.py is run with it. The extractor's job manifest already holds the
+(site, image) jobs of the earlier runs, so only the pairs of the new scenes whose acquisition date falls within a site
+visit's +/- N day window are extracted and the output csv is rewritten with all the results.
+
+The archive share is polled (directory modification times are compared) rather than watched with inotify, which is
+not available for the Windows network share. Only the directories whose modification time changed since the last poll
+are listed again, the others are only stat'ed. A new scene is only used once it has not been modified for --settle
+seconds so a scene that is still being copied in is not read.
+
+The arguments not known to this script are passed on to cal_val_extract.py e.g.
+    python watch_extract.py -d Z:/Landsat/wrs2 -l imglist_dil.csv -i 600 -- -s nt_rm_fieldSite_2021_wrs2sj_buff.shp -n 15 -o cal_val_dil_data_2021_results30days.csv
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import csv
+import time
+import fnmatch
+import argparse
+import subprocess
+from image_catalogue import harvestCatalogue, readImageList
+from run_report import report
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Poll the wrs2 archive for new scenes and run cal_val_extract.py on the new (site, image) pairs as they arrive, the remaining arguments are passed on to cal_val_extract.py.""")
+
+    p.add_argument("-d","--direc", help="path to the wrs2 directory to watch")
+
+    p.add_argument("-e","--endfilen", default="*dilm[2-4]_zstdmask.img", help="end of the scene file names to watch for (default is %(default)s)")
+
+    p.add_argument("-l","--imglist", help="image list csv kept up to date with the scenes found and passed to cal_val_extract.py -l, the scenes already in it are not new")
+
+    p.add_argument("-m","--metadata", action="store_true", help="keep the image list as an image catalogue with the georeferencing of each scene (image_catalogue.py)")
+
+    p.add_argument("-w","--workers", type=int, default=8, help="with -m the number of scene headers read at the same time (default is %(default)s)")
+
+    p.add_argument("-i","--interval", type=float, default=600, help="seconds between polls of the archive (default is %(default)s)")
+
+    p.add_argument("--settle", type=float, default=300, help="seconds a new scene must be unmodified for before it is used (default is %(default)s)")
+
+    p.add_argument("--once", action="store_true", help="poll the archive and run the extraction once rather than watching")
+
+    cmdargs, extract_args = p.parse_known_args()
+
+    if cmdargs.direc is None or cmdargs.imglist is None:
+
+        p.print_help()
+
+        sys.exit()
+
+    if extract_args and extract_args[0] == '--':
+        extract_args = extract_args[1:]
+
+    return cmdargs, extract_args
+
+
+class ArchiveWatcher(object):
+    """
+    find the scenes of a directory tree matching a file name pattern, listing again only the directories modified
+    since the last poll
+    """
+
+    def __init__(self, root, endfilename):
+        self.root = root
+        self.endfilename = endfilename
+        # directory -> (modification time, sub directories, matching files)
+        self.dirs = {}
+
+    def scanDir(self, dirname):
+        """
+        the matching files of the directory and its sub directories
+        """
+        try:
+            mtime = os.stat(dirname).st_mtime
+        except OSError:
+            self.dirs.pop(dirname, None)
+            return []
+
+        cached = self.dirs.get(dirname)
+        if cached is not None and cached[0] == mtime:
+            subdirs, files = cached[1], cached[2]
+            report.count('watch_dirs_unchanged')
+        else:
+            subdirs, files = [], []
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif fnmatch.fnmatch(entry.name, self.endfilename):
+                        files.append(entry.path)
+            self.dirs[dirname] = (mtime, sorted(subdirs), sorted(files))
+            report.count('watch_dirs_listed')
+
+        found = list(files)
+        for subdir in subdirs:
+            found += self.scanDir(subdir)
+        return found
+
+    def poll(self):
+        """
+        all the matching files of the tree
+        """
+        with report.stage('watch_poll'):
+            return self.scanDir(self.root)
+
+
+def settled(image, settle):
+    """
+    True if the scene has not been modified for settle seconds
+    """
+    try:
+        return time.time() - os.path.getmtime(image) >= settle
+    except OSError:
+        return False
+
+
+def writeImageList(path, list_img, metadata=False, workers=8, previous=None):
+    """
+    write the image list, or the image catalogue reusing the records of the previous catalogue
+    """
+    if metadata:
+        catalogue = harvestCatalogue(list_img, workers, previous)
+        catalogue.to_csv(path + '.part', index=False)
+    else:
+        with open(path + '.part', 'w') as output:
+            writer = csv.writer(output, lineterminator='\n')
+            for file in list_img:
+                writer.writerow([file])
+    os.replace(path + '.part', path)
+
+
+def runExtraction(imglist, extract_args):
+    """
+    run cal_val_extract.py with the image list, returns its exit code
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cal_val_extract.py')
+    with report.stage('watch_extract'):
+        return subprocess.call([sys.executable, script, '-l', imglist] + list(extract_args))
+
+
+def mainRoutine():
+
+    cmdargs, extract_args = getCmdargs()
+
+    # the scenes already in the image list are not new
+    known, catalogue = [], None
+    if os.path.isfile(cmdargs.imglist):
+        known, catalogue = readImageList(cmdargs.imglist)
+    known = [str(x) for x in known]
+    print ('scenes in the image list: ', len(known))
+
+    watcher = ArchiveWatcher(cmdargs.direc, cmdargs.endfilen)
+    first = True
+
+    try:
+        while True:
+            seen = set(known)
+            new = [img for img in watcher.poll() if img not in seen]
+            ready = [img for img in new if settled(img, cmdargs.settle)]
+            report.count('watch_new_scenes', len(ready))
+            if len(ready) < len(new):
+                print ('scenes still being copied: ', len(new) - len(ready))
+
+            if ready or first:
+                known += ready
+                print ('new scenes: ', len(ready), ' scenes: ', len(known))
+
+                writeImageList(cmdargs.imglist, known, cmdargs.metadata, cmdargs.workers, catalogue)
+                if cmdargs.metadata:
+                    known, catalogue = readImageList(cmdargs.imglist)
+                    known = [str(x) for x in known]
+
+                code = runExtraction(cmdargs.imglist, extract_args)
+                if code != 0:
+                    print ('cal_val_extract.py exited with ', code)
+                first = False
+
+            if cmdargs.once:
+                break
+
+            time.sleep(cmdargs.interval)
+
+    except KeyboardInterrupt:
+        print ('stopped watching')
+
+
+if __name__ == "__main__":
+    mainRoutine()
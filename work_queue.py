@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""
+Shared work queue of (site, image) jobs in a SQLite database on the common file system, so the extraction of a large
+run can be spread over worker processes (queue_worker.py) on several hosts without a cluster scheduler. The extractor
+(cal_val_extract.py --work-queue) publishes the outstanding jobs of a run, any number of workers claim, run and complete
+them, and the extractor collects the results once every job of the run is finished.
+
+Each job is claimed in a single write transaction (BEGIN IMMEDIATE) so two workers never claim the same job. A claimed
+job holds a lease that the worker renews while the job runs, the job of a worker that crashed or lost the share is
+claimed again by another worker once its lease expires. The lease and retry backoff of each job are set by the run that
+published it. A failed job is not claimed again until its backoff (doubled for each further attempt) has passed, and is
+failed once it has been attempted retries times.
+
+    jobs: id, run (the output csv and parameter digest of the run), uid, image, payload (json of the job and its options), status
+          (pending/running/done/skipped/failed), attempts, retries, lease, backoff, not_before, worker, lease_until, result,
+          error, updated
+
+The database uses the default rollback journal rather than WAL, WAL needs shared memory and does not work across hosts.
+
+e.g.
+    queue = WorkQueue('Z:/cal_val/work_queue.db')
+    job = queue.claim('host1-1234')
+    ...
+    queue.complete(job['id'], 'host1-1234', result_csv)
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import json
+import time
+import sqlite3
+import threading
+import datetime
+from run_report import report
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    image TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 3,
+    lease REAL,
+    backoff REAL NOT NULL DEFAULT 0,
+    not_before REAL,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    updated TEXT,
+    UNIQUE (run, uid, image)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+"""
+
+# the columns added to the jobs table since it was first made, added to the tables of older queue databases
+COLUMNS = [('lease', 'REAL'), ('backoff', 'REAL NOT NULL DEFAULT 0'), ('not_before', 'REAL')]
+
+
+class WorkQueue(object):
+    """
+    SQLite backed queue of (site, image) jobs with leases
+    """
+
+    def __init__(self, path, lease=600, timeout=60):
+        self.path = path
+        # the lease of the jobs published without one
+        self.lease = lease
+        # the connection is shared with the lease renewal thread of the worker
+        self.lock = threading.RLock()
+        # autocommit, the transactions are begun explicitly
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.transaction(self.addColumns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def transaction(self, func):
+        """
+        run func(db) in a write transaction taken before any read so the read and update are atomic
+        """
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(self.db)
+                self.db.execute('COMMIT')
+                return result
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def addColumns(self, db):
+        """
+        add the columns missing from the jobs table of a queue database made by an older version
+        """
+        have = set(r['name'] for r in db.execute("PRAGMA table_info(jobs)").fetchall())
+        for name, kind in COLUMNS:
+            if name not in have:
+                db.execute("ALTER TABLE jobs ADD COLUMN %s %s" % (name, kind))
+
+    def publish(self, run, jobs, retries=3, lease=None, backoff=0):
+        """
+        add the jobs (dictionaries with uid and image, stored as the payload) of the run and queue them to be run, with
+        the seconds a worker holds each job for without renewing it (the queue's lease if None) and the seconds before
+        the first retry of a failed job. A job already in the queue is queued again with the new payload whatever its
+        status (e.g. done by an earlier run whose results were removed) unless it is running. Returns the number of jobs
+        queued.
+        """
+        now = datetime.datetime.now().isoformat()
+        lease = self.lease if lease is None else lease
+        # every job is attempted at least once
+        retries = max(int(retries), 1)
+        rows = [(run, str(job['uid']), str(job['image']), json.dumps(job, default=str), retries, lease, backoff, now) for job in jobs]
+
+        def add(db):
+            db.executemany("INSERT OR IGNORE INTO jobs (run, uid, image, payload, retries, lease, backoff, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            cur = db.executemany("UPDATE jobs SET status = 'pending', attempts = 0, retries = ?, lease = ?, backoff = ?, not_before = NULL, payload = ?, "
+                                 "worker = NULL, lease_until = NULL, result = NULL, error = NULL, updated = ? "
+                                 "WHERE run = ? AND uid = ? AND image = ? AND status != 'running'",
+                                 [(r[4], r[5], r[6], r[3], now, r[0], r[1], r[2]) for r in rows])
+            return cur.rowcount
+
+        queued = self.transaction(add)
+        report.count('queue_published', queued)
+        return queued
+
+    def claim(self, worker):
+        """
+        claim the next pending job past its retry backoff, or a running job whose lease has expired, returns the job
+        dictionary (the payload with the queue id, run, attempt and lease) or None if there is nothing to run
+        """
+        def take(db):
+            now = time.time()
+            row = db.execute("SELECT * FROM jobs WHERE ((status = 'pending' AND (not_before IS NULL OR not_before <= ?)) "
+                             "OR (status = 'running' AND lease_until < ?)) ORDER BY id LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                return None
+
+            if row['status'] == 'running':
+                report.count('queue_lease_expired')
+
+            if row['attempts'] >= row['retries']:
+                # the last attempt did not finish within its lease
+                db.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE id = ?",
+                           ('lease expired after %s attempts' % row['attempts'], datetime.datetime.now().isoformat(), row['id']))
+                return False
+
+            lease = self.lease if row['lease'] is None else row['lease']
+            db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, updated = ? WHERE id = ?",
+                       (worker, now + lease, datetime.datetime.now().isoformat(), row['id']))
+            job = json.loads(row['payload'])
+            job.update({'id': row['id'], 'run': row['run'], 'attempt': row['attempts'] + 1, 'retries': row['retries'], 'lease': lease})
+            return job
+
+        while True:
+            with report.stage('queue_claim'):
+                job = self.transaction(take)
+            if job is not False:
+                return job
+
+    def renew(self, job_id, worker):
+        """
+        extend the lease of a running job by the lease it was published with, False if the job is no longer held by the
+        worker
+        """
+        def extend(db):
+            cur = db.execute("UPDATE jobs SET lease_until = ? + COALESCE(lease, ?) WHERE id = ? AND worker = ? AND status = 'running'",
+                             (time.time(), self.lease, job_id, worker))
+            return cur.rowcount == 1
+
+        return self.transaction(extend)
+
+    def finish(self, job_id, worker, status, result='', error=''):
+        """
+        record the end of a job held by the worker, a failed job is queued again after its backoff (doubled for each
+        further attempt) until it has used its retries. Returns False if the job was claimed by another worker after
+        the lease expired.
+        """
+        def end(db):
+            row = db.execute("SELECT attempts, retries, backoff, worker, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row['worker'] != worker or row['status'] != 'running':
+                return False
+
+            new_status = status
+            not_before = None
+            if status == 'failed' and row['attempts'] < row['retries']:
+                new_status = 'pending'
+                not_before = time.time() + row['backoff'] * 2 ** (row['attempts'] - 1)
+
+            db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, not_before = ?, updated = ? WHERE id = ?",
+                       (new_status, result, error, not_before, datetime.datetime.now().isoformat(), job_id))
+            return True
+
+        return self.transaction(end)
+
+    def complete(self, job_id, worker, result):
+        return self.finish(job_id, worker, 'done', result=result)
+
+    def skip(self, job_id, worker, error='', result=''):
+        return self.finish(job_id, worker, 'skipped', result=result, error=error)
+
+    def fail(self, job_id, worker, error=''):
+        return self.finish(job_id, worker, 'failed', error=error)
+
+    def counts(self, run=None):
+        """
+        return the number of jobs for each status, of one run or of the whole queue
+        """
+        with self.lock:
+            return self.statusCounts(run)
+
+    def statusCounts(self, run=None):
+        if run is None:
+            rows = self.db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        else:
+            rows = self.db.execute("SELECT status, COUNT(*) AS n FROM jobs WHERE run = ? GROUP BY status", (run,)).fetchall()
+        return dict((r['status'], r['n']) for r in rows)
+
+    def jobs(self, run):
+        """
+        the queue records of the jobs of a run
+        """
+        with self.lock:
+            return [dict(r) for r in self.db.execute("SELECT * FROM jobs WHERE run = ? ORDER BY id", (run,)).fetchall()]
+
+    def wait(self, run, poll=30):
+        """
+        wait until every job of the run is done, skipped or failed, returns the counts
+        """
+        while True:
+            counts = self.counts(run)
+            if counts.get('pending', 0) + counts.get('running', 0) == 0:
+                return counts
+            print ('queue: ', counts)
+            with report.stage('queue_wait'):
+                time.sleep(poll)
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+
+"""
+Label raster zonal statistics engine. Rather than rasterising and masking one polygon at a time (rasterstats), all of
+the site polygons for an image are burnt into one integer label raster covering the union window of the sites and the
+count, sum, sum of squares, min, max, median (and any percentiles or histogram counts) of every zone are derived at once
+with np.bincount and a single sort of the valid pixels by (label, value).
+
+The zone results are dictionaries with the same keys and types as rasterstats.zonal_stats returns so they can be used
+in place of it by zonal_stats_single_cal_val_local.applyZonalstats (engine='label').
+
+Polygons that overlap are burnt into separate label rasters (layers) so each pixel is still counted in every zone it
+falls in, as it is by rasterstats.
+
+The rasterised mask of each polygon is cached (mask_cache) keyed on the geometry, crs, pixel size, grid phase (the
+scene origin modulo the pixel size) and all_touched. All the images of a WRS-2 path/row in the same UTM zone share the
+30 m grid, so a site matched to 40 images (and 4 bands each) is rasterised once and its mask placed into the label
+raster of each image by a pixel offset.
+
+The exact engine (exactZonalstats, engine='exact') weights each pixel by the fraction of it covered by the polygon rather
+than counting it in or out (all_touched), which matters for 3 x 3 pixel sites where the edge pixels are half the sample.
+The coverage fractions are cached (coverage_cache) in the same way as the masks so they are worked out once per site
+and grid and reused for every band and image.
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import math
+import threading
+import collections
+import numpy as np
+import shapely
+from affine import Affine
+from rasterio.features import rasterize
+from rasterio.windows import Window
+from shapely.geometry import shape as asShape, mapping
+from shapely.affinity import translate
+from run_report import report
+
+
+class MaskCache(object):
+    """
+    least recently used cache of rasterised polygon masks, each mask is stored with the map coordinates of its upper
+    left corner so it can be placed into any raster on the same grid. The cache is shared by the pipeline worker
+    threads, the lookups and changes are made under a lock.
+    """
+
+    name = 'mask_cache'
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.masks = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def make(self, geom, affine, all_touched, phase):
+        return rasterizeMask(geom, affine, all_touched, phase)
+
+    def clear(self):
+        with self.lock:
+            self.masks.clear()
+
+    def key(self, geom, crs, affine, all_touched):
+        """
+        cache key of the polygon on the grid of the affine transform, rasters with origins a whole number of pixels
+        apart share the grid phase
+        """
+        phase = (round(affine.c % affine.a, 6), round(affine.f % abs(affine.e), 6))
+        return (geom.wkb, str(crs), affine.a, affine.e, phase, bool(all_touched))
+
+    def get(self, geom, crs, affine, all_touched):
+        """
+        return (mask, x0, y0) the rasterised mask of the polygon on the grid of the affine transform and the map
+        coordinates of the upper left corner of the mask
+        """
+        key = self.key(geom, crs, affine, all_touched)
+        with self.lock:
+            entry = self.masks.get(key)
+            if entry is not None:
+                self.masks.move_to_end(key)
+        if entry is not None:
+            report.hit(self.name)
+            return entry
+
+        # made outside the lock so the other threads are not held up, two threads may both make a missing entry
+        report.hit(self.name, False)
+        entry = self.make(geom, affine, all_touched, key[4])
+        with self.lock:
+            self.masks[key] = entry
+            self.masks.move_to_end(key)
+            while len(self.masks) > self.maxsize:
+                self.masks.popitem(last=False)
+
+        return entry
+
+
+def rasterizeMask(geom, affine, all_touched, phase):
+    """
+    rasterise the polygon on the grid with the pixel size of the affine transform and the given phase, the mask is
+    trimmed to the pixels inside the polygon.
+    """
+    a, e = affine.a, affine.e
+    minx, miny, maxx, maxy = geom.bounds
+
+    # grid aligned origin one pixel outside the polygon bounds
+    x0 = phase[0] + (math.floor((minx - phase[0]) / a) - 1) * a
+    y0 = phase[1] + (math.ceil((maxy - phase[1]) / abs(e)) + 1) * abs(e)
+    width = int(math.ceil((maxx - x0) / a)) + 1
+    height = int(math.ceil((y0 - miny) / abs(e))) + 1
+
+    mask = rasterize([(geom, 1)], out_shape=(height, width), transform=Affine(a, 0, x0, 0, e, y0), fill=0,
+                     all_touched=all_touched, dtype='uint8').astype(bool)
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        return mask[:0, :0], x0, y0
+
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return mask, x0 + cols[0] * a, y0 + rows[0] * e
+
+
+class CoverageCache(MaskCache):
+    """
+    least recently used cache of the fraction of each pixel covered by a polygon, stored and keyed in the same way as
+    the masks of MaskCache (all_touched is not used)
+    """
+
+    name = 'coverage_cache'
+
+    def key(self, geom, crs, affine, all_touched):
+        return MaskCache.key(self, geom, crs, affine, False)
+
+    def make(self, geom, affine, all_touched, phase):
+        return coverageFraction(geom, affine, phase)
+
+
+def coverageFraction(geom, affine, phase):
+    """
+    the exact fraction (0 - 1) of each pixel of the grid with the pixel size of the affine transform and the given phase
+    covered by the polygon, from the area of the intersection of the polygon with each pixel. Returns (fraction, x0, y0)
+    trimmed to the pixels the polygon touches.
+    """
+    a, e = affine.a, affine.e
+    if geom.is_empty:
+        return np.zeros((0, 0)), phase[0], phase[1]
+
+    minx, miny, maxx, maxy = geom.bounds
+    x0 = phase[0] + math.floor((minx - phase[0]) / a) * a
+    y0 = phase[1] + math.ceil((maxy - phase[1]) / abs(e)) * abs(e)
+    width = max(int(math.ceil((maxx - x0) / a)), 1)
+    height = max(int(math.ceil((y0 - miny) / abs(e))), 1)
+
+    cols, rows = np.meshgrid(np.arange(width), np.arange(height))
+    left = x0 + cols * a
+    top = y0 + rows * e
+    pixels = shapely.box(left, top + e, left + a, top)
+
+    shapely.prepare(geom)
+    fraction = shapely.area(shapely.intersection(pixels, geom)) / (a * abs(e))
+
+    return np.clip(fraction, 0.0, 1.0), x0, y0
+
+
+def weightedQuantile(values, weights, q):
+    """
+    weighted quantile (q 0 - 100) of values sorted in ascending order, interpolated between the values at the positions
+    (cumulative weight - weight) / (total weight - last weight) so it is numpy's linear percentile when every weight is 1
+    """
+    cum = np.cumsum(weights)
+    span = cum[-1] - weights[-1]
+    if span <= 0:
+        return float(values[0])
+    return float(np.interp(q / 100.0, (cum - weights) / span, values))
+
+
+def exactZonalstats(features, array, affine, nodata=None, percentiles=None, bins=None, crs=None, cache=None, shift=(0, 0)):
+    """
+    area weighted zonal stats of each feature over the array with the given affine transform, every valid pixel is
+    weighted by the fraction of it covered by the polygon (coverage_cache). Returns rasterstats like zone result
+    dictionaries in feature order where count is the number of valid pixels the polygon covers any part of and area is
+    their covered area in pixels, mean and std are weighted, the median and percentiles are weighted quantiles, min and
+    max are of the pixels the polygon covers and the histogram counts are the number of those pixels in each bin.
+    shift moves every polygon by whole pixels (columns, rows).
+    """
+    if cache is None:
+        cache = coverage_cache
+
+    zones = [dict(emptyZone(percentiles, bins), area=0.0) for f in features]
+    if array.size == 0:
+        return zones
+
+    valid = np.ones(array.shape, dtype=bool)
+    if nodata is not None:
+        valid &= array != nodata
+    if np.issubdtype(array.dtype, np.floating):
+        valid &= ~np.isnan(array)
+
+    for i, f in enumerate(features):
+        geom = asShape(f['geometry'])
+        if geom.is_empty:
+            continue
+
+        fraction, x0, y0 = cache.get(geom, crs, affine, False)
+
+        # the part of the coverage inside the array at the pixel offset of the polygon
+        col = int(round((x0 - affine.c) / affine.a)) + shift[0]
+        row = int(round((y0 - affine.f) / affine.e)) + shift[1]
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + fraction.shape[0], array.shape[0]), min(col + fraction.shape[1], array.shape[1])
+        if r1 <= r0 or c1 <= c0:
+            continue
+
+        w = fraction[r0 - row:r1 - row, c0 - col:c1 - col]
+        sel = (w > 0) & valid[r0:r1, c0:c1]
+        if not sel.any():
+            continue
+
+        w = w[sel]
+        vals = array[r0:r1, c0:c1][sel].astype('float64')
+        order = np.argsort(vals, kind='stable')
+        vals, w = vals[order], w[order]
+
+        total = w.sum()
+        mean = float((w * vals).sum() / total)
+        zone = zones[i]
+        zone.update({'count': int(vals.size), 'area': float(total), 'min': float(vals[0]), 'max': float(vals[-1]), 'mean': mean,
+                     'median': weightedQuantile(vals, w, 50),
+                     'std': float(math.sqrt(max((w * (vals - mean) ** 2).sum() / total, 0.0)))})
+
+        for q in (percentiles or []):
+            zone['p' + format(q, 'g')] = weightedQuantile(vals, w, q)
+
+        if bins is not None and len(bins) > 1:
+            nbins = len(bins) - 1
+            idx = np.searchsorted(bins, vals, side='right') - 1
+            idx[vals == bins[-1]] = nbins - 1
+            inside = (idx >= 0) & (idx < nbins)
+            zone['hist'] = [int(x) for x in np.bincount(idx[inside], minlength=nbins)]
+
+    return zones
+
+
+# masks and coverage fractions shared by every image processed in the run
+mask_cache = MaskCache()
+coverage_cache = CoverageCache()
+
+
+def unionWindow(srci, features, pad=1):
+    """
+    return the raster window covering the union of the feature bounds (plus pad pixels) clipped to the raster extent,
+    the window has a zero width or height if the features fall outside the raster.
+    """
+    bounds = np.array([asShape(f['geometry']).bounds for f in features])
+    if len(bounds) == 0:
+        return Window(0, 0, 0, 0)
+
+    minx, miny = bounds[:, 0].min(), bounds[:, 1].min()
+    maxx, maxy = bounds[:, 2].max(), bounds[:, 3].max()
+
+    inverse = ~srci.transform
+    cols, rows = zip(inverse * (minx, maxy), inverse * (maxx, miny))
+
+    col0 = max(int(math.floor(min(cols))) - pad, 0)
+    row0 = max(int(math.floor(min(rows))) - pad, 0)
+    col1 = min(int(math.ceil(max(cols))) + pad, srci.width)
+    row1 = min(int(math.ceil(max(rows))) + pad, srci.height)
+
+    return Window(col0, row0, max(col1 - col0, 0), max(row1 - row0, 0))
+
+
+def bufferTags(buffers, rings=False):
+    """
+    column tags of the buffer distances e.g. [30, 60] gives ['_b30', '_b60']. With rings the distances are sorted, the
+    first is the buffered polygon and the others the rings between distances e.g. [0, 30, 60] gives
+    ['_b0', '_r0_30', '_r30_60'].
+    """
+    if rings:
+        edges = sorted(buffers)
+        return ['_b' + format(edges[0], 'g')] + ['_r' + format(lo, 'g') + '_' + format(hi, 'g') for lo, hi in zip(edges[:-1], edges[1:])]
+    return ['_b' + format(d, 'g') for d in buffers]
+
+
+def bufferFeatures(features, buffers, rings=False):
+    """
+    return a list of the features buffered by each distance (map units, negative shrinks the polygon) with the same
+    properties, one list for each tag of bufferTags. With rings each list after the first holds the ring between the
+    previous distance and the distance.
+    """
+    geoms = [asShape(f['geometry']) for f in features]
+    distances = sorted(buffers) if rings else list(buffers)
+
+    buffered = []
+    inner = None
+    for d in distances:
+        outer = [g.buffer(d) if d != 0 else g for g in geoms]
+        parts = outer if inner is None else [o.difference(i) for o, i in zip(outer, inner)]
+        buffered.append([{'type': 'Feature', 'properties': dict(f['properties']), 'geometry': mapping(g)}
+                         for f, g in zip(features, parts)])
+        if rings:
+            inner = outer
+
+    return buffered
+
+
+def outerFeatures(features, buffers):
+    """
+    the features buffered by the largest distance (the features themselves if no distance is positive), the window
+    read for them covers every buffer
+    """
+    if not buffers or max(buffers) <= 0:
+        return features
+    return bufferFeatures(features, [max(buffers)])[0]
+
+
+def shiftOffsets(pixels):
+    """
+    the (columns, rows) offsets of a grid of whole pixel shifts up to the given number of pixels in x and y, including
+    no shift e.g. 1 gives the 9 offsets from (-1, -1) to (1, 1)
+    """
+    return [(dx, dy) for dy in range(-pixels, pixels + 1) for dx in range(-pixels, pixels + 1)]
+
+
+def shiftFeatures(features, shift, affine):
+    """
+    return the features moved by whole pixels (columns, rows) of the affine transform, with the same properties
+    """
+    dx, dy = shift[0] * affine.a + shift[1] * affine.b, shift[0] * affine.d + shift[1] * affine.e
+    return [{'type': 'Feature', 'properties': dict(f['properties']), 'geometry': mapping(translate(asShape(f['geometry']), dx, dy))}
+            for f in features]
+
+
+def labelLayers(geoms, pad=(0, 0)):
+    """
+    split the geometries into layers in which no two bounding boxes overlap, returns a list of lists of indexes. The
+    boxes are grown by pad (x, y), one pixel, so polygons in a layer can not touch the same pixel (e.g. with
+    all_touched). Empty geometries (e.g. a polygon shrunk away by a negative buffer) are left out.
+    """
+    layers = []
+    layer_bounds = []
+
+    for i, geom in enumerate(geoms):
+        if geom.is_empty:
+            continue
+        b = geom.bounds
+        b = (b[0] - pad[0], b[1] - pad[1], b[2] + pad[0], b[3] + pad[1])
+        for layer, boxes in zip(layers, layer_bounds):
+            if not any(b[0] < o[2] and o[0] < b[2] and b[1] < o[3] and o[1] < b[3] for o in boxes):
+                layer.append(i)
+                boxes.append(b)
+                break
+        else:
+            layers.append([i])
+            layer_bounds.append([b])
+
+    return layers
+
+
+def emptyZone(percentiles=None, bins=None):
+    """
+    zone result for a polygon with no valid pixels, as returned by rasterstats the count is zero and the other stats None
+    """
+    zone = {'count': 0, 'min': None, 'max': None, 'mean': None, 'median': None, 'std': None}
+    if percentiles or bins:
+        zone.update(dict(('p' + format(q, 'g'), None) for q in (percentiles or [])))
+        zone['hist'] = [0] * max(len(bins or []) - 1, 0)
+    return zone
+
+
+def segmentPercentile(values, starts, counts, q):
+    """
+    linearly interpolated percentile (numpy's default method) of each segment of values sorted within segments
+    """
+    pos = (counts - 1) * q / 100.0
+    lo = np.floor(pos).astype('int64')
+    hi = np.ceil(pos).astype('int64')
+    return values[starts + lo] + (values[starts + hi] - values[starts + lo]) * (pos - lo)
+
+
+def labelStats(labels, data, valid, num_zones, percentiles=None, bins=None):
+    """
+    derive the stats of zones 1..num_zones of the label raster from the valid pixels of data, returns a dictionary of
+    arrays (index 0 is the unlabelled background) with the count, sum, sum of squares, min, max, median, percentiles
+    and histogram counts of each zone.
+    """
+    sel = valid & (labels > 0)
+    lab = labels[sel].astype('int64')
+    vals = data[sel].astype('float64')
+
+    count = np.bincount(lab, minlength=num_zones + 1)
+    total = np.bincount(lab, weights=vals, minlength=num_zones + 1)
+    sumsq = np.bincount(lab, weights=vals * vals, minlength=num_zones + 1)
+
+    # one sort of the pixels by label then value gives the min, max and median segments of every zone
+    order = np.lexsort((vals, lab))
+    svals = vals[order]
+    starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+
+    has = count > 0
+    stats = {'count': count, 'sum': total, 'sumsq': sumsq,
+             'min': np.full(num_zones + 1, np.nan), 'max': np.full(num_zones + 1, np.nan),
+             'median': np.full(num_zones + 1, np.nan)}
+    stats['min'][has] = svals[starts[has]]
+    stats['max'][has] = svals[starts[has] + count[has] - 1]
+    stats['median'][has] = segmentPercentile(svals, starts[has], count[has], 50)
+
+    for q in (percentiles or []):
+        stats['p' + format(q, 'g')] = np.full(num_zones + 1, np.nan)
+        stats['p' + format(q, 'g')][has] = segmentPercentile(svals, starts[has], count[has], q)
+
+    # histogram counts of [edge, next edge), the last bin includes its upper edge
+    if bins is not None and len(bins) > 1:
+        nbins = len(bins) - 1
+        idx = np.searchsorted(bins, vals, side='right') - 1
+        idx[vals == bins[-1]] = nbins - 1
+        inside = (idx >= 0) & (idx < nbins)
+        stats['hist'] = np.bincount(lab[inside] * nbins + idx[inside], minlength=(num_zones + 1) * nbins).reshape(num_zones + 1, nbins)
+
+    return stats
+
+
+def labelRaster(geoms, layer, out_shape, affine, all_touched=False, crs=None, cache=None, shift=(0, 0)):
+    """
+    burn the polygons of a layer into a label raster (1..n in layer order), using the cached masks for north up rasters.
+    shift moves the polygons by whole pixels (columns, rows), a cached mask is placed at the shifted offset.
+    """
+    if cache is None or affine.b != 0 or affine.d != 0:
+        dx, dy = shift[0] * affine.a + shift[1] * affine.b, shift[0] * affine.d + shift[1] * affine.e
+        return rasterize([(translate(geoms[i], dx, dy), n + 1) for n, i in enumerate(layer)], out_shape=out_shape,
+                         transform=affine, fill=0, all_touched=all_touched, dtype='int32')
+
+    labels = np.zeros(out_shape, dtype='int32')
+
+    for n, i in enumerate(layer):
+        mask, x0, y0 = cache.get(geoms[i], crs, affine, all_touched)
+
+        # place the mask into the label raster by its pixel offset, clipped to the raster
+        col = int(round((x0 - affine.c) / affine.a)) + shift[0]
+        row = int(round((y0 - affine.f) / affine.e)) + shift[1]
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + mask.shape[0], out_shape[0]), min(col + mask.shape[1], out_shape[1])
+        if r1 <= r0 or c1 <= c0:
+            continue
+
+        sub = mask[r0 - row:r1 - row, c0 - col:c1 - col]
+        labels[r0:r1, c0:c1][sub] = n + 1
+
+    return labels
+
+
+def labelZonalstats(features, array, affine, nodata=None, all_touched=False, percentiles=None, bins=None, crs=None, cache=mask_cache, shift=(0, 0)):
+    """
+    zonal stats of each feature over the array (the band or the union window of the features read from it) with the
+    given affine transform, returns a list of zone result dictionaries in feature order. The polygon masks are taken
+    from the cache (cache=None rasterises every polygon). shift moves every polygon by whole pixels (columns, rows).
+    """
+    geoms = [asShape(f['geometry']) for f in features]
+    zones = [emptyZone(percentiles, bins) for g in geoms]
+
+    if array.size == 0 or len(geoms) == 0:
+        return zones
+
+    valid = np.ones(array.shape, dtype=bool)
+    if nodata is not None:
+        valid &= array != nodata
+    if np.issubdtype(array.dtype, np.floating):
+        valid &= ~np.isnan(array)
+
+    # the polygons of a layer are at least a pixel apart
+    for layer in labelLayers(geoms, (abs(affine.a) + abs(affine.b), abs(affine.d) + abs(affine.e))):
+
+        labels = labelRaster(geoms, layer, array.shape, affine, all_touched, crs, cache, shift)
+
+        stats = labelStats(labels, array, valid, len(layer), percentiles, bins)
+
+        for n, i in enumerate(layer):
+            z = n + 1
+            count = int(stats['count'][z])
+            if count == 0:
+                continue
+
+            mean = stats['sum'][z] / count
+            zone = zones[i]
+            zone.update({'count': count, 'min': float(stats['min'][z]), 'max': float(stats['max'][z]),
+                         'mean': float(mean), 'median': float(stats['median'][z]),
+                         'std': float(math.sqrt(max(stats['sumsq'][z] / count - mean * mean, 0.0)))})
+
+            for q in (percentiles or []):
+                zone['p' + format(q, 'g')] = float(stats['p' + format(q, 'g')][z])
+            if 'hist' in stats:
+                zone['hist'] = [int(x) for x in stats['hist'][z]]
+
+    return zones
@@ -15,12 +15,25 @@ import pdb
 import fiona
 import rasterio
 import pandas as pd 
+import numpy as np
 import argparse
+import contextlib
 from rasterstats import zonal_stats 
+from rasterio.features import rasterize
 import sys
 import os
-import shutil
-import glob
+from run_report import report
+from job_profiler import JobProfiler
+import zonal_engine
+from convert_to_cog import preferCog
+
+
+# zonal stats engines, rasterstats masks one polygon at a time, label burns all the polygons into one label raster,
+# exact weights each pixel by the fraction of it covered by the polygon
+ENGINES = ['rasterstats', 'label', 'exact']
+
+# open the COG copy of a scene (convert_to_cog.py) in place of the scene when there is one
+USE_COG = True
 
 
 
@@ -30,7 +43,7 @@ def getCmdargs():
 
     p.add_argument("-i","--image", help="Input image to derive zonal stats from")
     
-    p.add_argument("-a","--alltouch", default=False, help="select either True of False, True will increase the number of pixels used to produce the stats False reduces the number (default is %(default)s))")
+    p.add_argument("-a","--alltouch", type=asBool, default=False, help="select either True of False, True will increase the number of pixels used to produce the stats False reduces the number (default is %(default)s))")
         
     p.add_argument("-n","--nodata",default=None, help="define the no data value for the input raster image, the default is none (default is %(default)s))")
     
@@ -39,6 +52,26 @@ def getCmdargs():
     p.add_argument("-u","--uid", help="input the column name for the unique id field in the shapefile") 
     
     p.add_argument("-o","--csv", help="name of the output csv file containing the results")
+
+    p.add_argument("-e","--engine", default="rasterstats", choices=ENGINES, help="zonal stats engine, rasterstats masks one polygon at a time, label derives the stats of all the polygons at once from a label raster, exact weights each pixel by the fraction the polygon covers and adds the covered area in pixels area_N (default is %(default)s)")
+
+    p.add_argument("--percentiles", default=None, help="comma separated list of percentiles to add to the stats e.g. 10,25,75,90 (default is %(default)s)")
+
+    p.add_argument("--bins", default=None, help="comma separated list of histogram bin edges to count the pixel values into e.g. 100,120,140,160,180,200 (default is %(default)s)")
+
+    p.add_argument("-b","--buffers", default=None, help="comma separated list of buffer distances in metres to add the stats of the buffered polygons for e.g. 30,60, a list starting with a negative (shrinking) distance needs the = form e.g. -b=-30,30,60 (default is %(default)s)")
+
+    p.add_argument("--shrink", default=None, help="comma separated list of distances in metres to shrink the polygons by and add the stats of, as --buffers with the negative distances e.g. 30 (default is %(default)s)")
+
+    p.add_argument("--rings", action="store_true", help="with --buffers derive the stats of the rings between the sorted buffer distances rather than of the whole buffered polygons")
+
+    p.add_argument("--shifts", type=int, default=0, help="add the spread of the band means of the polygons shifted by up to this many whole pixels in x and y e.g. 1 shifts by -1, 0 and 1 pixels, 0 does not shift (default is %(default)s)")
+
+    p.add_argument("--no-cog", action="store_true", help="read the image itself even if there is a COG copy of it made by convert_to_cog.py")
+
+    p.add_argument("-r","--report", default=None, help="name of the json or csv run report file containing the timing and I/O counts (default is %(default)s)")
+
+    p.add_argument("-p","--profile", action="store_true", help="profile the zonal stats with cProfile and save the profile next to the run report (or the output csv)")
     
     cmdargs = p.parse_args()
     
@@ -51,10 +84,206 @@ def getCmdargs():
     return cmdargs
 
 
-def applyZonalstats(image,param, nodata, band, shape): # uid):
+def asBool(value):
+    """
+    convert a command line or json value to a bool, the strings "False", "false", "0" and "no" are False
+    """
+    if isinstance(value, str):
+        return value.strip().lower() not in ('false', '0', 'no', 'n', '')
+    return bool(value)
+
+
+def parseList(text, dtype=float):
+    """
+    convert a comma separated command line argument to a list e.g. "10,25,75,90" returns None if the argument is not set
+    """
+    if text is None or str(text).strip() == '':
+        return None
+    return [dtype(x) for x in str(text).split(',') if x.strip() != '']
+
+
+def parseBuffers(buffers, shrink=None):
+    """
+    the buffer distances of the --buffers and --shrink arguments, the --shrink distances are given without a sign and
+    shrink the polygons e.g. "30,60" and "30" return [30, 60, -30]. None if neither is set.
+    """
+    distances = (parseList(buffers) or []) + [-abs(d) for d in (parseList(shrink) or [])]
+    return distances or None
+
+
+def sortedPercentile(values, q):
+    """
+    linearly interpolated percentile (numpy's default method) of an array that is already sorted
+    """
+    pos = (values.size - 1) * q / 100.0
+    lo = int(np.floor(pos))
+    hi = int(np.ceil(pos))
+    return float(values[lo] + (values[hi] - values[lo]) * (pos - lo))
+
+
+def distributionStats(masked, percentiles=None, bins=None):
+    """
+    derive the mean, std, median, min, max, percentiles and histogram counts of a zone from a single sort of the valid
+    (unmasked) pixels. The histogram counts the pixels falling in [edge, next edge), the last bin includes its upper edge.
+    """
+    percentiles = percentiles or []
+    bins = bins or []
+    values = np.sort(masked.compressed()).astype('float64')
+
+    if values.size == 0:
+        stats = {'mean': None, 'std': None, 'median': None, 'min': None, 'max': None}
+        stats.update(dict(('p' + format(q, 'g'), None) for q in percentiles))
+        hist = [0] * max(len(bins) - 1, 0)
+    else:
+        stats = {'mean': float(values.mean()), 'std': float(values.std()), 'median': sortedPercentile(values, 50),
+                 'min': float(values[0]), 'max': float(values[-1])}
+        stats.update(dict(('p' + format(q, 'g'), sortedPercentile(values, q)) for q in percentiles))
+
+        # the bin counts come from the positions of the bin edges in the sorted values
+        if len(bins) > 1:
+            edges = np.searchsorted(values, bins, side='left')
+            edges[-1] = np.searchsorted(values, bins[-1], side='right')
+            hist = [int(x) for x in np.diff(edges)]
+        else:
+            hist = []
+
+    stats['hist'] = hist
+
+    return stats
+
+
+def distributionHeaders(band, percentiles=None, bins=None):
+    """
+    headers of the percentile and histogram columns added for the band
+    """
+    percentiles = percentiles or []
+    bins = bins or []
+    headers = ['p' + format(q, 'g') + '_' + str(band) for q in percentiles]
+    headers += ['hist_' + format(lo, 'g') + '_' + format(hi, 'g') + '_' + str(band) for lo, hi in zip(bins[:-1], bins[1:])]
+    return headers
+
+
+def openImage(image, nodata, pool=None):
+    """
+    open the image (or its COG copy), if a dataset pool is given the pooled handle is returned in a context that leaves
+    it open
+    """
+    if USE_COG:
+        image = preferCog(image)
+
+    if pool is not None:
+        return contextlib.nullcontext(pool.open(image, nodata))
+
+    with report.stage('raster_open'):
+        srci = rasterio.open(image, nodata=nodata)
+    report.count('raster_open')
+
+    return srci
+
+
+def bandZonalstats(features, array, affine, crs, param, nodata, percentiles=None, bins=None, engine='rasterstats', shift=(0, 0)):
+    """
+    zonal stats of each polygon over a single band array (the whole band or a window of it with the given affine)
+    with the rasterstats or label engine, returns a list of zone result dictionaries in polygon order. shift moves the
+    polygons by whole pixels (columns, rows).
+    """
+    if engine == 'label':
+        return zonal_engine.labelZonalstats(features, array, affine, nodata, param, percentiles, bins, crs, shift=shift)
+
+    if engine == 'exact':
+        return zonal_engine.exactZonalstats(features, array, affine, nodata, percentiles, bins, crs, shift=shift)
+
+    if shift != (0, 0):
+        features = zonal_engine.shiftFeatures(features, shift, affine)
+
+    # rasterstats cannot rasterise an empty polygon (e.g. one shrunk away by a negative buffer), it has no pixels
+    if isinstance(features, list):
+        empty = [zonal_engine.asShape(f['geometry']).is_empty for f in features]
+        if any(empty):
+            zs = iter(bandZonalstats([f for f, e in zip(features, empty) if not e], array, affine, crs, param, nodata,
+                                     percentiles, bins, engine))
+            return [zonal_engine.emptyZone(percentiles, bins) if e else next(zs) for e in empty]
+
+    if percentiles or bins:
+        # only the pixel count is left to rasterstats, the other stats are derived from the sorted pixels
+        zs = zonal_stats(features, array, affine=affine,nodata=nodata,stats=['count'],all_touched=param,
+                         add_stats={'distribution': lambda masked: distributionStats(masked, percentiles, bins)})
+        for zone in zs:
+            zone.update(zone.pop('distribution'))
+        return zs
+
+    return zonal_stats(features, array, affine=affine,nodata=nodata,stats=['count', 'min', 'max', 'mean','median','std'],all_touched=param) # using "all_touched=True" will increase the number of pixels used to produce the stats "False" reduces the number
+
+
+def zoneResult(zone_stats, percentiles=None, bins=None):
+    """
+    the mean, std, median, min, max and count of a zone (followed by any percentiles and histogram counts, and the
+    covered area of the exact engine) as a list
+    """
+    count = zone_stats["count"]
+    mean = zone_stats["mean"]
+    Min = zone_stats["min"]
+    Max = zone_stats['max']
+    med = zone_stats['median']
+    std = zone_stats['std']
+
+    result = [mean,std, med, Min, Max, count]
+
+    # add the percentiles and histogram counts
+    if percentiles or bins:
+        result += [zone_stats['p' + format(q, 'g')] for q in (percentiles or [])]
+        result += zone_stats['hist']
+
+    if 'area' in zone_stats:
+        result.append(zone_stats['area'])
+
+    return result
+
+
+def siteDetails(table_attributes):
+    """
+    the field site attributes of a polygon written in front of the zonal stats of each band
+    """
+    uid = table_attributes['uid']
+    site = table_attributes['Site']
+    obs_time = table_attributes['Date']
+    long = table_attributes['C_Lon']
+    lat = table_attributes['C_Lat']
+    
+    fpc = table_attributes['FPC']
+    pers = table_attributes['PPC']
+    crn = table_attributes['CC'] 
+    
+    bgg = table_attributes['BG']
+    pvg = table_attributes['PVg'] 
+    npvg = table_attributes['NPVg']
+    pv = table_attributes['PV']          
+    npv = table_attributes['NPV']
+    bg = table_attributes['BG']
+    ba_t = table_attributes['ba_trees']
+    ba_s = table_attributes['ba_shrubs']
+    ba_t = table_attributes['ba_total'] 
+    #mid_b = table_attributes['mid_b']
+    
+    #over_g = table_attributes['over_g']
+    #over_d = table_attributes['over_d']
+    #over_b = table_attributes['over_b'] 
+    #num_pts = table_attributes['num_points'] 
+    #unoc = table_attributes['unoccluded'] 
+    #obs_key = table_attributes['obs_key'] 
+
+    #site = table_attributes[uid] # reads in the id field from the attribute table and prints out the selected record 
+    details = [uid, site, obs_time, long, lat, fpc, pers, crn, pvg, npvg, bgg, pv, npv, bg, ba_t, ba_s, ba_t]
+
+    return details
+
+
+def applyZonalstats(image,param, nodata, band, shape, percentiles=None, bins=None, engine='rasterstats', pool=None): # uid):
         
     """
-    function to derive zonal stats for a single or multi band raster image
+    function to derive zonal stats for a single or multi band raster image, if percentiles or histogram bins are given
+    they are added to the end of the results for each polygon and all of the stats come from one sort of the pixels.
+    The image is opened from the dataset pool if one is given.
     """    
     # create an empty lists to write the results 
             
@@ -63,71 +292,39 @@ def applyZonalstats(image,param, nodata, band, shape): # uid):
     image_Name = []
     nodata = nodata
     
-    with rasterio.open(image, nodata=nodata) as srci:
-        affine = srci.transform
-        array = srci.read(band)
-        
+    with openImage(image, nodata, pool) as srci:
         with fiona.open(shape) as src:
+
+            # the label and exact engines only read the window covering the union of the polygons
+            if engine != 'rasterstats':
+                features = list(src)
+                window = zonal_engine.unionWindow(srci, features)
+                affine = srci.window_transform(window)
+                with report.stage('raster_read'):
+                    array = srci.read(band, window=window)
+            else:
+                affine = srci.transform
+                with report.stage('raster_read'):
+                    array = srci.read(band)
+            report.addBytes(image, array.nbytes)
             
-            zs = zonal_stats(src, array, affine=affine,nodata=nodata,stats=['count', 'min', 'max', 'mean','median','std'],all_touched=param) # using "all_touched=True" will increase the number of pixels used to produce the stats "False" reduces the number
-                        
-            # extract the image name from the opened file from the input file read in by rasterio
-            imgName1 = str(srci)[:-11]
+            with report.stage('zonal_stats'):
+                zs = bandZonalstats(features if engine != 'rasterstats' else src, array, affine, srci.crs, param, nodata,
+                                    percentiles, bins, engine)
+
+            # extract the image name from the input file (rather than the COG copy that may have been opened)
+            imgName1 = str(image)
             imgName = imgName1[-43:] 
             imgDate = imgName[16:20]      
             #lztrme_p104r068_1987median_chm.img
 
             for zone in zs:
-                zone_stats = zone
-                count = zone_stats["count"]
-                mean = zone_stats["mean"]
-                Min = zone_stats["min"]
-                Max = zone_stats['max']
-                med = zone_stats['median']
-                std = zone_stats['std']
-
                 # put the individual results in a list and append them to the zonestats list
-                result = [mean,std, med, Min, Max, count]
-                zonestats.append(result)
-                            
+                zonestats.append(zoneResult(zone, percentiles, bins))
+
             # extract out the site number for the polygon
             for i in src:
-                table_attributes = i['properties'] # reads in the attribute table for each record 
-                        
-                uid = table_attributes['uid']
-                site = table_attributes['Site']
-                obs_time = table_attributes['Date']
-                long = table_attributes['C_Lon']
-                lat = table_attributes['C_Lat']
-                
-                fpc = table_attributes['FPC']
-                pers = table_attributes['PPC']
-                crn = table_attributes['CC'] 
-                
-                bgg = table_attributes['BG']
-                pvg = table_attributes['PVg'] 
-                npvg = table_attributes['NPVg']
-                pv = table_attributes['PV']          
-                npv = table_attributes['NPV']
-                bg = table_attributes['BG']
-                ba_t = table_attributes['ba_trees']
-                ba_s = table_attributes['ba_shrubs']
-                ba_t = table_attributes['ba_total'] 
-                #mid_b = table_attributes['mid_b']
-                
-                #over_g = table_attributes['over_g']
-                #over_d = table_attributes['over_d']
-                #over_b = table_attributes['over_b'] 
-                #num_pts = table_attributes['num_points'] 
-                #unoc = table_attributes['unoccluded'] 
-                #obs_key = table_attributes['obs_key'] 
-                         
-
-                
-                
-                #site = table_attributes[uid] # reads in the id field from the attribute table and prints out the selected record 
-                details = [uid, site, obs_time, long, lat, fpc, pers, crn, pvg, npvg, bgg, pv, npv, bg, ba_t, ba_s, ba_t]
-                siteID.append(details)
+                siteID.append(siteDetails(i['properties']))
                 
                 imageUsed = [imgName]
                 image_Name.append(imageUsed)
@@ -135,9 +332,8 @@ def applyZonalstats(image,param, nodata, band, shape): # uid):
         # join the elements in each of the lists row by row 
         finalresults =  [siteid + imU + zoneR for siteid, imU, zoneR in zip(siteID, image_Name, zonestats)]                     
         
-        # close the vector and raster file 
+        # close the vector file, the raster is closed on leaving the with block (or left open in the pool)
         src.close() 
-        srci.close() 
 
         # print out the file name of the processed image
         #print ((imgName1 + ' ' + 'band' + ' ' + str(band) + ' ' + 'is' + ' ' + 'complete')) 
@@ -145,6 +341,197 @@ def applyZonalstats(image,param, nodata, band, shape): # uid):
     return(finalresults)
 
 
+def bandHeaders(band, percentiles=None, bins=None, engine='rasterstats'):
+    """
+    headers identifying the band number being processed for the results of applyZonalstats
+    """
+    return ['uid', 'Site', 'obs_time', 'longitude', 'latitude', 'FPC', 'PPC','CC', 'PVg', 'NPVg', 'BGg','PV', 'NPV', 'BG', 'ba_trees','ba_shrubs','ba_total','imName'] + statHeaders(band, percentiles, bins, engine=engine)
+
+
+def statHeaders(band, percentiles=None, bins=None, tag='', engine='rasterstats'):
+    """
+    headers of the stats columns of the band, tag is added to the end of each e.g. '_b30' for the polygons buffered by
+    30 m. The exact engine adds the area in pixels the polygon covers (area_1).
+    """
+    headers = ['mean_'+ str(band),'std_'+ str(band), 'median_'+ str(band), 'Min_'+ str(band),'Max_'+ str(band), 'count_'+ str(band)] + distributionHeaders(band, percentiles, bins)
+    if engine == 'exact':
+        headers.append('area_' + str(band))
+    return [h + tag for h in headers]
+
+
+def imageZonalstats(image, param, nodata, shape, percentiles=None, bins=None, engine='rasterstats', pool=None, buffers=None, rings=False, shifts=0):
+    """
+    function to derive the zonal stats for every band of the image and join the band results into a single dataframe
+    with one row per polygon. If buffer distances or pixel shifts are given the window covering the largest buffer and
+    shift is read once and the stats of the buffered polygons (or rings) and the spread of the mean of the shifted
+    polygons are added (see windowZonalstats).
+    """
+    if buffers or shifts:
+        with fiona.open(shape) as src:
+            features = list(src)
+        window = readImageWindow(image, nodata, zonal_engine.outerFeatures(features, buffers), pool, (shifts or 0) + 1)
+        return windowZonalstats(window, features, param, nodata, percentiles, bins, engine, buffers, rings, shifts)
+
+    with openImage(image, nodata, pool) as srci:
+        bands = srci.indexes # this will return the number of spectral band for the input raster image as a tuple
+
+    band_results = []
+
+    for band in bands:
+
+        # run the zonal stats function 
+        finalresults = applyZonalstats(image, param, nodata, band, shape, percentiles, bins, engine, pool)
+
+        # convert the list to a pandas dataframe with a headers identifying the band number being processed
+        band_results.append(pd.DataFrame.from_records(finalresults, columns=bandHeaders(band, percentiles, bins, engine)))
+
+    with report.stage('concat_bands'):
+        concatenated_df = pd.concat(band_results, ignore_index=False, axis=1)
+        concatenated_df = concatenated_df.loc[:,~concatenated_df.columns.duplicated()]
+
+    return concatenated_df
+
+
+def shiftHeaders(band):
+    """
+    headers of the spread of the band mean across the shifted polygons
+    """
+    return ['mean_' + str(band) + '_shift_' + stat for stat in ['min', 'max', 'range', 'std']]
+
+
+def shiftSpread(means):
+    """
+    the min, max, range and (population) std of the mean of a zone across the shifts, None if the zone has no pixels
+    """
+    values = np.array([m for m in means if m is not None], dtype='float64')
+    if values.size == 0:
+        return [None, None, None, None]
+    return [float(values.min()), float(values.max()), float(values.max() - values.min()), float(values.std())]
+
+
+def readImageWindow(image, nodata, features, pool=None, pad=1):
+    """
+    read every band of the window covering the union of the polygons (plus pad pixels), returns a dictionary with the
+    band numbers, the (bands, rows, cols) array, its affine transform, crs and nodata and the image name used in the
+    results
+    """
+    with openImage(image, nodata, pool) as srci:
+        window = zonal_engine.unionWindow(srci, features, pad)
+        with report.stage('raster_read'):
+            array = srci.read(window=window)
+        report.addBytes(image, array.nbytes)
+
+        return {'bands': srci.indexes, 'array': array, 'affine': srci.window_transform(window), 'crs': srci.crs,
+                'nodata': srci.nodata, 'imgName': str(image)[-43:]}
+
+
+def validPixelCounts(window, features, band=1, all_touched=False, cache=None):
+    """
+    the number of valid (not nodata) pixels of a single band within each polygon, from a window read by
+    readImageWindow so the job's own read is used. The polygon masks come from the mask cache (zonal_engine.mask_cache).
+    Used to skip the (site, image) jobs where the site is masked (e.g. cloud or shadow in the zstdmask products) before
+    the stats are derived.
+    """
+    if cache is None:
+        cache = zonal_engine.mask_cache
+
+    array = window['array'][min(band, len(window['bands'])) - 1]
+    affine, nodata = window['affine'], window['nodata']
+
+    valid = np.isfinite(array) if array.dtype.kind == 'f' else np.ones(array.shape, bool)
+    if nodata is not None:
+        valid &= array != nodata
+
+    counts = []
+    for f in features:
+        geom = zonal_engine.asShape(f['geometry'])
+        if geom.is_empty or array.size == 0:
+            counts.append(0)
+            continue
+
+        if affine.b != 0 or affine.d != 0:
+            mask = rasterize([(geom, 1)], out_shape=array.shape, transform=affine, fill=0, all_touched=all_touched,
+                             dtype='uint8').astype(bool)
+            counts.append(int(np.count_nonzero(mask & valid)))
+            continue
+
+        # place the cached mask into the window by its pixel offset, clipped to the window
+        mask, x0, y0 = cache.get(geom, window['crs'], affine, all_touched)
+        col = int(round((x0 - affine.c) / affine.a))
+        row = int(round((y0 - affine.f) / affine.e))
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + mask.shape[0], array.shape[0]), min(col + mask.shape[1], array.shape[1])
+        if r1 <= r0 or c1 <= c0:
+            counts.append(0)
+            continue
+
+        counts.append(int(np.count_nonzero(mask[r0 - row:r1 - row, c0 - col:c1 - col] & valid[r0:r1, c0:c1])))
+
+    return counts
+
+
+def windowZonalstats(window, features, param, nodata, percentiles=None, bins=None, engine='rasterstats', buffers=None, rings=False, shifts=0):
+    """
+    derive the zonal stats for every band of a window read by readImageWindow, returns the same dataframe as
+    imageZonalstats. Nothing is read from the image so this can run while the next window is being read.
+
+    If buffer distances (map units) are given the stats of the polygons buffered by each distance, or with rings of the
+    rings between the distances, are added after the stats of each band with the columns tagged by the distance e.g.
+    mean_1_b30 or mean_1_r30_60 (zonal_engine.bufferTags). The window must cover the largest buffer.
+
+    If shifts is given the mean of each band is derived for the polygons moved by every whole pixel offset up to shifts
+    pixels in x and y (zonal_engine.shiftOffsets) and the min, max, range and std of the means across the shifts are
+    added e.g. mean_1_shift_range. The window must be padded by more than shifts pixels.
+    """
+    details = [siteDetails(f['properties']) + [window['imgName']] for f in features]
+    band_results = []
+
+    buffered = []
+    if buffers:
+        buffered = list(zip(zonal_engine.bufferTags(buffers, rings), zonal_engine.bufferFeatures(features, buffers, rings)))
+
+    for n, band in enumerate(window['bands']):
+
+        with report.stage('zonal_stats'):
+            zs = bandZonalstats(features, window['array'][n], window['affine'], window['crs'], param, nodata,
+                                percentiles, bins, engine)
+
+        finalresults = [d + zoneResult(zone, percentiles, bins) for d, zone in zip(details, zs)]
+        headers = bandHeaders(band, percentiles, bins, engine)
+        zs_base = zs
+
+        # the buffered polygons use the same window
+        for tag, buffer_features in buffered:
+            with report.stage('zonal_stats_buffers'):
+                zs = bandZonalstats(buffer_features, window['array'][n], window['affine'], window['crs'], param, nodata,
+                                    percentiles, bins, engine)
+            finalresults = [r + zoneResult(zone, percentiles, bins) for r, zone in zip(finalresults, zs)]
+            headers += statHeaders(band, percentiles, bins, tag, engine)
+
+        # the polygons moved by whole pixels use the same window, the unshifted means are the ones above
+        if shifts:
+            means = []
+            for shift in zonal_engine.shiftOffsets(shifts):
+                if shift == (0, 0):
+                    means.append([zone['mean'] for zone in zs_base])
+                    continue
+                with report.stage('zonal_stats_shifts'):
+                    zs = bandZonalstats(features, window['array'][n], window['affine'], window['crs'], param, nodata,
+                                        engine=engine, shift=shift)
+                means.append([zone['mean'] for zone in zs])
+
+            finalresults = [r + shiftSpread(m) for r, m in zip(finalresults, zip(*means))]
+            headers += shiftHeaders(band)
+
+        band_results.append(pd.DataFrame.from_records(finalresults, columns=headers))
+
+    with report.stage('concat_bands'):
+        concatenated_df = pd.concat(band_results, ignore_index=False, axis=1)
+        concatenated_df = concatenated_df.loc[:,~concatenated_df.columns.duplicated()]
+
+    return concatenated_df
+
+
 def mainRoutine():
         
     # read in the command arguments
@@ -155,60 +542,34 @@ def mainRoutine():
     shape = cmdargs.shape 
     #uid = cmdargs.uid
     export_csv = cmdargs.csv
-    
-    # make a temp dir to save the individual band results 
-    
-    # make a temp dir to save the individual band results 
-    tempIDir = './temp_individual_bands'
-    
-    # check if the temp dir exists and if it does remove it, otherwise create the new dir for the individual outputs
-    check_if_dir_exists = os.path.isdir(tempIDir)
-    if check_if_dir_exists == True:
-        shutil.rmtree(tempIDir)
-    else:    
-        os.makedirs(tempIDir)
-        
-    with rasterio.open(image, nodata=nodata) as srci:
-        
-        bands = srci.indexes # this will return the number of spectral band for the input raster image as a tuple
-        num_bands = len(bands)
-    
-    for band in bands:
-        
-        # creates the individual band csv file name
-        bandResults = 'band_'+str(band)+'.csv'
+    percentiles = parseList(cmdargs.percentiles)
+    bins = parseList(cmdargs.bins)
+    buffers = parseBuffers(cmdargs.buffers, cmdargs.shrink)
+
+    report.info['image'] = image
+
+    global USE_COG
+    USE_COG = not cmdargs.no_cog
+
+    # derive the zonal stats for each band and join the band results to a single dataframe
+    if cmdargs.profile:
+        profiler = JobProfiler(os.path.splitext(cmdargs.report or export_csv)[0] + '_profiles')
+        with fiona.open(shape) as src:
+            sites = len(src)
+        with report.stage('zonal_job', job=image), profiler.profile(image, sites):
+            concatenated_df = imageZonalstats(image, param, nodata, shape, percentiles, bins, cmdargs.engine, None, buffers, cmdargs.rings, cmdargs.shifts)
+        profiler.finish()
+    else:
+        with report.stage('zonal_job', job=image):
+            concatenated_df = imageZonalstats(image, param, nodata, shape, percentiles, bins, cmdargs.engine, None, buffers, cmdargs.rings, cmdargs.shifts)
 
-        # run the zonal stats function 
-        finalresults = applyZonalstats(image, param, nodata, band,shape) #, uid)
-        
-        # write out the individual band results to a list
-        
-        outputlist = []
-        
-        for i in finalresults:
-        
-            outputlist.append(i)    
-        
-        # convert the list to a pandas dataframe with a headers identifying the band number being processed
-        headers = ['uid', 'Site', 'obs_time', 'longitude', 'latitude', 'FPC', 'PPC','CC', 'PVg', 'NPVg', 'BGg','PV', 'NPV', 'BG', 'ba_trees','ba_shrubs','ba_total','imName','mean_'+ str(band),'std_'+ str(band), 'median_'+ str(band), 'Min_'+ str(band),'Max_'+ str(band), 'count_'+ str(band)]
-                                  
-        output  = pd.DataFrame.from_records(outputlist,columns=headers)
-              
-        output.to_csv(tempIDir + '/'+ bandResults,index=False)
-          
-    
-    # read in the individual band results and concatenate them to a single dataframe
-    all_files = glob.glob(os.path.join(tempIDir, "*.csv"))     # advisable to use os.path.join as this makes concatenation OS independent
-    
-    df_from_each_file = (pd.read_csv(f) for f in all_files)
-    concatenated_df   = pd.concat(df_from_each_file,ignore_index=False, axis=1)
     # export the results to a csv file
-    concatenated_df = concatenated_df.loc[:,~concatenated_df.columns.duplicated()]
-    concatenated_df.to_csv(export_csv) 
-    
-    # remove the temp dir and single band csv files
-    shutil.rmtree(tempIDir)
+    with report.stage('write_csv'):
+        concatenated_df.to_csv(export_csv) 
+
+    if cmdargs.report is not None:
+        report.write(cmdargs.report)
     
     
 if __name__ == "__main__":
-    mainRoutine()   
\ No newline at end of file
+    mainRoutine()   
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+"""
+Long lived zonal stats worker. Running zonal_stats_single_cal_val_local.py once per image pays the rasterio/fiona/GDAL
+import and driver registration cost on every call. The worker is started once and reads json lines job requests from
+stdin (or a local unix socket), keeps GDAL initialised and a pool of open datasets (dataset_pool.py) and streams a json
+line result back for each request.
+
+Request (one json object per line):
+    {"id": 1, "image": "Z:/Landsat/wrs2/.../l8olre_p104r070_20180725_dilm3_zstdmask.img", "shape": "site.shp",
+     "nodata": 0, "alltouch": false, "engine": "label", "percentiles": [10, 90], "bins": null, "buffers": [30, 60],
+     "rings": false, "shifts": 1, "csv": null}
+
+    only image and shape are required, if csv is given the results are written to it rather than returned. The
+    buffers are distances in metres, negative distances shrink the polygons e.g. [-30, 30, 60].
+    {"op": "ping"}, {"op": "report"} (the run report so far) and {"op": "shutdown"} are also accepted.
+
+Response (one json object per line):
+    {"id": 1, "status": "ok", "seconds": 0.05, "columns": [...], "records": [{...}, ...]}
+    {"id": 1, "status": "error", "error": "..."}
+
+From a notebook or script use ZonalWorkerClient, which starts the worker as a subprocess (or connects to a running
+worker's socket):
+
+    with ZonalWorkerClient() as client:
+        result = client.submit(image=img, shape=shp, nodata=0)
+        df = pd.DataFrame(result['records'], columns=result['columns'])
+
+
+Modified Date: 19/10/2026
+
+"""
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import socketserver
+import pandas as pd
+from zonal_stats_single_cal_val_local import imageZonalstats, asBool, ENGINES
+from dataset_pool import DatasetPool
+from run_report import report
+
+
+def getCmdargs():
+
+    p = argparse.ArgumentParser(description="""Long lived zonal stats worker reading json lines job requests on stdin (or a unix socket) and writing a json line result for each.""")
+
+    p.add_argument("-s","--socket", default=None, help="path of a unix socket to listen on rather than reading from stdin (default is %(default)s)")
+
+    p.add_argument("-m","--max-open", type=int, default=16, help="maximum number of datasets kept open (default is %(default)s)")
+
+    cmdargs = p.parse_args()
+
+    return cmdargs
+
+
+def dfRecords(df):
+    """
+    convert a dataframe to a list of json serialisable records with missing values as null
+    """
+    return json.loads(df.to_json(orient='records'))
+
+
+def handleRequest(request, pool):
+    """
+    run a single request and return the response dictionary, the second value is True when the worker should stop
+    """
+    op = request.get('op', 'zonal')
+    response = {'id': request.get('id')}
+
+    if op == 'ping':
+        response.update({'status': 'ok', 'pid': os.getpid(), 'open_datasets': len(pool)})
+        return response, False
+
+    if op == 'report':
+        response.update({'status': 'ok', 'report': report.summary()})
+        return response, False
+
+    if op == 'shutdown':
+        response['status'] = 'ok'
+        return response, True
+
+    start = time.perf_counter()
+    try:
+        engine = request.get('engine', 'rasterstats')
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: %s' % engine)
+
+        with report.stage('zonal_job', job=request['image']):
+            df = imageZonalstats(request['image'], asBool(request.get('alltouch', False)), request.get('nodata'),
+                                 request['shape'], request.get('percentiles'), request.get('bins'), engine, pool,
+                                 request.get('buffers'), asBool(request.get('rings', False)), int(request.get('shifts', 0)))
+
+        if request.get('csv'):
+            df.to_csv(request['csv'])
+            response['csv'] = request['csv']
+        else:
+            response.update({'columns': list(df.columns), 'records': dfRecords(df)})
+        response['status'] = 'ok'
+
+    except Exception as err:
+        report.count('worker_errors')
+        response.update({'status': 'error', 'error': repr(err)})
+
+    response['seconds'] = time.perf_counter() - start
+    return response, False
+
+
+def serveLines(lines, write, pool):
+    """
+    read requests from an iterable of json lines and write a response line for each, returns True if shutdown was
+    requested
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            write(json.dumps({'status': 'error', 'error': 'invalid json: %s' % err}) + '\n')
+            continue
+
+        response, stop = handleRequest(request, pool)
+        write(json.dumps(response, default=str) + '\n')
+        if stop:
+            return True
+
+    return False
+
+
+def serveSocket(path, pool):
+    """
+    listen on a unix socket, each connection can send any number of requests. Connections are served one at a time
+    as the GDAL dataset handles in the pool are not thread safe.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        print ('unix sockets are not available on this platform, use stdin/stdout')
+        sys.exit(1)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            def write(text):
+                self.wfile.write(text.encode('utf-8'))
+                self.wfile.flush()
+
+            if serveLines(self.rfile, write, pool):
+                self.server.stop = True
+
+    server = socketserver.UnixStreamServer(path, Handler)
+    server.stop = False
+    print ('zonal worker listening on: ', path)
+
+    try:
+        while not server.stop:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+class ZonalWorkerClient(object):
+    """
+    submit jobs to a zonal worker, either one started as a subprocess (socket=None) or one listening on a unix socket
+    """
+
+    def __init__(self, socket_path=None, max_open=16, python=sys.executable):
+        self.process = None
+        self.sock = None
+        self.next_id = 0
+
+        if socket_path is None:
+            script = os.path.abspath(__file__)
+            self.process = subprocess.Popen([python, script, '--max-open', str(max_open)], stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+            self.reader = self.process.stdout
+            self.writer = self.process.stdin
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+            self.reader = self.sock.makefile('r')
+            self.writer = self.sock.makefile('w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, request):
+        """
+        send a request and wait for its response
+        """
+        self.writer.write(json.dumps(request) + '\n')
+        self.writer.flush()
+        line = self.reader.readline()
+        if not line:
+            raise RuntimeError('zonal worker closed the connection')
+        return json.loads(line)
+
+    def submit(self, **job):
+        """
+        run a zonal stats job e.g. submit(image=img, shape=shp, nodata=0, engine='label')
+        """
+        self.next_id += 1
+        job.setdefault('id', self.next_id)
+        return self.request(job)
+
+    def dataframe(self, **job):
+        """
+        run a zonal stats job and return the results as a dataframe, raises RuntimeError if the job failed
+        """
+        response = self.submit(**job)
+        if response['status'] != 'ok':
+            raise RuntimeError(response['error'])
+        return pd.DataFrame(response['records'], columns=response['columns'])
+
+    def close(self):
+        """
+        stop the worker subprocess or disconnect from the socket
+        """
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.request({'op': 'shutdown'})
+                self.writer.close()
+                self.process.wait()
+            self.process = None
+        if self.sock is not None:
+            self.reader.close()
+            self.writer.close()
+            self.sock.close()
+            self.sock = None
+
+
+def mainRoutine():
+
+    cmdargs = getCmdargs()
+
+    with DatasetPool(cmdargs.max_open) as pool:
+        if cmdargs.socket is not None:
+            serveSocket(cmdargs.socket, pool)
+        else:
+            # responses are the only thing written to stdout, anything else printed goes to stderr
+            stdout = sys.stdout
+            sys.stdout = sys.stderr
+
+            def write(text):
+                stdout.write(text)
+                stdout.flush()
+
+            serveLines(sys.stdin, write, pool)
+
+
+if __name__ == "__main__":
+    mainRoutine()